@@ -0,0 +1,61 @@
+import json
+from typing import NamedTuple
+
+from prometheus_client import CollectorRegistry
+
+from airthings.MetricsCache import MetricsCache
+
+
+class Account(NamedTuple):
+    name: str
+    collector: object  # CloudCollector
+    metrics_cache: MetricsCache
+
+
+def load_accounts_config(path):
+    """Read an accounts file and return a dict of account name to settings.
+
+    The file is JSON of the form::
+
+        {"accounts": {"building-a": {"client_id": "...", "client_secret": "...",
+                                     "device_ids": ["..."], "discover": false}}}
+    """
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+
+    accounts = config.get("accounts") if isinstance(config, dict) else None
+    if not isinstance(accounts, dict) or not accounts:
+        raise ValueError(f"{path}: expected an 'accounts' object with at least one account")
+    for name, settings in accounts.items():
+        missing = [key for key in ("client_id", "client_secret") if not settings.get(key)]
+        if missing:
+            raise ValueError(f"{path}: account '{name}' is missing {', '.join(missing)}")
+    return accounts
+
+
+class Accounts:
+    """Collectors for several Airthings accounts, served through /probe.
+
+    Every account gets its own collector and with it its own token cache,
+    connection pool, rate limit state and snapshot, so a throttled account
+    never holds up the others. Each collector is registered in a registry of
+    its own, so a probe only renders the metrics of that account.
+    """
+
+    def __init__(self, config, create_collector):
+        self._accounts = {}
+        for name, settings in config.items():
+            collector = create_collector(settings)
+            registry = CollectorRegistry(auto_describe=False)
+            registry.register(collector)
+            self._accounts[name] = Account(name, collector, MetricsCache(registry, collector))
+
+    def get(self, name):
+        """Return the account with the given name, or None."""
+        return self._accounts.get(name)
+
+    def __iter__(self):
+        return iter(self._accounts.values())
+
+    def __len__(self):
+        return len(self._accounts)
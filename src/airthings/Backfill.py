@@ -0,0 +1,199 @@
+import contextlib
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from airthings.CloudCollector import RateLimitException
+from airthings.Exposition import escape_label_value, format_header, format_value
+from airthings.StateStore import StateStore
+
+logger = logging.getLogger(__name__)
+
+
+def history_rows(data):
+    """Turn a page of columnar history (a list per field) into one dict per sample."""
+    fields = list(data.items())
+    for i in range(len(data.get("time") or ())):
+        yield {key: values[i] for key, values in fields if i < len(values)}
+
+
+class Backfill:  # pylint: disable=too-many-instance-attributes
+    """Page through the sample history of devices and write it as OpenMetrics.
+
+    Samples are streamed page by page into one spool file per metric
+    family next to ``output``, so the range is never held in memory. Once
+    every device is done the spools are joined into ``output`` with the
+    headers and ``# EOF`` that ``promtool tsdb create-blocks-from
+    openmetrics`` expects.
+
+    After every page the spools are flushed and a checkpoint with each
+    device's cursor and each spool's size is saved. A rerun with the same
+    range continues from there, cutting off anything written after the
+    last checkpoint.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self, collector, output, *, start, end, sleep=time.sleep, clock=time.time
+    ):
+        self.collector = collector
+        self.output = output
+        self.start = int(start)
+        self.end = int(end)
+        self.sleep = sleep
+        self.clock = clock
+        self.spool_dir = f"{output}.spool"
+        self.checkpoint = StateStore(f"{output}.checkpoint")
+        self.samples_written = 0
+        self._spools = {}  # metric_name -> open spool file
+        self._families = {}  # metric_name -> (documentation, unit)
+        self._devices = {}  # device_id -> {"cursor": ..., "done": ...}
+        self._labels = {}
+
+    def run(self, device_ids):
+        """Backfill the given devices and return the path of the written file."""
+        self.__resume__()
+        try:
+            for device_id in device_ids:
+                progress = self._devices.setdefault(device_id, {"cursor": None, "done": False})
+                if progress["done"]:
+                    continue
+                logger.info("⏪ Backfilling device %s", device_id)
+                for page in self.__pages__(device_id, progress):
+                    self.__write_rows__(device_id, history_rows(page))
+                    self.__save_checkpoint__()
+                progress["done"] = True
+                self.__save_checkpoint__()
+        finally:
+            self.__close_spools__()
+
+        self.__assemble__()
+        logger.info("✅ Wrote %d sample(s) to %s", self.samples_written, self.output)
+        return self.output
+
+    def __pages__(self, device_id, progress):
+        """Yield the ``data`` of each history page, advancing ``progress["cursor"]``."""
+        while True:
+            self.__wait_for_budget__()
+            try:
+                response = self.collector.get_sample_history(
+                    device_id, self.start, self.end, progress["cursor"]
+                )
+            except RateLimitException as e:
+                logger.warning("⏳ Rate limited, resuming backfill at %s", e.retry_after_time)
+                self.sleep(max(1, e.retry_after_seconds))
+                continue
+            finally:
+                self.collector.budget.record_cycle(1)
+
+            progress["cursor"] = response.get("cursor")
+            yield response.get("data") or {}
+            if not progress["cursor"]:
+                return
+
+    def __wait_for_budget__(self):
+        """Sleep while the request budget holds back requests."""
+        budget = self.collector.budget
+        while budget.plan(1) == 0:
+            now = self.clock()
+            resume_at = budget.next_poll_at if now < budget.next_poll_at else budget.reset_at
+            delay = max(1, (resume_at or now) - now)
+            logger.info("📉 Waiting %.0fs for the API budget", delay)
+            self.sleep(delay)
+
+    def __write_rows__(self, device_id, rows):
+        lookup = self.collector.sensor_map.lookup
+        labels = self._labels.get(device_id)
+        if labels is None:
+            labels = self._labels[device_id] = f'{{device_id="{escape_label_value(device_id)}"}}'
+        for row in rows:
+            timestamp = row.get("time")
+            if not isinstance(timestamp, (int, float)):
+                continue
+            for key, value in row.items():
+                sensor = lookup(key, value)
+                if sensor is None or value is None:
+                    continue
+                spool = self.__spool__(sensor.metric_name)
+                self._families[sensor.metric_name] = (sensor.documentation, sensor.unit)
+                spool.write(
+                    f"{sensor.metric_name}{labels} "
+                    f"{format_value(sensor.convert(value))} {timestamp}\n"
+                )
+                self.samples_written += 1
+
+    def __spool__(self, metric_name):
+        spool = self._spools.get(metric_name)
+        if spool is None:
+            path = os.path.join(self.spool_dir, metric_name)
+            # Closed by __close_spools__ once the run ends
+            spool = open(path, "a", encoding="utf-8")  # pylint: disable=consider-using-with
+            self._spools[metric_name] = spool
+        return spool
+
+    def __resume__(self):
+        os.makedirs(self.spool_dir, exist_ok=True)
+        state = self.checkpoint.load()
+        if state is not None and (state.get("start"), state.get("end")) != (self.start, self.end):
+            logger.warning("⚠️ Checkpoint is for a different range, starting over")
+            state = None
+        state = state or {}
+
+        self._devices = state.get("devices", {})
+        self._families = {name: tuple(family) for name, family in state.get("families", {}).items()}
+        self.samples_written = state.get("samples_written", 0)
+        # Drop whatever was spooled after the last checkpoint
+        sizes = state.get("spools", {})
+        for name in os.listdir(self.spool_dir):
+            with open(os.path.join(self.spool_dir, name), "r+b") as f:
+                f.truncate(sizes.get(name, 0))
+        if self._devices:
+            done = sum(progress["done"] for progress in self._devices.values())
+            logger.info("💾 Resuming backfill, %d device(s) already done", done)
+
+    def __save_checkpoint__(self):
+        sizes = {}
+        for name, spool in self._spools.items():
+            spool.flush()
+            os.fsync(spool.fileno())
+            sizes[name] = spool.tell()
+        for name in os.listdir(self.spool_dir):
+            sizes.setdefault(name, os.path.getsize(os.path.join(self.spool_dir, name)))
+        self.checkpoint.save(
+            {
+                "start": self.start,
+                "end": self.end,
+                "devices": self._devices,
+                "families": self._families,
+                "spools": sizes,
+                "samples_written": self.samples_written,
+            }
+        )
+
+    def __close_spools__(self):
+        for spool in self._spools.values():
+            spool.close()
+        self._spools = {}
+
+    def __assemble__(self):
+        """Join the spools into the output file and remove the spools and checkpoint."""
+        directory = os.path.dirname(os.path.abspath(self.output))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".airthings-backfill-")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as out:
+                for name, (documentation, unit) in sorted(self._families.items()):
+                    path = os.path.join(self.spool_dir, name)
+                    if not os.path.getsize(path):
+                        continue
+                    out.write(format_header(name, documentation, unit, openmetrics=True))
+                    with open(path, encoding="utf-8") as spool:
+                        shutil.copyfileobj(spool, out)
+                out.write("# EOF\n")
+            os.replace(tmp_path, self.output)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        shutil.rmtree(self.spool_dir)
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.checkpoint.path)
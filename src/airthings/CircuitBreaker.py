@@ -0,0 +1,69 @@
+import threading
+import time
+
+# Consecutive failures after which a device is skipped
+DEFAULT_FAILURE_THRESHOLD = 3
+
+# How long a failing device is skipped before it is tried again (in seconds)
+DEFAULT_COOLDOWN = 300
+
+
+class _Circuit:
+    __slots__ = ("failures", "open_until")
+
+    def __init__(self):
+        self.failures = 0
+        self.open_until = None
+
+
+class CircuitBreaker:
+    """Skip fetches that keep failing for a cool-down period.
+
+    After ``failure_threshold`` consecutive failures of a key its circuit
+    opens and ``allow()`` returns False until ``cooldown`` seconds have
+    passed. Then a single trial fetch is let through: success closes the
+    circuit, failure opens it for another cool-down.
+    """
+
+    def __init__(
+        self,
+        failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+        cooldown=DEFAULT_COOLDOWN,
+        clock=time.monotonic,
+    ):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self._circuits = {}
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        with self._lock:
+            circuit = self._circuits.get(key)
+            if circuit is None or circuit.open_until is None:
+                return True
+            if self.clock() < circuit.open_until:
+                return False
+            # Half-open: hold off other callers while the trial fetch runs
+            circuit.open_until = self.clock() + self.cooldown
+            return True
+
+    def record_success(self, key):
+        with self._lock:
+            self._circuits.pop(key, None)
+
+    def record_failure(self, key):
+        """Count a failure; returns True if it opened the circuit."""
+        with self._lock:
+            circuit = self._circuits.setdefault(key, _Circuit())
+            circuit.failures += 1
+            if circuit.failures >= self.failure_threshold:
+                opened = circuit.open_until is None
+                circuit.open_until = self.clock() + self.cooldown
+                return opened
+            return False
+
+    def open_circuits(self):
+        """Return the keys whose circuit is currently open."""
+        with self._lock:
+            return [key for key, c in self._circuits.items() if c.open_until is not None]
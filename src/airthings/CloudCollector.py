@@ -1,32 +1,182 @@
 import logging
-from datetime import datetime, timedelta, timezone
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import partial
+from typing import Callable, NamedTuple, Tuple
+from urllib.parse import urlencode
 
 import requests
-from prometheus_client.metrics_core import GaugeMetricFamily
+from prometheus_client.metrics_core import (
+    CounterMetricFamily,
+    GaugeMetricFamily,
+    InfoMetricFamily,
+)
 from prometheus_client.registry import Collector
 
+from airthings.CircuitBreaker import CircuitBreaker
+from airthings.DeviceDirectory import DEFAULT_DISCOVERY_TTL, DeviceDirectory
+from airthings.Exposition import ExpositionRenderer
+from airthings.Instrumentation import (
+    API_REQUEST_DURATION,
+    FETCH_RETRIES,
+    POLL_DURATION,
+    RATE_LIMIT_EVENTS,
+    CountingHTTPAdapter,
+    connection_stats,
+    endpoint_name,
+)
+from airthings.MetricsSlice import ShardIndex
+from airthings.RateLimitBudget import RateLimitBudget, format_duration, parse_rate_limit
+from airthings.Retry import call_with_retries
+from airthings.RollingAggregates import DEFAULT_BUCKETS, RollingAggregates
+from airthings.SampleSchedule import SampleSchedule
+from airthings.Sensors import SensorMap
+from airthings.SingleFlight import SingleFlight
+from airthings.Snapshot import EMPTY_SNAPSHOT, DeviceReading, Snapshot
+from airthings.TokenManager import DEFAULT_TOKEN_LIFETIME, TokenManager
+
+API_URL = "https://ext-api.airthings.com/v1"
+TOKEN_URL = "https://accounts-api.airthings.com/v1/token"
+
 # Timeout for API requests (in seconds)
 REQUEST_TIMEOUT = 30
 
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+# Timeout for establishing a connection to the API (in seconds)
+CONNECT_TIMEOUT = 10
+
+# Number of devices fetched concurrently
+DEFAULT_MAX_WORKERS = 8
+
+# Overall deadline for fetching all devices of one poll (in seconds)
+DEFAULT_SCRAPE_TIMEOUT = 25
+
+# Deadline for fetching one device or location, including retries (in seconds)
+DEFAULT_DEVICE_TIMEOUT = 10
+
+# Polls starting within this many seconds of the last one reuse its result
+DEFAULT_COALESCE_WINDOW = 5
+
 logger = logging.getLogger(__name__)
 
 
 class RateLimitException(Exception):
-    """Custom exception for rate limiting with retry information."""
+    """Custom exception for rate limiting with retry information.
+
+    ``fetched`` holds the readings fetched before the rate limit hit.
+    """
 
     def __init__(self, retry_after_seconds, retry_after_time):
         self.retry_after_seconds = retry_after_seconds
         self.retry_after_time = retry_after_time
+        self.fetched = {}
         super().__init__(f"Rate limited until {retry_after_time}")
 
 
-class CloudCollector(Collector):
-    def __init__(self, client_id, client_secret, device_id_list):
+def _api_time(timestamp):
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class FetchTask(NamedTuple):
+    """One API request of a poll and the devices it is expected to return."""
+
+    key: str  # e.g. "device 123" or "location abc"
+    endpoint: str
+    device_ids: Tuple[str, ...]
+    fetch: Callable  # Returns a dict of device_id to sensor data
+
+
+class CloudCollector(Collector):  # pylint: disable=too-many-instance-attributes
+    def __init__(  # pylint: disable=too-many-arguments,too-many-locals
+        self,
+        client_id,
+        client_secret,
+        device_id_list,
+        *,
+        poll_on_collect=True,
+        max_workers=DEFAULT_MAX_WORKERS,
+        scrape_timeout=DEFAULT_SCRAPE_TIMEOUT,
+        device_timeout=DEFAULT_DEVICE_TIMEOUT,
+        session=None,
+        connect_timeout=CONNECT_TIMEOUT,
+        read_timeout=REQUEST_TIMEOUT,
+        discover=False,
+        discovery_ttl=DEFAULT_DISCOVERY_TTL,
+        coalesce_window=DEFAULT_COALESCE_WINDOW,
+        generic_sensors=False,
+        sensor_allow=None,
+        sensor_deny=None,
+        api_url=API_URL,
+        token_url=TOKEN_URL,
+        state_store=None,
+        adaptive=False,
+        sample_timestamps=False,
+        aggregate_windows=(),
+        aggregate_buckets=DEFAULT_BUCKETS,
+        device_metadata=False,
+        device_labels=False,
+    ):
         self.client_id = client_id
         self.client_secret = client_secret
-        self.device_id_list = device_id_list
+        self.api_url = api_url.rstrip("/")
+        self.token_url = token_url
+        self.device_id_list = device_id_list or []
+        # When False, a background Poller refreshes the snapshot and collect() only reads it
+        self.poll_on_collect = poll_on_collect
+        self.max_workers = max_workers
+        self.scrape_timeout = scrape_timeout
+        self.device_timeout = device_timeout
+        # Failing devices are retried within their deadline, then skipped for a while
+        self.breaker = CircuitBreaker()
+        self.device_up = {}
+        self._fetch_deadline = threading.local()
+        self._executor = None
+        # Any object with requests.Session's get/post interface can be passed in
+        self.session = session if session is not None else self.__create_session__()
+        self.timeout = (connect_timeout, read_timeout)
+        # With discovery, devices and locations come from the account and are
+        # fetched with one request per location
+        self.discover = discover
+        self.directory = DeviceDirectory(self.__api_get__, discovery_ttl)
+        self.budget = RateLimitBudget()
+        self._rotation = 0
+        self._single_flight = SingleFlight(coalesce_window)
+        # Device names, models and locations from the account, refreshed like discovery
+        self.device_metadata = device_metadata or device_labels
+        # Attach the device's name and location to its sensor samples
+        self.device_labels = device_labels
+        self._label_sets = {}
+        self._labels_generation = 0
+        self.sensor_map = SensorMap(generic=generic_sensors, allow=sensor_allow, deny=sensor_deny)
+        self.renderer = ExpositionRenderer(self.sensor_map, self.__label_set__)
+        # Set while MetricsCache renders the per-device families itself
+        self._streaming = threading.local()
+        # Devices of each shard of /metrics?shard=i/n
+        self.shard_index = ShardIndex()
+        # With adaptive polling a device is only fetched once a new sample is expected
+        self.adaptive = adaptive
+        self.schedule = SampleSchedule()
+        self.skipped_fetches = 0
+        # Export samples with the time the device took them instead of the scrape time
+        self.sample_timestamps = sample_timestamps
+        self._labels = {}
+        # Rolling min/max/mean per device and sensor over each window (in seconds)
+        self.aggregates = (
+            RollingAggregates(aggregate_windows, aggregate_buckets) if aggregate_windows else None
+        )
+        self.fetch_durations = {}  # Duration of the last successful request per device
         self.rate_limit_until = None  # Track when rate limit expires
+        self.token_manager = TokenManager(self.__request_access_token__)
+        self.snapshot = EMPTY_SNAPSHOT
+        self._snapshot_lock = threading.Lock()
+        # Optional StateStore; state is saved after every poll that changed it
+        self.state_store = state_store
+        self._saved_state_key = None
+        # Called with (collector, readings) after every poll that fetched readings
+        self._listeners = []
 
     def describe(self):
         """Return metric descriptors without making API calls.
@@ -38,104 +188,681 @@ class CloudCollector(Collector):
         return []
 
     def collect(self):
-        # Check if we're still rate limited
-        if self.rate_limit_until:
-            now = datetime.now(timezone.utc)
-            if now < self.rate_limit_until:
-                time_remaining = self.rate_limit_until - now
-                seconds = int(time_remaining.total_seconds())
-
-                # Format time remaining in human-readable form
-                if seconds >= 3600:
-                    hours = seconds // 3600
-                    minutes = (seconds % 3600) // 60
-                    time_str = f"{hours}h {minutes}m"
-                elif seconds >= 60:
-                    minutes = seconds // 60
-                    secs = seconds % 60
-                    time_str = f"{minutes}m {secs}s"
-                else:
-                    time_str = f"{seconds}s"
+        if self.poll_on_collect and getattr(self._streaming, "poll", True):
+            self.poll(coalesce=True)
+        self.__sync_labels__()
+
+        if not getattr(self._streaming, "active", False):
+            yield from self.__collect_device_metrics__(self.snapshot)
+        yield from self.__collect_info_metrics__()
+        yield from self.__collect_token_metrics__()
+        yield from self.__collect_connection_metrics__()
+        yield from self.__collect_budget_metrics__()
+        yield from self.__collect_fetch_metrics__()
+        yield CounterMetricFamily(
+            "airthings_exporter_coalesced_polls",
+            "Polls that shared the result of an overlapping or recent poll",
+            value=self._single_flight.coalesced,
+        )
 
-                logger.warning(
-                    "⏳ Rate limited. Retry after: %s (in %s)",
-                    self.rate_limit_until.strftime("%Y-%m-%d %H:%M:%S %Z"),
-                    time_str,
-                )
-                # Don't raise exception - just return empty metrics
-                # This allows Prometheus default metrics to still be returned
-                yield GaugeMetricFamily("airthings_gauge", "Airthings sensor values")
-                return
+    @contextmanager
+    def streaming(self, poll=True):
+        """Leave the per-device families out of ``collect()`` on this thread.
 
-            logger.info("✅ Rate limit window expired, resuming normal operation")
-            self.rate_limit_until = None
+        Used together with ``render_device_metrics()``, which renders them
+        straight from the snapshot. With ``poll`` False, ``collect()`` does
+        not poll even if the collector polls on collect.
+        """
+        self._streaming.active = True
+        self._streaming.poll = poll
+        try:
+            yield
+        finally:
+            self._streaming.active = False
+            self._streaming.poll = True
+
+    def render_device_metrics(self, openmetrics=False):
+        """Render the per-device families as exposition text, without Sample objects."""
+        self.__sync_labels__()
+        return self.__render_devices__(self.snapshot, None, None, openmetrics)
+
+    def render_slice(self, metrics_slice, openmetrics=False):
+        """Render the per-device families of the devices and sensors of a MetricsSlice.
+
+        Only the selected devices are looked at, so the cost follows the
+        size of the slice. The snapshot is read as it is; the API is never
+        called. Device gauges such as airthings_device_up are left out when
+        the slice selects sensors.
+        """
+        self.__sync_labels__()
+        snapshot = self.snapshot
+        device_ids = self.shard_index.select(
+            metrics_slice,
+            snapshot.generation,
+            lambda: snapshot.readings.keys() | self.device_up.keys(),
+        )
+        metric_names = None
+        if metrics_slice.sensors is not None:
+            metric_names = self.sensor_map.metric_names(metrics_slice.sensors)
+        return self.__render_devices__(snapshot, device_ids, metric_names, openmetrics)
+
+    def poll(self, coalesce=False):
+        """Fetch the latest readings of all devices and swap in a new snapshot.
+
+        Overlapping calls share a single fetch and its result or exception.
+        With ``coalesce``, as for polls triggered by scrapes, so do calls
+        within ``coalesce_window`` seconds of the last one. Devices keep
+        their previous reading while the API is rate limited or the request
+        budget asks to wait, so scrapes are served stale data instead of
+        nothing.
+        """
+        return self._single_flight.do(self.__poll__, window=None if coalesce else 0)
 
-        gauge_metric_family = GaugeMetricFamily("airthings_gauge", "Airthings sensor values")
+    def get_sample_history(self, device_id, start, end, cursor=None):
+        """Return one page of a device's samples between two Unix times.
+
+        The response holds a ``data`` dict with a list of values per field,
+        ``time`` included, and a ``cursor`` while more pages follow.
+        """
+        query = {"start": _api_time(start), "end": _api_time(end)}
+        if cursor:
+            query["cursor"] = cursor
+        return self.__api_get__(
+            self.__get_access_token__(),
+            f"/devices/{device_id}/samples?{urlencode(query)}",
+            f"history of device {device_id}",
+        )
+
+    def add_listener(self, listener):
+        """Call ``listener(collector, readings)`` with the readings fetched by each poll.
+
+        ``readings`` maps device ids to DeviceReading. Listeners run on the
+        polling thread and should only hand the readings off.
+        """
+        self._listeners.append(listener)
+
+    def has_data(self):
+        """Return True once a poll has completed or a snapshot was restored."""
+        snapshot = self.snapshot
+        return snapshot.generation > 0 or bool(snapshot.readings)
+
+    def export_state(self):
+        """Return the snapshot, device status, token, limits and aggregates as a JSON-able dict."""
+        snapshot = self.snapshot
+        token = self.token_manager.export()
+        return {
+            "generation": snapshot.generation,
+            "readings": {
+                device_id: {"data": reading.data, "updated_at": reading.updated_at}
+                for device_id, reading in snapshot.readings.items()
+            },
+            "device_up": dict(self.device_up),
+            "fetch_durations": dict(self.fetch_durations),
+            "token": (
+                None
+                if token is None
+                else {"access_token": token[0], "expires_at": token[1], "fetched_at": token[2]}
+            ),
+            **self.export_limits(),
+            "aggregates": self.aggregates.export() if self.aggregates else None,
+        }
+
+    def restore_state(self, state):
+        """Restore state saved by ``export_state()``, e.g. after a restart.
+
+        The snapshot is served right away, an unexpired token is reused and
+        polling stays paused until a saved rate limit or budget allows it.
+        """
+        readings = {
+            device_id: DeviceReading(reading["data"], reading["updated_at"])
+            for device_id, reading in state.get("readings", {}).items()
+        }
+        with self._snapshot_lock:
+            self.snapshot = Snapshot(state.get("generation", 0), readings)
+        if "device_up" in state:
+            self.device_up = dict(state["device_up"])
+            self.fetch_durations = dict(state.get("fetch_durations", {}))
+
+        token = state.get("token")
+        if token:
+            self.token_manager.restore(
+                token["access_token"], token["expires_at"], token.get("fetched_at")
+            )
+        self.restore_limits(state)
+        if self.aggregates and state.get("aggregates"):
+            self.aggregates.restore(state["aggregates"])
+        self._saved_state_key = self.__state_key__()
+
+    def export_limits(self):
+        """Return the rate limit and request budget, the state replicas hand over."""
+        return {
+            "rate_limit_until": (
+                self.rate_limit_until.timestamp() if self.rate_limit_until else None
+            ),
+            "budget": self.budget.export(),
+        }
+
+    def restore_limits(self, state):
+        """Restore a rate limit and request budget saved by ``export_limits()``.
+
+        A saved state without a rate limit clears the current one.
+        """
+        rate_limit_until = state.get("rate_limit_until")
+        self.rate_limit_until = (
+            None
+            if rate_limit_until is None
+            else datetime.fromtimestamp(rate_limit_until, tz=timezone.utc)
+        )
+        if state.get("budget"):
+            self.budget.restore(state["budget"])
+
+    def save_state(self):
+        """Save the current state if it changed since it was last saved or restored."""
+        if self.state_store is None:
+            return
+        key = self.__state_key__()
+        if key == self._saved_state_key:
+            return
+        try:
+            self.state_store.save(self.export_state())
+            self._saved_state_key = key
+        except OSError as e:
+            logger.error("❌ Could not save state: %s", e)
+
+    def __state_key__(self):
+        token = self.token_manager.export()
+        return (
+            self.snapshot.generation,
+            token and token[0],
+            self.rate_limit_until,
+            self.budget.next_poll_at,
+        )
+
+    def __poll__(self):
+        try:
+            return self.__poll_once__()
+        finally:
+            self.save_state()
+
+    def __poll_once__(self):
+        if self.__is_rate_limited__() or self.budget.plan(1) == 0:
+            return self.snapshot
 
         access_token = self.__get_access_token__()
-        for device_id in self.device_id_list:
-            data = self.__get_cloud_data__(access_token, device_id)
-            self.__add_samples__(gauge_metric_family, data, device_id)
+        if self.device_metadata and not self.discover:
+            self.__refresh_metadata__(access_token)
+        if self.discover:
+            tasks, order = self.__discovered_tasks__(access_token)
+        else:
+            tasks, order = self.__device_tasks__(access_token, self.device_id_list)
+
+        tasks = self.__rotate__(tasks, self.budget.plan(len(tasks)))
+        try:
+            with POLL_DURATION.time():
+                fetched = self.__run_fetches__(tasks, order)
+        except RateLimitException as e:
+            # Keep what was fetched before the rate limit, its devices are already marked up
+            if e.fetched:
+                self.__swap_snapshot__(e.fetched)
+            raise
+        self.budget.record_cycle(len(tasks))
+        if not tasks and self.snapshot.generation:
+            # Nothing was due; keep the generation so cached responses stay valid
+            return self.snapshot
+        return self.__swap_snapshot__(fetched)
+
+    def __swap_snapshot__(self, fetched):
+        with self._snapshot_lock:
+            readings = dict(self.snapshot.readings)
+            readings.update(fetched)
+            self.snapshot = Snapshot(self.snapshot.generation + 1, readings)
+        for listener in self._listeners:
+            try:
+                listener(self, fetched)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logger.error("❌ Reading listener failed: %s", e)
+        return self.snapshot
+
+    def __fetch_devices__(self, access_token, device_ids):
+        return self.__run_fetches__(*self.__device_tasks__(access_token, device_ids))
+
+    def __device_tasks__(self, access_token, device_ids):
+        """Fetch each device with its own latest-samples request."""
+        device_ids = self.__due__(device_ids)
+        tasks = [self.__device_task__(access_token, device_id) for device_id in device_ids]
+        return tasks, device_ids
+
+    def __device_task__(self, access_token, device_id):
+        return FetchTask(
+            f"device {device_id}",
+            "devices/latest-samples",
+            (device_id,),
+            partial(self.__get_device_readings__, access_token, device_id),
+        )
 
-        yield gauge_metric_family
+    def __discovered_tasks__(self, access_token):
+        """Fetch all devices with one latest-samples request per location.
 
-    def __add_samples__(self, gauge_metric_family, data, device_id):
-        labels = {"device_id": device_id}
-        if "battery" in data:
-            gauge_metric_family.add_sample(
-                "airthings_battery_percent", value=data["battery"], labels=labels
+        Configured devices that are not part of any discovered location are
+        still fetched one by one.
+        """
+        devices = self.directory.get_devices(access_token, self.snapshot.readings)
+        # A location is fetched as soon as one of its devices is due
+        due = set(self.__due__(list(devices)))
+        location_ids = sorted(
+            {d.location_id for d in devices.values() if d.location_id and d.device_id in due}
+        )
+        unlocated = self.__due__(
+            [
+                device_id
+                for device_id in self.device_id_list
+                if device_id not in devices or not devices[device_id].location_id
+            ]
+        )
+
+        tasks = [
+            FetchTask(
+                f"location {location_id}",
+                "locations/latest-samples",
+                tuple(d.device_id for d in devices.values() if d.location_id == location_id),
+                partial(self.__get_location_data__, access_token, location_id),
             )
-        if "co2" in data:
-            gauge_metric_family.add_sample(
-                "airthings_co2_parts_per_million", value=data["co2"], labels=labels
+            for location_id in location_ids
+        ]
+        tasks += [self.__device_task__(access_token, device_id) for device_id in unlocated]
+        order = list(self.device_id_list) + [d for d in devices if d not in self.device_id_list]
+        return tasks, order
+
+    def __refresh_metadata__(self, access_token):
+        """Refresh device metadata when stale or when a device with readings is unknown."""
+        try:
+            self.directory.get_devices(access_token, self.snapshot.readings)
+        except RateLimitException:
+            raise
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logger.warning("⚠️ Could not fetch device metadata: %s", e)
+
+    def __due__(self, device_ids):
+        """Return the devices that may have a new sample, or all without adaptive polling."""
+        if not self.adaptive:
+            return device_ids
+        due = [device_id for device_id in device_ids if self.schedule.is_due(device_id)]
+        self.skipped_fetches += len(device_ids) - len(due)
+        return due
+
+    def __rotate__(self, tasks, allowed):
+        """Keep ``allowed`` tasks, continuing where the previous partial cycle stopped."""
+        if allowed >= len(tasks):
+            return tasks
+        logger.info("📉 API budget allows %d of %d request(s) this cycle", allowed, len(tasks))
+        start = self._rotation % len(tasks)
+        self._rotation = start + allowed
+        return (tasks[start:] + tasks[:start])[:allowed]
+
+    def __run_fetches__(self, tasks, order):
+        """Run fetch tasks concurrently within the scrape deadline.
+
+        Each task returns a dict of device_id to sensor data. Results are
+        merged in ``order`` regardless of completion order; devices missing
+        from ``order`` are appended sorted. Tasks that failed, were skipped
+        by the circuit breaker or did not finish before the deadline are
+        left out, their devices keep their previous reading and are marked
+        down. A rate limit cancels all tasks that have not started yet,
+        leaving their devices' status as it was, and is re-raised with the
+        readings fetched so far in its ``fetched``.
+        """
+        if not tasks:
+            return {}
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="airthings-fetch"
             )
-        if "humidity" in data:
-            gauge_metric_family.add_sample(
-                "airthings_humidity_percent", value=data["humidity"], labels=labels
+
+        deadline = time.monotonic() + self.scrape_timeout
+        futures = {self._executor.submit(self.__run_task__, task, deadline): task for task in tasks}
+        fetched = {}
+        rate_limit = None
+        pending = set(futures)
+        try:
+            while pending and rate_limit is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning(
+                        "⏱️ Scrape deadline of %ss exceeded, %d request(s) not finished",
+                        self.scrape_timeout,
+                        len(pending),
+                    )
+                    break
+                done, pending = wait(pending, timeout=remaining, return_when=FIRST_EXCEPTION)
+                for future in done:
+                    try:
+                        fetched.update(self.__task_readings__(*future.result()))
+                    except RateLimitException as e:
+                        rate_limit = e
+        finally:
+            for future in pending:
+                future.cancel()
+                if rate_limit is None:
+                    self.__mark_down__(futures[future].device_ids)
+
+        ordered = {device_id: fetched.pop(device_id) for device_id in order if device_id in fetched}
+        ordered.update(sorted(fetched.items()))
+        if rate_limit is not None:
+            rate_limit.fetched = ordered
+            raise rate_limit
+        return ordered
+
+    def __run_task__(self, task, scrape_deadline):
+        """Fetch one task with retries; returns ``(task, data_by_device, duration)``.
+
+        ``data_by_device`` is None if the task failed or its circuit is open.
+        """
+        if not self.breaker.allow(task.key):
+            logger.debug("Circuit open, skipping %s", task.key)
+            return task, None, None
+
+        def fetch():
+            # Queued and retrying tasks bail out once another fetch hit a rate limit
+            self.__raise_if_rate_limited__()
+            return task.fetch()
+
+        started = time.perf_counter()
+        deadline = min(scrape_deadline, time.monotonic() + self.device_timeout)
+        self._fetch_deadline.value = deadline
+        try:
+            data_by_device = call_with_retries(
+                fetch,
+                deadline=deadline,
+                on_retry=lambda e: FETCH_RETRIES.labels(task.endpoint).inc(),
             )
-        if "pm1" in data:
-            gauge_metric_family.add_sample(
-                "airthings_pm1_micrograms_per_cubic_meter", value=float(data["pm1"]), labels=labels
+        except RateLimitException:
+            raise
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            if self.breaker.record_failure(task.key):
+                logger.warning(
+                    "🔌 Fetching %s keeps failing, skipping it for %ss",
+                    task.key,
+                    self.breaker.cooldown,
+                )
+            logger.error("❌ Fetching %s failed: %s", task.key, e)
+            return task, None, None
+        finally:
+            self._fetch_deadline.value = None
+
+        self.breaker.record_success(task.key)
+        return task, data_by_device, time.perf_counter() - started
+
+    def __task_readings__(self, task, data_by_device, duration):
+        if data_by_device is None:
+            self.__mark_down__(task.device_ids)
+            return {}
+        return self.__to_readings__(data_by_device, duration)
+
+    def __mark_down__(self, device_ids):
+        for device_id in device_ids:
+            self.device_up[device_id] = 0
+
+    def __to_readings__(self, data_by_device, duration):
+        updated_at = time.time()
+        for device_id, data in data_by_device.items():
+            self.device_up[device_id] = 1
+            self.fetch_durations[device_id] = duration
+            self.schedule.observe(device_id, data.get("time"))
+            if self.aggregates:
+                self.aggregates.add_reading(device_id, data, self.sensor_map, updated_at)
+        return {
+            device_id: DeviceReading(data, updated_at) for device_id, data in data_by_device.items()
+        }
+
+    def __is_rate_limited__(self):
+        if not self.rate_limit_until:
+            return False
+
+        now = datetime.now(timezone.utc)
+        if now >= self.rate_limit_until:
+            logger.info("✅ Rate limit window expired, resuming normal operation")
+            self.rate_limit_until = None
+            return False
+
+        seconds = int((self.rate_limit_until - now).total_seconds())
+        logger.warning(
+            "⏳ Rate limited. Retry after: %s (in %s)",
+            self.rate_limit_until.strftime("%Y-%m-%d %H:%M:%S %Z"),
+            format_duration(seconds),
+        )
+        return True
+
+    def __raise_if_rate_limited__(self):
+        rate_limit_until = self.rate_limit_until
+        if rate_limit_until is None:
+            return
+        seconds = (rate_limit_until - datetime.now(timezone.utc)).total_seconds()
+        if seconds > 0:
+            raise RateLimitException(int(seconds), rate_limit_until)
+
+    def __render_devices__(self, snapshot, device_ids, metric_names, openmetrics):
+        readings = snapshot.readings
+        if device_ids is None:
+            selected = ((device_id, reading.data) for device_id, reading in readings.items())
+        else:
+            selected = ((d, readings[d].data) for d in device_ids if d in readings)
+        parts = [
+            self.renderer.readings(
+                selected,
+                openmetrics=openmetrics,
+                timestamps=self.sample_timestamps,
+                metric_names=metric_names,
             )
-        if "pm25" in data:
-            gauge_metric_family.add_sample(
-                "airthings_pm25_micrograms_per_cubic_meter",
-                value=float(data["pm25"]),
-                labels=labels,
+        ]
+        if metric_names is None:
+            for name, documentation, values in self.__device_gauges__(snapshot, device_ids):
+                parts.append(
+                    self.renderer.gauge(name, documentation, values, openmetrics=openmetrics)
+                )
+        for name, documentation, values in self.__aggregate_gauges__(device_ids, metric_names):
+            parts.append(
+                self.renderer.window_gauge(name, documentation, values, openmetrics=openmetrics)
             )
-        if "pressure" in data:
-            gauge_metric_family.add_sample(
-                "airthings_pressure_hectopascals", value=float(data["pressure"]), labels=labels
+        return "".join(parts)
+
+    def __create_session__(self):
+        """Create a session that keeps one connection per concurrent fetch alive."""
+        session = requests.Session()
+        adapter = CountingHTTPAdapter(pool_maxsize=self.max_workers)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def __connection_stats__(self):
+        """Return (new, reused) request counts from the session's connection pools."""
+        if not isinstance(self.session, requests.Session):
+            return 0, 0
+        return connection_stats(self.session)
+
+    def __collect_connection_metrics__(self):
+        new, reused = self.__connection_stats__()
+        requests_total = CounterMetricFamily(
+            "airthings_exporter_http_requests",
+            "API requests by whether they opened a new connection or reused a pooled one",
+            labels=["connection"],
+        )
+        requests_total.add_metric(["new"], new)
+        requests_total.add_metric(["reused"], reused)
+        yield requests_total
+
+    def __collect_device_metrics__(self, snapshot):
+        families = {}
+        for device_id, reading in snapshot.readings.items():
+            self.__add_samples__(families, reading.data, device_id)
+        yield from families.values()
+
+        for name, documentation, values in self.__device_gauges__(snapshot):
+            gauge = GaugeMetricFamily(name, documentation, labels=["device_id"])
+            for device_id, value in values.items():
+                gauge.add_metric([device_id], value)
+            yield gauge
+
+        for name, documentation, values in self.__aggregate_gauges__():
+            gauge = GaugeMetricFamily(name, documentation, labels=["device_id", "window"])
+            for (device_id, window), value in values.items():
+                gauge.add_metric([device_id, window], value)
+            yield gauge
+
+    def __device_gauges__(self, snapshot, device_ids=None):
+        """Return ``(name, documentation, values by device)`` of the per-device gauges."""
+
+        def select(values):
+            if device_ids is None:
+                return dict(values)
+            return {d: values[d] for d in device_ids if d in values}
+
+        gauges = [
+            (
+                "airthings_last_update_timestamp_seconds",
+                "Unix time of the last successful fetch of a device",
+                {d: reading.updated_at for d, reading in select(snapshot.readings).items()},
+            ),
+            (
+                "airthings_device_up",
+                "Whether the last fetch of a device succeeded (1) or failed (0)",
+                select(self.device_up),
+            ),
+            (
+                "airthings_exporter_device_fetch_duration_seconds",
+                "Duration of the last successful request that fetched a device",
+                select(self.fetch_durations),
+            ),
+        ]
+        if self.adaptive:
+            gauges.append(
+                (
+                    "airthings_exporter_device_sample_interval_seconds",
+                    "Learned interval between new samples of a device",
+                    self.schedule.intervals(device_ids),
+                )
             )
-        if "radonShortTermAvg" in data:
-            gauge_metric_family.add_sample(
-                "airthings_radon_short_term_average_becquerels_per_cubic_meter",
-                value=float(data["radonShortTermAvg"]),
-                labels=labels,
+        return gauges
+
+    def __aggregate_gauges__(self, device_ids=None, metric_names=None):
+        """Return ``(name, documentation, values by device and window)`` of the aggregates."""
+        if not self.aggregates:
+            return []
+        return self.aggregates.gauges(device_ids, metric_names)
+
+    def __collect_fetch_metrics__(self):
+        if self.adaptive:
+            yield CounterMetricFamily(
+                "airthings_exporter_skipped_fetches",
+                "Device fetches skipped because no new sample was expected yet",
+                value=self.skipped_fetches,
             )
-        if "temp" in data:
-            gauge_metric_family.add_sample(
-                "airthings_temperature_celsius", value=data["temp"], labels=labels
+
+        if self.aggregates:
+            yield GaugeMetricFamily(
+                "airthings_exporter_aggregate_buffer_bytes",
+                "Memory held by the ring buffers of the rolling aggregates",
+                value=self.aggregates.memory_bytes(),
             )
-        if "voc" in data:
-            gauge_metric_family.add_sample(
-                "airthings_voc_parts_per_billion", value=data["voc"], labels=labels
+
+        rate_limited_until = GaugeMetricFamily(
+            "airthings_exporter_rate_limited_until_timestamp_seconds",
+            "Unix time until which the API rate limited the exporter",
+        )
+        if self.rate_limit_until:
+            rate_limited_until.add_metric([], self.rate_limit_until.timestamp())
+        yield rate_limited_until
+
+    def __collect_budget_metrics__(self):
+        budget = self.budget
+        for name, documentation, value in (
+            ("limit", "Request limit of the current rate limit window", budget.limit),
+            ("remaining", "Requests left in the current rate limit window", budget.remaining),
+            (
+                "reset_timestamp_seconds",
+                "Unix time when the current rate limit window resets",
+                budget.reset_at,
+            ),
+            (
+                "next_poll_timestamp_seconds",
+                "Unix time before which the request budget holds back polling",
+                budget.next_poll_at,
+            ),
+        ):
+            gauge = GaugeMetricFamily(f"airthings_exporter_rate_limit_{name}", documentation)
+            if value is not None:
+                gauge.add_metric([], value)
+            yield gauge
+
+    def __collect_info_metrics__(self):
+        if not (self.device_metadata or self.discover):
+            return
+        info = InfoMetricFamily(
+            "airthings_device",
+            "Name, model and location of a device in the Airthings account",
+            labels=["device_id", "name", "model", "location_id", "location"],
+        )
+        for device in self.directory.devices.values():
+            info.add_metric(
+                [
+                    device.device_id,
+                    device.name or "",
+                    device.device_type or "",
+                    device.location_id or "",
+                    device.location_name or "",
+                ],
+                {},
             )
+        yield info
 
-    def __get_cloud_data__(self, access_token, device_id):
-        headers = {"Authorization": f"Bearer {access_token}"}
-        response = requests.get(
-            f"https://ext-api.airthings.com/v1/devices/{device_id}/latest-samples",
-            headers=headers,
-            timeout=REQUEST_TIMEOUT,
+    def __collect_token_metrics__(self):
+        token_age = GaugeMetricFamily(
+            "airthings_exporter_token_age_seconds",
+            "Seconds since the cached Airthings access token was fetched",
+        )
+        age = self.token_manager.token_age()
+        if age is not None:
+            token_age.add_metric([], age)
+        yield token_age
+        yield CounterMetricFamily(
+            "airthings_exporter_token_refreshes",
+            "Number of access tokens fetched from the Airthings token endpoint",
+            value=self.token_manager.refresh_count,
         )
 
-        # Check for rate limiting
-        if response.status_code == 429:
-            self.__handle_rate_limit__(response, f"device {device_id}")
+    def __add_samples__(self, families, data, device_id):
+        labels = self._labels.get(device_id)
+        if labels is None:
+            # Samples never modify their labels, so one dict per device is shared
+            labels = self._labels[device_id] = dict(self.__label_set__(device_id))
+        timestamp = data.get("time") if self.sample_timestamps else None
+        self.sensor_map.add_samples(families, data, labels, timestamp)
+
+    def __label_set__(self, device_id):
+        """Return the label pairs of a device's sensor samples, built once per device."""
+        label_set = self._label_sets.get(device_id)
+        if label_set is None:
+            pairs = [("device_id", device_id)]
+            if self.device_labels:
+                device = self.directory.devices.get(device_id)
+                pairs.append(("name", (device and device.name) or ""))
+                pairs.append(("location", (device and device.location_name) or ""))
+            label_set = tuple((name, sys.intern(value)) for name, value in pairs)
+            self._label_sets[device_id] = label_set
+        return label_set
+
+    def __sync_labels__(self):
+        """Drop cached label sets once a metadata refresh changed the devices."""
+        generation = self.directory.generation
+        if self.device_labels and generation != self._labels_generation:
+            self._label_sets = {}
+            self._labels = {}
+            self.renderer.reset_labels()
+            self._labels_generation = generation
 
-        response.raise_for_status()
-        json_data = response.json()
+    def __get_cloud_data__(self, access_token, device_id):
+        json_data = self.__api_get__(
+            access_token, f"/devices/{device_id}/latest-samples", f"device {device_id}"
+        )
 
         if "data" not in json_data:
             logger.error("Unexpected API response for device %s: %s", device_id, json_data)
@@ -143,103 +870,118 @@ class CloudCollector(Collector):
 
         return json_data["data"]
 
+    def __get_device_readings__(self, access_token, device_id):
+        return {device_id: self.__get_cloud_data__(access_token, device_id)}
+
+    def __get_location_data__(self, access_token, location_id):
+        """Fetch the latest samples of all devices in a location with one request."""
+        json_data = self.__api_get__(
+            access_token, f"/locations/{location_id}/latest-samples", f"location {location_id}"
+        )
+
+        if "devices" not in json_data:
+            logger.error("Unexpected API response for location %s: %s", location_id, json_data)
+            raise KeyError("'devices' key not found in API response")
+
+        return {device["id"]: device.get("data", {}) for device in json_data["devices"]}
+
+    def __api_get__(self, access_token, path, context):
+        """GET an API path and return the decoded JSON body."""
+        response = self.__request__(access_token, path)
+
+        # The token may have been revoked or expired early; refresh once and retry
+        if response.status_code == 401:
+            logger.info("Access token rejected for %s, refreshing token", context)
+            self.token_manager.invalidate(access_token)
+            response = self.__request__(self.__get_access_token__(), path)
+
+        # Check for rate limiting
+        if response.status_code == 429:
+            RATE_LIMIT_EVENTS.labels(endpoint_name(path)).inc()
+            self.__handle_rate_limit__(response, context)
+
+        response.raise_for_status()
+        return response.json()
+
+    def __request__(self, access_token, path):
+        headers = {"Authorization": f"Bearer {access_token}"}
+        response = self.__timed_request__(
+            endpoint_name(path),
+            partial(
+                self.session.get,
+                f"{self.api_url}{path}",
+                headers=headers,
+                timeout=self.__request_timeout__(),
+            ),
+        )
+        self.budget.update(response.headers)
+        return response
+
+    def __request_timeout__(self):
+        """Return the request timeout, cut short by the deadline of the current fetch."""
+        deadline = getattr(self._fetch_deadline, "value", None)
+        if deadline is None:
+            return self.timeout
+        connect_timeout, read_timeout = self.timeout
+        return (connect_timeout, max(0.1, min(read_timeout, deadline - time.monotonic())))
+
+    def __timed_request__(self, endpoint, send):
+        started = time.perf_counter()
+        status_code = "error"
+        try:
+            response = send()
+            status_code = str(response.status_code)
+            return response
+        finally:
+            API_REQUEST_DURATION.labels(endpoint, status_code).observe(
+                time.perf_counter() - started
+            )
+
     def __get_access_token__(self):
+        """Return the cached access token, fetching a new one only near expiry."""
+        return self.token_manager.get_token()
+
+    def __request_access_token__(self):
         data = {
             "grant_type": "client_credentials",
             "client_id": self.client_id,
             "client_secret": self.client_secret,
-            "scope": "read:device:current_values",
+            # Listing devices and locations needs the broader read:device scope
+            "scope": (
+                "read:device read:device:current_values"
+                if self.discover or self.device_metadata
+                else "read:device:current_values"
+            ),
         }
-        token_response = requests.post(
-            "https://accounts-api.airthings.com/v1/token", data=data, timeout=REQUEST_TIMEOUT
+        token_response = self.__timed_request__(
+            "token", partial(self.session.post, self.token_url, data=data, timeout=self.timeout)
         )
 
         # Check for rate limiting on token endpoint
         if token_response.status_code == 429:
+            RATE_LIMIT_EVENTS.labels("token").inc()
             self.__handle_rate_limit__(token_response, "auth token")
 
         token_response.raise_for_status()
-        return token_response.json()["access_token"]
+        token_data = token_response.json()
+        return token_data["access_token"], token_data.get("expires_in", DEFAULT_TOKEN_LIFETIME)
 
     def __handle_rate_limit__(self, response, context):
         """Handle 429 rate limit response and parse Retry-After header."""
-        # The API provides multiple rate limit headers:
-        # - X-RateLimit-Reset: Unix timestamp when the rate limit window resets (most reliable)
-        # - X-RateLimit-Retry-After: Seconds until reset (often buggy, returns 0)
-        # - X-RateLimit-Remaining: How many requests are left (0 when rate limited)
-
-        reset_header = response.headers.get("X-RateLimit-Reset")
-        retry_after_header = response.headers.get("X-RateLimit-Retry-After")
-        remaining_header = response.headers.get("X-RateLimit-Remaining")
-
         logger.info(
             "Rate limit hit (%s): Remaining=%s, Reset=%s, Retry-After=%s",
             context,
-            remaining_header,
-            reset_header,
-            retry_after_header,
+            response.headers.get("X-RateLimit-Remaining"),
+            response.headers.get("X-RateLimit-Reset"),
+            response.headers.get("X-RateLimit-Retry-After"),
         )
-
-        # Prefer X-RateLimit-Reset (Unix timestamp) as it's more reliable
-        if reset_header:
-            try:
-                reset_timestamp = int(reset_header)
-                self.rate_limit_until = datetime.fromtimestamp(reset_timestamp, tz=timezone.utc)
-                logger.info("Using X-RateLimit-Reset header: %s", self.rate_limit_until)
-            except (ValueError, OSError) as e:
-                logger.error("Could not parse X-RateLimit-Reset '%s': %s", reset_header, e)
-                reset_header = None  # Fall back to retry-after
-
-        # Fallback to X-RateLimit-Retry-After if X-RateLimit-Reset wasn't available
-        if not reset_header and retry_after_header:
-            try:
-                # Try parsing as seconds first
-                retry_after_seconds = int(retry_after_header)
-                # If retry_after is 0 or negative, the API says rate limit is already expired
-                if retry_after_seconds <= 0:
-                    logger.warning(
-                        "X-RateLimit-Retry-After is %s (buggy header). Defaulting to 15 minutes.",
-                        retry_after_seconds,
-                    )
-                    retry_after_seconds = 900  # 15 minutes
-                self.rate_limit_until = datetime.now(timezone.utc) + timedelta(
-                    seconds=retry_after_seconds
-                )
-            except ValueError:
-                # Try parsing as ISO timestamp
-                try:
-                    self.rate_limit_until = datetime.fromisoformat(
-                        retry_after_header.replace("Z", "+00:00")
-                    )
-                except ValueError:
-                    # Default to 15 minutes if we can't parse
-                    logger.error("Could not parse Retry-After header: %s", retry_after_header)
-                    self.rate_limit_until = datetime.now(timezone.utc) + timedelta(minutes=15)
-        elif not reset_header:
-            # No headers at all, default to 15 minutes
-            logger.warning("No rate limit headers found, defaulting to 15 minutes")
-            self.rate_limit_until = datetime.now(timezone.utc) + timedelta(minutes=15)
-
-        # Calculate human-readable time until retry
-        time_remaining = self.rate_limit_until - datetime.now(timezone.utc)
-        seconds = int(time_remaining.total_seconds())
-
-        if seconds >= 3600:
-            hours = seconds // 3600
-            minutes = (seconds % 3600) // 60
-            time_str = f"{hours}h {minutes}m"
-        elif seconds >= 60:
-            minutes = seconds // 60
-            secs = seconds % 60
-            time_str = f"{minutes}m {secs}s"
-        else:
-            time_str = f"{seconds}s"
-
+        self.rate_limit_until = parse_rate_limit(response.headers)
+        seconds = int((self.rate_limit_until - datetime.now(timezone.utc)).total_seconds())
         logger.error(
             "🚫 Rate limit hit (%s). Retry after: %s (in %s)",
             context,
             self.rate_limit_until.strftime("%Y-%m-%d %H:%M:%S %Z"),
-            time_str,
+            format_duration(seconds),
         )
 
         raise RateLimitException(
@@ -0,0 +1,267 @@
+import json
+import marshal
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime, timezone
+from typing import NamedTuple
+from urllib.parse import parse_qs
+
+# Profile length of /debug/profile without ?seconds= (in seconds)
+DEFAULT_PROFILE_SECONDS = 10
+
+# Longest profile a request may ask for (in seconds)
+MAX_PROFILE_SECONDS = 60
+
+# Stack samples taken per second while profiling
+PROFILE_SAMPLE_RATE = 100
+
+# Frames recorded per allocation once /debug/memory starts tracemalloc
+TRACEMALLOC_FRAMES = 10
+
+# Allocation sites listed by /debug/memory without ?limit=
+DEFAULT_MEMORY_LIMIT = 25
+
+CONTENT_TYPE_TEXT = "text/plain; charset=utf-8"
+
+
+class DebugResponse(NamedTuple):
+    status: int
+    content_type: str
+    body: bytes
+
+
+def _text(status, text):
+    return DebugResponse(status, CONTENT_TYPE_TEXT, text.encode())
+
+
+def _query_number(params, name, default, maximum):
+    """Return a positive number from the query, or raise ValueError."""
+    value = float(params[name][-1]) if name in params else default
+    if not 0 < value <= maximum:
+        raise ValueError(f"{name} must be between 0 and {maximum}")
+    return value
+
+
+def sample_stacks(seconds, rate=PROFILE_SAMPLE_RATE):
+    """Sample the stacks of all other threads ``rate`` times a second.
+
+    Returns a Counter of ``(thread name, frames)``, with frames from the
+    outermost call inwards as ``(filename, first line, function)``.
+    """
+    own_thread = threading.get_ident()
+    samples = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():  # pylint: disable=protected-access
+            if ident == own_thread:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+            samples[(names.get(ident, str(ident)), tuple(reversed(stack)))] += 1
+        time.sleep(1 / rate)
+    return samples
+
+
+def collapsed_stacks(samples):
+    """Render samples in the collapsed stack format read by flamegraph tools."""
+    lines = []
+    for (thread, stack), count in samples.most_common():
+        frames = [thread.replace(";", ":")]
+        frames += [f"{name} ({os.path.basename(path)}:{line})" for path, line, name in stack]
+        lines.append(f"{';'.join(frames)} {count}\n")
+    return "".join(lines)
+
+
+def pstats_dump(samples, rate=PROFILE_SAMPLE_RATE):
+    """Convert samples into the marshalled stats that ``pstats.Stats`` loads.
+
+    Times are estimated from the number of samples in which a function was
+    running (own time) or on the stack (cumulative time); call counts are
+    sample counts.
+    """
+    interval = 1 / rate
+    stats = {}
+    for (_, stack), count in samples.items():
+        seen = set()
+        for depth, function in enumerate(stack):
+            entry = stats.get(function)
+            if entry is None:
+                entry = stats[function] = [0, 0, 0.0, 0.0, {}]
+            if function in seen:
+                continue  # Recursion counts once per sample
+            seen.add(function)
+            entry[0] += count
+            entry[1] += count
+            entry[3] += count * interval
+            if depth:
+                caller = stack[depth - 1]
+                cc, nc, tt, ct = entry[4].get(caller, (0, 0, 0.0, 0.0))
+                entry[4][caller] = (cc + count, nc + count, tt, ct + count * interval)
+        if stack:
+            stats[stack[-1]][2] += count * interval
+    return marshal.dumps({function: tuple(entry) for function, entry in stats.items()})
+
+
+class DebugEndpoints:
+    """Answer the /debug endpoints, which only exist with --debug-endpoints.
+
+    ``/debug/profile?seconds=N`` samples the stacks of every thread and
+    returns collapsed stacks, or with ``format=pstats`` a file for
+    ``pstats`` and tools like snakeviz. ``/debug/memory`` lists the top
+    allocation sites and how they changed since the previous request;
+    tracemalloc is only started by the first such request and stopped
+    again by ``/debug/memory?stop=1``. ``/debug/state``
+    shows the token, rate limit and per-device fetch state as JSON.
+
+    Nothing runs in between requests, so the endpoints cost nothing until
+    they are used.
+    """
+
+    def __init__(self, collector, accounts=None):
+        self.collector = collector
+        self.accounts = accounts
+        self._profiling = threading.Lock()
+        self._memory_lock = threading.Lock()
+        self._last_memory_snapshot = None
+
+    def handle(self, path, query):
+        """Return the DebugResponse of a request, or None for unknown paths."""
+        params = parse_qs(query)
+        handler = {
+            "/debug/profile": self.profile,
+            "/debug/memory": self.memory,
+            "/debug/state": self.state,
+        }.get(path)
+        if handler is None:
+            return None
+        try:
+            return handler(params)
+        except ValueError as e:
+            return _text(400, str(e))
+
+    def profile(self, params):
+        seconds = _query_number(params, "seconds", DEFAULT_PROFILE_SECONDS, MAX_PROFILE_SECONDS)
+        output = params.get("format", ["collapsed"])[-1]
+        if output not in ("collapsed", "pstats"):
+            raise ValueError("format must be collapsed or pstats")
+        # A non-blocking acquire answers a concurrent request with 409 instead of queueing it
+        if not self._profiling.acquire(blocking=False):  # pylint: disable=consider-using-with
+            return _text(409, "A profile is already running")
+        try:
+            samples = sample_stacks(seconds)
+        finally:
+            self._profiling.release()
+        if output == "pstats":
+            return DebugResponse(200, "application/octet-stream", pstats_dump(samples))
+        return _text(200, collapsed_stacks(samples))
+
+    def memory(self, params):
+        if params.get("stop", [""])[-1] == "1":
+            return self.stop_memory()
+        limit = int(_query_number(params, "limit", DEFAULT_MEMORY_LIMIT, 1000))
+        group = params.get("group", ["lineno"])[-1]
+        if group not in ("lineno", "filename", "traceback"):
+            raise ValueError("group must be lineno, filename or traceback")
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            return _text(
+                200,
+                "Started tracing allocations; request again to see the top allocation sites, "
+                "or with ?stop=1 to stop tracing\n",
+            )
+
+        with self._memory_lock:
+            snapshot = tracemalloc.take_snapshot().filter_traces(
+                (
+                    tracemalloc.Filter(False, tracemalloc.__file__),
+                    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                    tracemalloc.Filter(False, "<unknown>"),
+                )
+            )
+            previous, self._last_memory_snapshot = self._last_memory_snapshot, snapshot
+
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"Traced memory: {current / 1024:.1f} KiB, peak {peak / 1024:.1f} KiB", ""]
+        lines.append(f"Top {limit} allocation sites:")
+        for statistic in snapshot.statistics(group)[:limit]:
+            lines.append(str(statistic))
+            if group == "traceback":
+                lines += statistic.traceback.format()
+        if previous is not None:
+            lines += ["", f"Top {limit} changes since the previous request:"]
+            lines += [str(diff) for diff in snapshot.compare_to(previous, group)[:limit]]
+        return _text(200, "\n".join(lines) + "\n")
+
+    def stop_memory(self):
+        """Stop tracing allocations, so they no longer pay for it."""
+        with self._memory_lock:
+            self._last_memory_snapshot = None
+            if not tracemalloc.is_tracing():
+                return _text(200, "Allocations are not being traced\n")
+            tracemalloc.stop()
+        return _text(200, "Stopped tracing allocations\n")
+
+    def state(self, _params):
+        collectors = {"default": self.collector}
+        for account in self.accounts or ():
+            collectors[f"account-{account.name}"] = account.collector
+        state = {name: collector_state(c) for name, c in collectors.items()}
+        return DebugResponse(
+            200, "application/json", json.dumps(state, indent=2, sort_keys=True).encode()
+        )
+
+
+def _iso_time(timestamp):
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).isoformat()
+
+
+def collector_state(collector):
+    """Return the token, rate limit and device state of a collector; never the token itself."""
+    now = time.time()
+    token = collector.token_manager.export()
+    budget = collector.budget.export()
+    snapshot = collector.snapshot
+    intervals = collector.schedule.intervals() if collector.adaptive else {}
+    device_ids = sorted(snapshot.readings.keys() | collector.device_up.keys())
+
+    devices = {}
+    for device_id in device_ids:
+        reading = snapshot.readings.get(device_id)
+        devices[device_id] = {
+            "up": collector.device_up.get(device_id),
+            "last_fetch_duration_seconds": collector.fetch_durations.get(device_id),
+            "updated_at": _iso_time(reading.updated_at) if reading else None,
+            "age_seconds": round(now - reading.updated_at, 1) if reading else None,
+            "sample_interval_seconds": intervals.get(device_id),
+        }
+
+    return {
+        "token": {
+            "cached": token is not None,
+            "expires_in_seconds": round(token[1] - now, 1) if token else None,
+            "age_seconds": collector.token_manager.token_age(),
+            "refreshes": collector.token_manager.refresh_count,
+        },
+        "rate_limit": {
+            "limited_until": (
+                collector.rate_limit_until.isoformat() if collector.rate_limit_until else None
+            ),
+            "limit": budget["limit"],
+            "remaining": budget["remaining"],
+            "reset_at": _iso_time(budget["reset_at"]),
+            "next_poll_at": _iso_time(budget["next_poll_at"] or None),
+        },
+        "snapshot": {"generation": snapshot.generation, "devices": len(snapshot.readings)},
+        "open_circuits": sorted(collector.breaker.open_circuits()),
+        "devices": devices,
+    }
@@ -0,0 +1,107 @@
+import logging
+import threading
+import time
+from typing import NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+# Refresh the list of discovered devices and locations this often (in seconds)
+DEFAULT_DISCOVERY_TTL = 3600
+
+# Refresh early for devices missing from the list, at most this often (in seconds);
+# a failed refresh is also retried at most this often
+UNKNOWN_DEVICE_REFRESH = 300
+
+
+class DeviceInfo(NamedTuple):
+    device_id: str
+    device_type: Optional[str]
+    location_id: Optional[str]
+    location_name: Optional[str]
+    name: Optional[str] = None  # Name given in the Airthings app, usually the room
+
+
+class DeviceDirectory:  # pylint: disable=too-many-instance-attributes
+    """Devices and locations of the account, refreshed on a slow TTL.
+
+    ``api_get`` is called as ``api_get(access_token, path, context)`` and must
+    return the decoded JSON body of a GET request against the Airthings API.
+    ``generation`` counts the refreshes that changed the devices, so callers
+    can cache whatever they derive from them.
+    """
+
+    def __init__(self, api_get, ttl=DEFAULT_DISCOVERY_TTL, clock=time.monotonic):
+        self.api_get = api_get
+        self.ttl = ttl
+        self.clock = clock
+        self.devices = {}
+        self.refreshed_at = None
+        self.attempted_at = None
+        self.generation = 0
+        self._error = None  # Error of the last refresh, while retrying it is held off
+        self._lock = threading.Lock()
+
+    def get_devices(self, access_token, expected=()):
+        """Return discovered devices by device id, refreshing them when stale.
+
+        Device ids in ``expected`` that are not known yet, e.g. a device just
+        added to the account, trigger an early refresh at most every
+        ``UNKNOWN_DEVICE_REFRESH`` seconds. A failed refresh keeps serving the
+        previously discovered devices and is only raised when nothing has been
+        discovered yet. It is retried after ``UNKNOWN_DEVICE_REFRESH`` seconds
+        (or the TTL, if shorter), so e.g. a missing scope doesn't cost an API
+        request on every poll; until then a failed first discovery is raised
+        again.
+        """
+        with self._lock:
+            if self.__is_stale__(expected):
+                self.attempted_at = self.clock()
+                try:
+                    self.__refresh__(access_token)
+                    self._error = None
+                except Exception as e:  # pylint: disable=broad-exception-caught
+                    self._error = e
+                    if self.refreshed_at is None:
+                        raise
+                    logger.warning("Device discovery failed, keeping known devices: %s", e)
+            elif self._error is not None and self.refreshed_at is None:
+                raise self._error
+            return self.devices
+
+    def __is_stale__(self, expected):
+        now = self.clock()
+        if self._error is not None:
+            return now - self.attempted_at >= min(self.ttl, UNKNOWN_DEVICE_REFRESH)
+        if self.refreshed_at is None:
+            return True
+        age = now - self.refreshed_at
+        if age >= self.ttl:
+            return True
+        return age >= UNKNOWN_DEVICE_REFRESH and any(d not in self.devices for d in expected)
+
+    def __refresh__(self, access_token):
+        locations = self.api_get(access_token, "/locations", "locations").get("locations", [])
+        location_names = {location["id"]: location.get("name") for location in locations}
+
+        devices = {}
+        for device in self.api_get(access_token, "/devices", "devices").get("devices", []):
+            # Hubs and similar devices report no sensors of their own
+            if "sensors" in device and not device["sensors"]:
+                continue
+            location_id = (device.get("location") or {}).get("id")
+            devices[device["id"]] = DeviceInfo(
+                device_id=device["id"],
+                device_type=device.get("deviceType"),
+                location_id=location_id,
+                location_name=location_names.get(location_id),
+                name=(device.get("segment") or {}).get("name"),
+            )
+
+        devices = dict(sorted(devices.items()))
+        if devices != self.devices:
+            self.generation += 1
+        self.devices = devices
+        self.refreshed_at = self.clock()
+        logger.info(
+            "🔎 Discovered %d device(s) in %d location(s)", len(self.devices), len(location_names)
+        )
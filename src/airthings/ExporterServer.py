@@ -0,0 +1,179 @@
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from airthings.CloudCollector import RateLimitException
+from airthings.Instrumentation import SCRAPE_DURATION
+from airthings.MetricsCache import (
+    SLICES_NEED_POLLING,
+    accepts_gzip,
+    accepts_openmetrics,
+    etag_matches,
+)
+from airthings.MetricsSlice import parse_slice
+
+logger = logging.getLogger(__name__)
+
+# Number of /metrics requests rendered at the same time
+DEFAULT_MAX_CONCURRENT_SCRAPES = 4
+
+# Socket timeout for reading requests and writing responses (in seconds)
+DEFAULT_REQUEST_TIMEOUT = 60
+
+# How long a /metrics request waits for a free slot before getting a 503 (in seconds)
+SCRAPE_QUEUE_TIMEOUT = 1
+
+
+class ExporterServer(ThreadingHTTPServer):
+    """HTTP server handling every request in its own thread.
+
+    /health and /ready are answered right away, while /metrics and /probe
+    requests share a bounded number of slots so slow scrapes can't pile up.
+    On close the server waits for in-flight requests to finish.
+    """
+
+    daemon_threads = False
+    block_on_close = True
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        server_address,
+        metrics_cache,
+        *,
+        max_concurrent_scrapes=DEFAULT_MAX_CONCURRENT_SCRAPES,
+        request_timeout=DEFAULT_REQUEST_TIMEOUT,
+        ready_check=None,
+        accounts=None,
+        debug=None,
+    ):
+        super().__init__(server_address, HealthCheckHandler)
+        # None disables /metrics, e.g. when readings are only pushed
+        self.metrics_cache = metrics_cache
+        self.request_timeout = request_timeout
+        # Called by /ready; without it the server is ready as soon as it listens
+        self.ready_check = ready_check
+        # Accounts served by /probe?account=<name>, if any
+        self.accounts = accounts
+        # DebugEndpoints answering /debug/*; None unless --debug-endpoints is set
+        self.debug = debug
+        self.scrape_slots = threading.BoundedSemaphore(max_concurrent_scrapes)
+
+
+class HealthCheckHandler(BaseHTTPRequestHandler):
+    def setup(self):
+        # StreamRequestHandler applies this to the connection socket
+        self.timeout = self.server.request_timeout
+        super().setup()
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if self.path == "/health":
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain")
+            self.end_headers()
+            self.wfile.write(b"OK")
+        elif self.path == "/ready":
+            ready = self.server.ready_check is None or self.server.ready_check()
+            self.send_response(200 if ready else 503)
+            self.send_header("Content-Type", "text/plain")
+            self.end_headers()
+            self.wfile.write(b"Ready" if ready else b"Waiting for the first poll")
+        elif url.path == "/metrics" and self.server.metrics_cache is not None:
+            self.__scrape__(self.server.metrics_cache, url.query)
+        elif url.path == "/probe" and self.server.accounts is not None:
+            name = parse_qs(url.query).get("account", [""])[0]
+            account = self.server.accounts.get(name)
+            if account is None:
+                self.send_response(404)
+                self.send_header("Content-Type", "text/plain")
+                self.end_headers()
+                self.wfile.write(f"Unknown account '{name}'".encode())
+                return
+            self.__scrape__(account.metrics_cache, url.query)
+        elif url.path.startswith("/debug/") and self.server.debug is not None:
+            self.__send_debug__(url)
+        else:
+            self.send_response(404)
+            self.end_headers()
+
+    def __send_debug__(self, url):
+        response = self.server.debug.handle(url.path, url.query)
+        if response is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(response.status)
+        self.send_header("Content-Type", response.content_type)
+        self.send_header("Content-Length", str(len(response.body)))
+        self.end_headers()
+        self.wfile.write(response.body)
+
+    def __scrape__(self, metrics_cache, query=""):
+        try:
+            metrics_slice = parse_slice(query)
+            if metrics_slice is not None and not metrics_cache.supports_slices:
+                raise ValueError(SLICES_NEED_POLLING)
+        except ValueError as e:
+            self.send_response(400)
+            self.send_header("Content-Type", "text/plain")
+            self.end_headers()
+            self.wfile.write(str(e).encode())
+            return
+
+        if not self.server.scrape_slots.acquire(timeout=SCRAPE_QUEUE_TIMEOUT):
+            self.send_response(503)
+            self.send_header("Retry-After", "1")
+            self.send_header("Content-Type", "text/plain")
+            self.end_headers()
+            self.wfile.write(b"Too many concurrent scrapes")
+            return
+        try:
+            with SCRAPE_DURATION.time():
+                self.__send_metrics__(metrics_cache, metrics_slice)
+        finally:
+            self.server.scrape_slots.release()
+
+    def __send_metrics__(self, metrics_cache, metrics_slice=None):
+        try:
+            compress = accepts_gzip(self.headers.get("Accept-Encoding"))
+            rendered = metrics_cache.get(
+                compress=compress,
+                openmetrics=accepts_openmetrics(self.headers.get("Accept")),
+                metrics_slice=metrics_slice,
+            )
+            etag = rendered.etag_for(compress)
+            if etag_matches(self.headers.get("If-None-Match"), etag):
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Vary", "Accept, Accept-Encoding")
+                self.end_headers()
+                return
+
+            output = rendered.gzip_body if compress else rendered.body
+            self.send_response(200)
+            self.send_header("Content-Type", rendered.content_type)
+            self.send_header("ETag", etag)
+            self.send_header("Vary", "Accept, Accept-Encoding")
+            if compress:
+                self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(output)))
+            self.end_headers()
+            self.wfile.write(output)
+        except RateLimitException as e:
+            self.send_response(429)
+            self.send_header("Retry-After", str(e.retry_after_seconds))
+            self.send_header("Content-Type", "text/plain")
+            self.end_headers()
+            message = f"Rate limited. Retry after {e.retry_after_time}"
+            self.wfile.write(message.encode())
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            self.send_response(500)
+            self.send_header("Content-Type", "text/plain")
+            self.end_headers()
+            self.wfile.write(f"Error generating metrics: {str(e)}".encode())
+
+    def log_message(self, fmt, *log_args):  # pylint: disable=arguments-differ
+        # Only log errors, suppress normal HTTP logs to reduce noise
+        if "code 4" in str(log_args) or "code 5" in str(log_args):
+            logger.info(fmt, *log_args)
@@ -0,0 +1,115 @@
+from prometheus_client.utils import floatToGoString
+
+
+def format_value(value):
+    """Format a sample value like prometheus_client does, but faster for plain floats."""
+    text = repr(float(value))
+    # Exponents, infinity and NaN use Go's spelling
+    if "e" in text or "n" in text:
+        return floatToGoString(value)
+    return text
+
+
+def escape_label_value(value):
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def escape_help(text, openmetrics):
+    text = text.replace("\\", r"\\").replace("\n", r"\n")
+    return text.replace('"', r"\"") if openmetrics else text
+
+
+def format_header(name, documentation, unit="", openmetrics=False):
+    """Return the HELP, TYPE and (for OpenMetrics) UNIT lines of a gauge family."""
+    header = f"# HELP {name} {escape_help(documentation, openmetrics)}\n# TYPE {name} gauge\n"
+    if openmetrics and unit:
+        header += f"# UNIT {name} {unit}\n"
+    return header
+
+
+class ExpositionRenderer:
+    """Render per-device gauges as exposition text without building samples.
+
+    The text format and OpenMetrics are supported. Only the sample lines
+    are produced here; the ``# EOF`` that ends an OpenMetrics exposition is
+    left to the caller. Label sets are rendered once per device and cached.
+    """
+
+    def __init__(self, sensor_map, label_set=None):
+        self.sensor_map = sensor_map
+        # Returns the (name, value) label pairs of a device's sensor samples
+        self.label_set = label_set or (lambda device_id: (("device_id", device_id),))
+        self._labels = {}
+        self._sample_labels = {}
+
+    def reset_labels(self):
+        """Forget the rendered sample label sets, e.g. after device metadata changed."""
+        self._sample_labels = {}
+
+    def readings(self, readings, *, openmetrics=False, timestamps=False, metric_names=None):
+        """Render one gauge family per sensor from ``(device_id, data)`` pairs.
+
+        With ``timestamps`` every sample carries the ``time`` field of its
+        reading. ``metric_names`` limits the output to those sensors.
+        """
+        lookup = self.sensor_map.lookup
+        lines_by_sensor = {}
+        for device_id, data in readings:
+            labels = self.__sample_labels__(device_id)
+            suffix = self.__timestamp__(data.get("time"), openmetrics) if timestamps else ""
+            for key, value in data.items():
+                sensor = lookup(key, value)
+                if sensor is None or value is None:
+                    continue
+                if metric_names is not None and sensor.metric_name not in metric_names:
+                    continue
+                lines = lines_by_sensor.get(sensor)
+                if lines is None:
+                    lines = lines_by_sensor[sensor] = []
+                lines.append(
+                    f"{sensor.metric_name}{labels} {format_value(sensor.convert(value))}{suffix}\n"
+                )
+
+        return "".join(
+            format_header(sensor.metric_name, sensor.documentation, sensor.unit, openmetrics)
+            + "".join(lines)
+            for sensor, lines in lines_by_sensor.items()
+        )
+
+    def gauge(self, name, documentation, values, *, openmetrics=False):
+        """Render a gauge family from a dict of device_id to value."""
+        output = [format_header(name, documentation, "", openmetrics)]
+        for device_id, value in values.items():
+            output.append(f"{name}{self.__labels__(device_id)} {format_value(value)}\n")
+        return "".join(output)
+
+    def window_gauge(self, name, documentation, values, *, openmetrics=False):
+        """Render a gauge family from a dict of ``(device_id, window)`` to value."""
+        output = [format_header(name, documentation, "", openmetrics)]
+        for (device_id, window), value in values.items():
+            labels = self.__labels__(device_id)[:-1] + f',window="{escape_label_value(window)}"}}'
+            output.append(f"{name}{labels} {format_value(value)}\n")
+        return "".join(output)
+
+    def __labels__(self, device_id):
+        labels = self._labels.get(device_id)
+        if labels is None:
+            labels = self._labels[device_id] = f'{{device_id="{escape_label_value(device_id)}"}}'
+        return labels
+
+    def __sample_labels__(self, device_id):
+        labels = self._sample_labels.get(device_id)
+        if labels is None:
+            pairs = ",".join(
+                f'{name}="{escape_label_value(value)}"' for name, value in self.label_set(device_id)
+            )
+            labels = self._sample_labels[device_id] = f"{{{pairs}}}"
+        return labels
+
+    @staticmethod
+    def __timestamp__(timestamp, openmetrics):
+        if not isinstance(timestamp, (int, float)):
+            return ""
+        if openmetrics:
+            return f" {timestamp}"
+        return f" {int(float(timestamp) * 1000)}"
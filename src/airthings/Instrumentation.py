@@ -0,0 +1,108 @@
+import re
+import threading
+
+from prometheus_client import Counter, Gauge, Histogram
+from requests.adapters import HTTPAdapter
+
+# Metrics about the exporter itself, registered in the default registry
+
+API_REQUEST_DURATION = Histogram(
+    "airthings_exporter_api_request_duration_seconds",
+    "Duration of Airthings API requests",
+    ["endpoint", "status_code"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+
+POLL_DURATION = Histogram(
+    "airthings_exporter_poll_duration_seconds",
+    "Duration of polls fetching all devices",
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 60),
+)
+
+SCRAPE_DURATION = Histogram(
+    "airthings_exporter_scrape_duration_seconds",
+    "Duration of /metrics requests from receiving the request to sending the response",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30),
+)
+
+RATE_LIMIT_EVENTS = Counter(
+    "airthings_exporter_rate_limit_events",
+    "Responses with HTTP 429 from the Airthings API",
+    ["endpoint"],
+)
+
+FETCH_RETRIES = Counter(
+    "airthings_exporter_fetch_retries",
+    "Retries of device and location fetches after transient errors",
+    ["endpoint"],
+)
+
+PUSHED_SAMPLES = Counter(
+    "airthings_exporter_pushed_samples",
+    "Samples of the push pipeline by result: sent, spilled to disk or dropped",
+    ["result"],
+)
+
+HA_LEADER = Gauge(
+    "airthings_exporter_ha_leader",
+    "Whether this replica holds the lease and polls the API (1) or follows the leader (0)",
+    ["lease"],
+)
+
+_ID_SEGMENT = re.compile(r"/(devices|locations)/[^/]+")
+
+
+def endpoint_name(path):
+    """Return an endpoint label for an API path with ids and the query removed."""
+    return _ID_SEGMENT.sub(r"/\1", path.split("?", 1)[0]).strip("/")
+
+
+class CountingHTTPAdapter(HTTPAdapter):
+    """HTTP adapter that keeps the request counts of the connection pools it closes.
+
+    urllib3 closes pools evicted from its pool manager, which would make the
+    counts summed over the live pools drop.
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        self.closed_stats = (0, 0)
+        self._stats_lock = threading.Lock()
+        super().init_poolmanager(*args, **kwargs)
+        pools = self.poolmanager.pools
+        dispose = pools.dispose_func
+
+        def count_and_dispose(pool):
+            with self._stats_lock:
+                new, reused = self.closed_stats
+                self.closed_stats = (
+                    new + pool.num_connections,
+                    reused + pool.num_requests - pool.num_connections,
+                )
+            if dispose:
+                dispose(pool)
+
+        pools.dispose_func = count_and_dispose
+
+
+def connection_stats(session):
+    """Return (new, reused) request counts from a requests session's connection pools.
+
+    Pools closed by a ``CountingHTTPAdapter`` are included, so the counts only grow.
+    """
+    new = reused = 0
+    # The same adapter is mounted for several prefixes
+    adapters = {id(adapter): adapter for adapter in session.adapters.values()}
+    for adapter in adapters.values():
+        pools = getattr(getattr(adapter, "poolmanager", None), "pools", None)
+        if pools is None:
+            continue
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            new += pool.num_connections
+            reused += pool.num_requests - pool.num_connections
+        closed_new, closed_reused = getattr(adapter, "closed_stats", (0, 0))
+        new += closed_new
+        reused += closed_reused
+    return new, reused
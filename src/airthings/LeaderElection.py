@@ -0,0 +1,117 @@
+import logging
+import time
+
+from airthings.Instrumentation import HA_LEADER
+from airthings.Lease import DEFAULT_CHECK_INTERVAL
+from airthings.Poller import Poller
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderElection:  # pylint: disable=too-many-instance-attributes
+    """Share one polling loop between exporter replicas.
+
+    Every ``check_interval`` seconds each replica tries to take the lease.
+    The replica holding it polls the API every ``interval`` seconds and
+    writes every new snapshot to the shared SnapshotFile. The others load
+    that file whenever its generation changes and serve it, so all replicas
+    answer scrapes while only one spends API requests.
+
+    When the leader stops or dies its lease is released and the next
+    replica to check takes over. The leader hands its rate limit and
+    request budget over through the lease, so a new leader keeps waiting
+    out a rate limit instead of running into it again.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        collector,
+        lease,
+        snapshot_file,
+        interval,
+        *,
+        name="default",
+        check_interval=DEFAULT_CHECK_INTERVAL,
+        clock=time.time,
+    ):
+        self.collector = collector
+        self.lease = lease
+        self.snapshot_file = snapshot_file
+        self.interval = interval
+        self.name = name
+        self.check_interval = check_interval
+        self.clock = clock
+        self.leading = False
+        self._next_poll = 0
+        self._loaded_generation = None
+        self._poller = None
+        HA_LEADER.labels(name).set(0)
+
+    def start(self):
+        self._poller = Poller(self, self.check_interval)
+        self._poller.start()
+        return self
+
+    def stop(self, timeout=None):
+        """Stop checking and give up the lease, so another replica takes over right away."""
+        if self._poller is not None:
+            self._poller.stop(timeout)
+        self.lease.release()
+        self.snapshot_file.close()
+        if self.leading:
+            logger.info("👋 Released the lease of %s", self.name)
+        self.leading = False
+        HA_LEADER.labels(self.name).set(0)
+
+    def poll(self):
+        """Poll the API as leader, or load the leader's latest snapshot as follower."""
+        if not self.lease.try_acquire():
+            if self.leading:
+                logger.warning("⚠️ Lost the lease of %s, following", self.name)
+                self.leading = False
+                HA_LEADER.labels(self.name).set(0)
+            self.__follow__()
+            return self.collector.snapshot
+
+        if not self.leading:
+            self.__take_over__()
+        if self.clock() < self._next_poll:
+            return self.collector.snapshot
+        self._next_poll = self.clock() + self.interval
+        try:
+            return self.collector.poll()
+        finally:
+            self.__publish__()
+
+    def __take_over__(self):
+        # Continue from the previous leader's snapshot and limits
+        self.__follow__()
+        state = self.lease.read()
+        if state:
+            self.collector.restore_limits(state)
+        readings = self.collector.snapshot.readings
+        if readings:
+            # Don't poll before the previous leader's snapshot is a full interval old
+            self._next_poll = max(r.updated_at for r in readings.values()) + self.interval
+        self.leading = True
+        HA_LEADER.labels(self.name).set(1)
+        logger.info("👑 Took the lease of %s, polling the API", self.name)
+
+    def __publish__(self):
+        try:
+            generation = self.collector.snapshot.generation
+            if generation != self._loaded_generation:
+                self.snapshot_file.write(generation, self.collector.export_state())
+                self._loaded_generation = generation
+            self.lease.write(self.collector.export_limits())
+        except OSError as e:
+            logger.error("❌ Could not share the snapshot of %s: %s", self.name, e)
+
+    def __follow__(self):
+        generation = self.snapshot_file.generation()
+        if generation is None or generation == self._loaded_generation:
+            return
+        state = self.snapshot_file.load()
+        if state is not None:
+            self.collector.restore_state(state)
+            self._loaded_generation = generation
@@ -0,0 +1,77 @@
+import fcntl
+import json
+import logging
+import os
+import socket
+
+logger = logging.getLogger(__name__)
+
+# Seconds between attempts of a follower to take the lease and checks for a new snapshot
+DEFAULT_CHECK_INTERVAL = 5
+
+
+class FileLease:
+    """Leader lease held as an exclusive ``flock`` on a file on a shared volume.
+
+    The kernel drops the lock when the holder exits or crashes, so the next
+    replica calling ``try_acquire()`` takes over. The file also carries the
+    state the holder hands over to the next one. All replicas must see each
+    other's locks, e.g. on a volume mounted on one node or on NFSv4.
+
+    Other lease backends, e.g. one on a key-value store, provide the same
+    methods: ``try_acquire()`` returns whether this replica holds the
+    lease, ``release()`` gives it up, ``write(state)`` stores handover
+    state while holding it and ``read()`` returns the last stored state.
+    """
+
+    def __init__(self, path, holder=None):
+        self.path = path
+        # Written into the lease file to tell who holds it
+        self.holder = holder or f"{socket.gethostname()}:{os.getpid()}"
+        self._fd = None
+
+    @property
+    def held(self):
+        return self._fd is not None
+
+    def try_acquire(self):
+        """Take the lease if nobody holds it; return True while this replica holds it."""
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is None:
+            return
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+
+    def read(self):
+        """Return the state written by the last holder, or None if there is none."""
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if not data:
+            return None
+        try:
+            state = json.loads(data)
+        except ValueError as e:
+            logger.warning("⚠️ Ignoring unreadable lease file %s: %s", self.path, e)
+            return None
+        return state if isinstance(state, dict) else None
+
+    def write(self, state):
+        """Replace the handover state; only the holder writes."""
+        payload = json.dumps({**state, "holder": self.holder}, separators=(",", ":")).encode()
+        os.ftruncate(self._fd, 0)
+        os.pwrite(self._fd, payload, 0)
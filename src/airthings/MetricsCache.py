@@ -0,0 +1,162 @@
+import gzip
+import hashlib
+import threading
+from typing import NamedTuple, Optional
+
+from prometheus_client import generate_latest
+from prometheus_client.openmetrics.exposition import generate_latest as generate_latest_openmetrics
+
+CONTENT_TYPE_TEXT = "text/plain; version=0.0.4; charset=utf-8"
+CONTENT_TYPE_OPENMETRICS = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# Rendered slices kept per generation; scrape configs only ask for a few
+MAX_CACHED_SLICES = 256
+
+SLICES_NEED_POLLING = "Sliced metrics are only served with --poll-interval"
+
+
+class RenderedMetrics(NamedTuple):
+    generation: Optional[int]  # Snapshot generation, None if not cacheable
+    body: bytes
+    gzip_body: Optional[bytes]
+    etag: str
+    content_type: str = CONTENT_TYPE_TEXT
+
+    def etag_for(self, compress):
+        """Return the ETag of the gzip or the identity body; they differ byte for byte."""
+        return f'{self.etag[:-1]}-gz"' if compress else self.etag
+
+
+def accepts_gzip(accept_encoding):
+    """Return True if an Accept-Encoding header value allows gzip."""
+    for coding in (accept_encoding or "").split(","):
+        name, _, params = coding.partition(";")
+        if name.strip().lower() not in ("gzip", "*"):
+            continue
+        quality = params.strip().lower()
+        if not quality.startswith("q="):
+            return True
+        try:
+            return float(quality[2:]) > 0
+        except ValueError:
+            return False
+    return False
+
+
+def accepts_openmetrics(accept):
+    """Return True if an Accept header value asks for the OpenMetrics format."""
+    return "application/openmetrics-text" in (accept or "")
+
+
+def etag_matches(if_none_match, etag):
+    """Return True if an If-None-Match header value matches the given ETag."""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+class MetricsCache:
+    """Render the per-device families once per snapshot generation.
+
+    Collectors providing ``render_device_metrics()`` render their per-device
+    families straight from the snapshot instead of through the registry,
+    which avoids building a sample object per value on large fleets. With
+    background polling that text is kept until the collector swaps in a new
+    snapshot; when the collector polls on every scrape each request renders
+    afresh. The rest of the registry (the exporter's own, process and
+    platform metrics) is rendered on every request, so scrape durations,
+    rate limits and budgets are never served stale.
+
+    Collectors providing ``render_slice()`` also serve a MetricsSlice of
+    their devices and sensors. Slices are rendered from the snapshot
+    without polling, and cached per generation as well; slices without
+    the exporter's metrics are cached with their gzip copy and ETag. They
+    are only served with background polling: a collector polling on
+    collect would never refresh the snapshot of sliced scrapes.
+    """
+
+    def __init__(self, registry, collector=None):
+        self.registry = registry
+        self.collector = collector
+        self._devices = {}  # Per format (True for OpenMetrics): (generation, bytes)
+        self._slices = {}  # (MetricsSlice, format) -> (generation, bytes or RenderedMetrics)
+        self._lock = threading.Lock()
+
+    @property
+    def supports_slices(self):
+        return hasattr(self.collector, "render_slice") and not self.collector.poll_on_collect
+
+    def get(self, compress=False, openmetrics=False, metrics_slice=None):
+        """Return the rendered metrics; ``gzip_body`` is set if ``compress`` is True.
+
+        ``metrics_slice`` selects a MetricsSlice instead of all metrics.
+        """
+        if metrics_slice is not None:
+            return self.__get_slice__(metrics_slice, compress, openmetrics)
+        encoder = generate_latest_openmetrics if openmetrics else generate_latest
+        if not hasattr(self.collector, "render_device_metrics"):
+            return self.__finish__(None, encoder(self.registry), compress, openmetrics)
+
+        with self.collector.streaming():
+            # Polls first when the collector polls on collect
+            body = encoder(self.registry)
+        generation = None if self.collector.poll_on_collect else self.collector.snapshot.generation
+        devices = self.__cached__(
+            self._devices,
+            openmetrics,
+            generation,
+            lambda: self.collector.render_device_metrics(openmetrics).encode(),
+        )
+        return self.__finish__(generation, devices + body, compress, openmetrics)
+
+    def __get_slice__(self, metrics_slice, compress, openmetrics):
+        if not self.supports_slices:
+            raise ValueError(SLICES_NEED_POLLING)
+        generation = self.collector.snapshot.generation
+        key = (metrics_slice, openmetrics)
+        if not metrics_slice.exporter_metrics:
+            suffix = b"# EOF\n" if openmetrics else b""
+            return self.__cached__(
+                self._slices,
+                key,
+                generation,
+                lambda: self.__finish__(
+                    generation,
+                    self.collector.render_slice(metrics_slice, openmetrics).encode() + suffix,
+                    True,
+                    openmetrics,
+                ),
+            )
+
+        body = self.__cached__(
+            self._slices,
+            key,
+            generation,
+            lambda: self.collector.render_slice(metrics_slice, openmetrics).encode(),
+        )
+        encoder = generate_latest_openmetrics if openmetrics else generate_latest
+        with self.collector.streaming(poll=False):
+            body += encoder(self.registry)
+        return self.__finish__(generation, body, compress, openmetrics)
+
+    def __cached__(self, cache, key, generation, render):
+        """Return ``render()``, kept in ``cache`` under ``key`` until the generation changes."""
+        if generation is None:
+            return render()
+        cached = cache.get(key)
+        if cached is not None and cached[0] == generation:
+            return cached[1]
+        rendered = render()
+        with self._lock:
+            if len(cache) >= MAX_CACHED_SLICES:
+                cache.clear()
+            cache[key] = (generation, rendered)
+        return rendered
+
+    @staticmethod
+    def __finish__(generation, body, compress, openmetrics):
+        gzip_body = gzip.compress(body, mtime=0) if compress else None
+        etag = f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+        content_type = CONTENT_TYPE_OPENMETRICS if openmetrics else CONTENT_TYPE_TEXT
+        return RenderedMetrics(generation, body, gzip_body, etag, content_type)
@@ -0,0 +1,138 @@
+import hashlib
+import threading
+from typing import NamedTuple, Optional, Tuple
+from urllib.parse import parse_qs
+
+# Largest shard count accepted in /metrics?shard=i/n
+MAX_SHARDS = 1024
+
+# Shard counts whose device lists are kept; scrape configs use one or two
+MAX_INDEXED_SHARD_COUNTS = 8
+
+
+def jump_hash(key, buckets):
+    """Map a 64-bit key to one of ``buckets`` buckets with Jump Consistent Hash.
+
+    Growing the number of buckets from n to n + 1 only moves 1/(n + 1) of
+    the keys, all of them into the new bucket (Lamping and Veach, 2014).
+    """
+    bucket, candidate = -1, 0
+    while candidate < buckets:
+        bucket = candidate
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        candidate = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def device_key(device_id):
+    return int.from_bytes(hashlib.blake2b(device_id.encode(), digest_size=8).digest(), "big")
+
+
+def device_shard(device_id, shards):
+    """Return the shard of a device when its devices are split into ``shards`` shards."""
+    return jump_hash(device_key(device_id), shards)
+
+
+class MetricsSlice(NamedTuple):
+    """The devices and sensors one /metrics request asks for."""
+
+    devices: Optional[Tuple[str, ...]] = None  # None selects every device
+    sensors: Optional[Tuple[str, ...]] = None  # API fields or metric names; None selects all
+    shard: Optional[Tuple[int, int]] = None  # (index, count)
+
+    @property
+    def exporter_metrics(self):
+        """Whether the exporter's own metrics go with this slice.
+
+        They are served once per scrape configuration: with the first shard,
+        and never with device or sensor filters.
+        """
+        if self.devices is not None or self.sensors is not None:
+            return False
+        index, _ = self.shard or (0, 1)
+        return index == 0
+
+
+def parse_slice(query):
+    """Parse the query string of a /metrics request into a MetricsSlice.
+
+    Returns None if the query selects no slice. Devices and sensors can be
+    repeated or comma-separated. Raises ValueError for an invalid query.
+    """
+    params = parse_qs(query, keep_blank_values=True)
+    devices = _names(params.get("device"))
+    sensors = _names(params.get("sensor"))
+    shard = None
+    if "shard" in params:
+        shard = _parse_shard(params["shard"][-1])
+    if devices is None and sensors is None and shard is None:
+        return None
+    return MetricsSlice(devices, sensors, shard)
+
+
+def _names(values):
+    if values is None:
+        return None
+    names = tuple(dict.fromkeys(n.strip() for v in values for n in v.split(",") if n.strip()))
+    if not names:
+        raise ValueError("Empty device or sensor filter")
+    return names
+
+
+def _parse_shard(text):
+    index, _, count = text.partition("/")
+    try:
+        index, count = int(index), int(count)
+    except ValueError as e:
+        raise ValueError(f"Invalid shard '{text}', expected <index>/<count>") from e
+    if not 0 < count <= MAX_SHARDS or not 0 <= index < count:
+        raise ValueError(f"Invalid shard '{text}', expected 0 <= index < count <= {MAX_SHARDS}")
+    return index, count
+
+
+class ShardIndex:
+    """Devices of every shard, rebuilt once per snapshot generation and shard count.
+
+    Building the index looks at every device once; afterwards each shard
+    request only costs as much as the devices in that shard.
+    """
+
+    def __init__(self):
+        self._keys = {}  # device_id -> hash key
+        self._shards = {}  # shard count -> (generation, [device ids per shard])
+        self._lock = threading.Lock()
+
+    def select(self, metrics_slice, generation, known_devices):
+        """Return the devices a MetricsSlice selects, or None for all of them.
+
+        ``known_devices`` returns every device and is only called on a rebuild.
+        """
+        device_ids = metrics_slice.devices
+        if metrics_slice.shard is None:
+            return device_ids
+        index, count = metrics_slice.shard
+        if device_ids is not None:
+            return [d for d in device_ids if device_shard(d, count) == index]
+        return self.devices(generation, known_devices, index, count)
+
+    def devices(self, generation, known_devices, index, count):
+        """Return the devices of one shard; ``known_devices`` is called on a rebuild."""
+        entry = self._shards.get(count)
+        if entry is None or entry[0] != generation:
+            with self._lock:
+                entry = self._shards.get(count)
+                if entry is None or entry[0] != generation:
+                    entry = (generation, self.__build__(known_devices(), count))
+                    if len(self._shards) >= MAX_INDEXED_SHARD_COUNTS:
+                        self._shards.clear()
+                    self._shards[count] = entry
+        return entry[1][index]
+
+    def __build__(self, device_ids, count):
+        shards = [[] for _ in range(count)]
+        for device_id in sorted(device_ids):
+            key = self._keys.get(device_id)
+            if key is None:
+                key = self._keys[device_id] = device_key(device_id)
+            shards[jump_hash(key, count)].append(device_id)
+        return shards
@@ -0,0 +1,49 @@
+import logging
+import threading
+
+from airthings.CloudCollector import RateLimitException
+
+logger = logging.getLogger(__name__)
+
+
+class Poller:
+    """Poll the Airthings API in a background thread at a fixed interval.
+
+    Each cycle calls ``collector.poll()``, which swaps in a fresh snapshot.
+    Scrapes then only read that snapshot, so neither their latency nor the
+    number of scrapers has any effect on API usage.
+    """
+
+    def __init__(self, collector, interval, initial_delay=0):
+        self.collector = collector
+        self.interval = interval
+        # Lets a snapshot restored from the state file age a full interval first
+        self.initial_delay = initial_delay
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="airthings-poller", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def run(self):
+        if self.initial_delay > 0 and self._stop_event.wait(self.initial_delay):
+            return
+        while True:
+            self.poll_once()
+            if self._stop_event.wait(self.interval):
+                return
+
+    def poll_once(self):
+        try:
+            self.collector.poll()
+        except RateLimitException as e:
+            logger.warning("⚠️ Poll skipped, rate limited until %s", e.retry_after_time)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            # Keep serving the last snapshot and try again next cycle
+            logger.error("❌ Poll failed: %s", e)
@@ -0,0 +1,124 @@
+import gzip
+import json
+import struct
+from typing import NamedTuple
+
+from airthings import Snappy
+from airthings.Sensors import Sensor
+
+# Samples per push request
+DEFAULT_PUSH_BATCH_SIZE = 500
+
+# Seconds between pushes of a partly filled batch
+DEFAULT_PUSH_INTERVAL = 15
+
+# Samples held in memory; the oldest are dropped beyond this
+DEFAULT_PUSH_QUEUE_SIZE = 10000
+
+# Bytes of undelivered batches kept on disk; the oldest are dropped beyond this
+DEFAULT_SPILL_MAX_BYTES = 64 * 1024 * 1024
+
+
+class PushSample(NamedTuple):
+    sensor: Sensor
+    device_id: str
+    value: float
+    timestamp: float  # Unix time the device took the sample
+
+
+def _series(samples):
+    """Group samples by sensor and device, keeping the order they were queued in."""
+    series = {}
+    for sample in samples:
+        series.setdefault((sample.sensor, sample.device_id), []).append(sample)
+    return series
+
+
+def _field(number, payload):
+    return Snappy.encode_varint(number << 3 | 2) + Snappy.encode_varint(len(payload)) + payload
+
+
+class RemoteWriteFormat:
+    """Prometheus remote-write 1.0: a protobuf WriteRequest, Snappy compressed.
+
+    The few protobuf messages involved are encoded by hand::
+
+        WriteRequest { repeated TimeSeries timeseries = 1; }
+        TimeSeries   { repeated Label labels = 1; repeated Sample samples = 2; }
+        Label        { string name = 1; string value = 2; }
+        Sample       { double value = 1; int64 timestamp = 2; }  // milliseconds
+    """
+
+    name = "remote-write"
+    extension = "rw"
+    headers = {
+        "Content-Type": "application/x-protobuf",
+        "Content-Encoding": "snappy",
+        "X-Prometheus-Remote-Write-Version": "0.1.0",
+    }
+
+    def encode(self, samples):
+        request = bytearray()
+        for (sensor, device_id), points in _series(samples).items():
+            # Labels sorted by name, as remote-write requires
+            series = _field(1, self.__label__("__name__", sensor.metric_name))
+            series += _field(1, self.__label__("device_id", device_id))
+            for point in sorted(points, key=lambda p: p.timestamp):
+                timestamp = int(point.timestamp * 1000) & 0xFFFFFFFFFFFFFFFF
+                sample = b"\x09" + struct.pack("<d", point.value)
+                sample += b"\x10" + Snappy.encode_varint(timestamp)
+                series += _field(2, sample)
+            request += _field(1, series)
+        return Snappy.compress(request)
+
+    @staticmethod
+    def __label__(name, value):
+        return _field(1, name.encode()) + _field(2, value.encode())
+
+
+class OtlpFormat:
+    """OTLP/HTTP metrics as gzip compressed JSON, one gauge per sensor."""
+
+    name = "otlp"
+    extension = "otlp"
+    headers = {"Content-Type": "application/json", "Content-Encoding": "gzip"}
+
+    def encode(self, samples):
+        metrics = {}
+        for (sensor, device_id), points in _series(samples).items():
+            metric = metrics.get(sensor)
+            if metric is None:
+                metric = metrics[sensor] = {
+                    "name": sensor.metric_name,
+                    "description": sensor.documentation,
+                    "unit": sensor.unit,
+                    "gauge": {"dataPoints": []},
+                }
+            attributes = [{"key": "device_id", "value": {"stringValue": device_id}}]
+            metric["gauge"]["dataPoints"].extend(
+                {
+                    "attributes": attributes,
+                    "timeUnixNano": str(int(point.timestamp * 1_000_000_000)),
+                    "asDouble": point.value,
+                }
+                for point in points
+            )
+
+        body = {
+            "resourceMetrics": [
+                {
+                    "resource": {
+                        "attributes": [
+                            {"key": "service.name", "value": {"stringValue": "airthings-exporter"}}
+                        ]
+                    },
+                    "scopeMetrics": [
+                        {"scope": {"name": "airthings-exporter"}, "metrics": list(metrics.values())}
+                    ],
+                }
+            ]
+        }
+        return gzip.compress(json.dumps(body, separators=(",", ":")).encode())
+
+
+PUSH_FORMATS = {push_format.name: push_format for push_format in (RemoteWriteFormat, OtlpFormat)}
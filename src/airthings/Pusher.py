@@ -0,0 +1,225 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import requests
+
+from airthings.Instrumentation import PUSHED_SAMPLES
+from airthings.PushFormats import (
+    DEFAULT_PUSH_BATCH_SIZE,
+    DEFAULT_PUSH_INTERVAL,
+    DEFAULT_PUSH_QUEUE_SIZE,
+    DEFAULT_SPILL_MAX_BYTES,
+    PUSH_FORMATS,
+    PushSample,
+)
+from airthings.Retry import call_with_retries, is_transient
+
+logger = logging.getLogger(__name__)
+
+# Attempts per push request, including the first one
+PUSH_ATTEMPTS = 4
+
+
+class Pusher:  # pylint: disable=too-many-instance-attributes
+    """Push new readings to a remote-write or OTLP endpoint in batches.
+
+    Collectors hand every poll's readings to ``add_readings()``. Each sample
+    is queued once, with the time the device took it, in a bounded queue
+    that a background thread sends in batches of ``batch_size``, or every
+    ``flush_interval`` seconds when fewer are waiting.
+
+    Failed pushes are retried with backoff. Batches that still fail are
+    written to ``spill_dir`` and sent oldest first once the endpoint is
+    back; while any are spilled, new batches are spilled behind them so
+    the receiver gets every series in order. Without ``spill_dir`` such
+    batches are dropped.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        url,
+        push_format="remote-write",
+        *,
+        batch_size=DEFAULT_PUSH_BATCH_SIZE,
+        flush_interval=DEFAULT_PUSH_INTERVAL,
+        queue_size=DEFAULT_PUSH_QUEUE_SIZE,
+        spill_dir=None,
+        spill_max_bytes=DEFAULT_SPILL_MAX_BYTES,
+        headers=None,
+        session=None,
+        timeout=(10, 30),
+        attempts=PUSH_ATTEMPTS,
+        retry_delay=1,
+    ):
+        self.url = url
+        self.format = PUSH_FORMATS[push_format]()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.spill_dir = spill_dir
+        self.spill_max_bytes = spill_max_bytes
+        self.headers = {**self.format.headers, **(headers or {})}
+        self.session = session if session is not None else requests.Session()
+        self.timeout = timeout
+        self.attempts = attempts
+        self.retry_delay = retry_delay
+        self._queue = deque()
+        self._last_sample = {}  # device_id -> time of the last queued reading
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._sequence = 0
+        self._thread = None
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def attach(self, collector):
+        """Queue the readings of every poll of ``collector``."""
+        collector.add_listener(self.add_readings)
+
+    def add_readings(self, collector, readings):
+        """Queue the sensor values of readings not queued before."""
+        lookup = collector.sensor_map.lookup
+        with self._condition:
+            for device_id, reading in readings.items():
+                sample_time = reading.data.get("time")
+                if not isinstance(sample_time, (int, float)):
+                    sample_time = reading.updated_at
+                if sample_time <= self._last_sample.get(device_id, float("-inf")):
+                    continue
+                self._last_sample[device_id] = sample_time
+                for key, value in reading.data.items():
+                    sensor = lookup(key, value)
+                    if sensor is None or value is None:
+                        continue
+                    self._queue.append(
+                        PushSample(sensor, device_id, sensor.convert(value), sample_time)
+                    )
+
+            overflow = len(self._queue) - self.queue_size
+            if overflow > 0:
+                for _ in range(overflow):
+                    self._queue.popleft()
+                PUSHED_SAMPLES.labels("dropped").inc(overflow)
+                logger.warning("⚠️ Push queue full, dropped %d sample(s)", overflow)
+            if len(self._queue) >= self.batch_size:
+                self._condition.notify()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="airthings-pusher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """Push what is still queued, spilling it if that fails, and stop."""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        else:
+            self.flush()
+
+    def run(self):
+        while True:
+            with self._condition:
+                if len(self._queue) < self.batch_size and not self._stopping:
+                    self._condition.wait(self.flush_interval)
+                stopping = self._stopping
+            self.flush()
+            if stopping:
+                return
+
+    def flush(self):
+        """Send everything queued so far, then retry spilled batches."""
+        while True:
+            with self._condition:
+                batch = [
+                    self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))
+                ]
+            if not batch:
+                break
+            if self.__spilled__():
+                self.__spill__(batch)
+            else:
+                self.__push__(batch)
+        self.__drain_spill__()
+
+    def __push__(self, batch):
+        try:
+            self.__send__(self.format.encode(batch))
+            PUSHED_SAMPLES.labels("sent").inc(len(batch))
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            if self.spill_dir and self.__is_retryable__(e):
+                logger.warning("⚠️ Push failed, spilling %d sample(s): %s", len(batch), e)
+                self.__spill__(batch)
+            else:
+                logger.error("❌ Push failed, dropping %d sample(s): %s", len(batch), e)
+                PUSHED_SAMPLES.labels("dropped").inc(len(batch))
+
+    def __send__(self, payload):
+        def post():
+            response = self.session.post(
+                self.url, data=payload, headers=self.headers, timeout=self.timeout
+            )
+            response.raise_for_status()
+
+        call_with_retries(
+            post,
+            attempts=self.attempts,
+            base_delay=self.retry_delay,
+            max_delay=10 * self.retry_delay,
+        )
+
+    @staticmethod
+    def __is_retryable__(error):
+        if isinstance(error, requests.HTTPError) and error.response is not None:
+            # Throttled requests may succeed later; other client errors never will
+            return error.response.status_code == 429 or error.response.status_code >= 500
+        return is_transient(error)
+
+    def __spilled__(self):
+        """Return the spilled batches, oldest first, as ``(path, samples)``."""
+        if not self.spill_dir:
+            return []
+        spilled = []
+        for name in sorted(os.listdir(self.spill_dir)):
+            stem, _, extension = name.rpartition(".")
+            if extension == self.format.extension:
+                spilled.append((os.path.join(self.spill_dir, name), int(stem.rsplit("-", 1)[1])))
+        return spilled
+
+    def __spill__(self, batch):
+        self._sequence += 1
+        name = f"{time.time_ns():020d}{self._sequence:06d}-{len(batch)}.{self.format.extension}"
+        path = os.path.join(self.spill_dir, name)
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(self.format.encode(batch))
+        os.replace(f"{path}.tmp", path)
+        PUSHED_SAMPLES.labels("spilled").inc(len(batch))
+
+        spilled = self.__spilled__()
+        total = sum(os.path.getsize(path) for path, _ in spilled)
+        while total > self.spill_max_bytes and len(spilled) > 1:
+            oldest, samples = spilled.pop(0)
+            total -= os.path.getsize(oldest)
+            os.unlink(oldest)
+            PUSHED_SAMPLES.labels("dropped").inc(samples)
+            logger.warning("⚠️ Spill directory full, dropped %d sample(s)", samples)
+
+    def __drain_spill__(self):
+        for path, samples in self.__spilled__():
+            with open(path, "rb") as f:
+                payload = f.read()
+            try:
+                self.__send__(payload)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                if self.__is_retryable__(e):
+                    return  # Still down; try again next flush
+                logger.error("❌ Push of spilled batch failed, dropping it: %s", e)
+                PUSHED_SAMPLES.labels("dropped").inc(samples)
+            else:
+                PUSHED_SAMPLES.labels("sent").inc(samples)
+            os.unlink(path)
@@ -0,0 +1,166 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+# Requests kept in reserve for discovery and retries
+DEFAULT_RESERVE = 2
+
+
+def _parse_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_rate_limit(headers):
+    """Return when the rate limit of a 429 response ends, as an aware datetime."""
+    # The API provides multiple rate limit headers:
+    # - X-RateLimit-Reset: Unix timestamp when the rate limit window resets (most reliable)
+    # - X-RateLimit-Retry-After: Seconds until reset (often buggy, returns 0)
+    # - X-RateLimit-Remaining: How many requests are left (0 when rate limited)
+    reset_header = headers.get("X-RateLimit-Reset")
+    retry_after_header = headers.get("X-RateLimit-Retry-After")
+
+    # Prefer X-RateLimit-Reset (Unix timestamp) as it's more reliable
+    if reset_header:
+        try:
+            until = datetime.fromtimestamp(int(reset_header), tz=timezone.utc)
+            logger.info("Using X-RateLimit-Reset header: %s", until)
+            return until
+        except (ValueError, OSError) as e:
+            logger.error("Could not parse X-RateLimit-Reset '%s': %s", reset_header, e)
+
+    # Fallback to X-RateLimit-Retry-After if X-RateLimit-Reset wasn't available
+    if not retry_after_header:
+        # No headers at all, default to 15 minutes
+        logger.warning("No rate limit headers found, defaulting to 15 minutes")
+        return datetime.now(timezone.utc) + timedelta(minutes=15)
+    try:
+        # Try parsing as seconds first
+        retry_after_seconds = int(retry_after_header)
+        # If retry_after is 0 or negative, the API says rate limit is already expired
+        if retry_after_seconds <= 0:
+            logger.warning(
+                "X-RateLimit-Retry-After is %s (buggy header). Defaulting to 15 minutes.",
+                retry_after_seconds,
+            )
+            retry_after_seconds = 900  # 15 minutes
+        return datetime.now(timezone.utc) + timedelta(seconds=retry_after_seconds)
+    except ValueError:
+        pass
+    # Try parsing as ISO timestamp
+    try:
+        return datetime.fromisoformat(retry_after_header.replace("Z", "+00:00"))
+    except ValueError:
+        # Default to 15 minutes if we can't parse
+        logger.error("Could not parse Retry-After header: %s", retry_after_header)
+        return datetime.now(timezone.utc) + timedelta(minutes=15)
+
+
+def format_duration(seconds):
+    """Format a number of seconds like 1h 5m, 3m 20s or 45s."""
+    if seconds >= 3600:
+        return f"{seconds // 3600}h {(seconds % 3600) // 60}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m {seconds % 60}s"
+    return f"{seconds}s"
+
+
+class RateLimitBudget:
+    """Spread the remaining API quota over the rest of the rate limit window.
+
+    The budget is fed the ``X-RateLimit-*`` headers of every API response.
+    Before a poll cycle ``plan()`` says how many requests the cycle may spend,
+    and after it ``record_cycle()`` paces the next cycle so the remaining
+    requests last until the window resets. Without rate limit headers, or
+    once the window has reset, nothing is throttled.
+    """
+
+    def __init__(self, reserve=DEFAULT_RESERVE, clock=time.time):
+        self.reserve = reserve
+        self.clock = clock
+        self.limit = None
+        self.remaining = None
+        self.reset_at = None  # Unix timestamp when the window resets
+        self.next_poll_at = 0.0  # Unix timestamp before which no cycle should run
+        self._lock = threading.Lock()
+
+    def update(self, headers):
+        """Record the rate limit headers of an API response."""
+        limit = _parse_int(headers.get("X-RateLimit-Limit"))
+        remaining = _parse_int(headers.get("X-RateLimit-Remaining"))
+        reset_at = _parse_int(headers.get("X-RateLimit-Reset"))
+        with self._lock:
+            if limit is not None:
+                self.limit = limit
+            if remaining is not None:
+                # Responses of one cycle can arrive out of order; keep the lowest count
+                if self.remaining is None or reset_at != self.reset_at:
+                    self.remaining = remaining
+                else:
+                    self.remaining = min(self.remaining, remaining)
+            if reset_at is not None:
+                self.reset_at = reset_at
+
+    def plan(self, calls):
+        """Return how many of ``calls`` requests the next cycle may make.
+
+        Returns 0 while the cycle should be skipped, either because it is too
+        early or because the budget is used up until the window resets.
+        """
+        with self._lock:
+            if not self.__is_tracking__():
+                return calls
+            if self.clock() < self.next_poll_at:
+                return 0
+            return max(0, min(calls, self.remaining - self.reserve))
+
+    def record_cycle(self, calls):
+        """Schedule the next cycle after one that made ``calls`` requests."""
+        with self._lock:
+            if not self.__is_tracking__() or calls <= 0:
+                self.next_poll_at = 0.0
+                return
+
+            now = self.clock()
+            spendable = self.remaining - self.reserve
+            if spendable <= 0:
+                logger.info(
+                    "📉 API budget used up until %s, pausing polling",
+                    time.strftime("%Y-%m-%d %H:%M:%S UTC", time.gmtime(self.reset_at)),
+                )
+                self.next_poll_at = float(self.reset_at)
+                return
+
+            # Space cycles so the remaining requests last until the window resets
+            interval = (self.reset_at - now) * calls / spendable
+            self.next_poll_at = min(now + interval, float(self.reset_at))
+
+    def export(self):
+        """Return the budget state as a dict for the state file."""
+        with self._lock:
+            return {
+                "limit": self.limit,
+                "remaining": self.remaining,
+                "reset_at": self.reset_at,
+                "next_poll_at": self.next_poll_at,
+            }
+
+    def restore(self, state):
+        """Restore a budget saved by ``export()``."""
+        with self._lock:
+            self.limit = state.get("limit")
+            self.remaining = state.get("remaining")
+            self.reset_at = state.get("reset_at")
+            self.next_poll_at = state.get("next_poll_at") or 0.0
+
+    def __is_tracking__(self):
+        return (
+            self.remaining is not None
+            and self.reset_at is not None
+            and self.clock() < self.reset_at
+        )
@@ -0,0 +1,53 @@
+import random
+import time
+
+import requests
+
+# Attempts per fetch, including the first one
+DEFAULT_ATTEMPTS = 3
+
+# Backoff before the first retry; doubles with every further retry (in seconds)
+DEFAULT_BASE_DELAY = 0.5
+DEFAULT_MAX_DELAY = 5
+
+
+def is_transient(error):
+    """Return True for errors worth retrying: timeouts, connection errors and 5xx."""
+    if isinstance(error, (requests.Timeout, requests.ConnectionError)):
+        return True
+    if isinstance(error, requests.HTTPError):
+        response = error.response
+        return response is not None and response.status_code >= 500
+    return False
+
+
+def call_with_retries(  # pylint: disable=too-many-arguments
+    fn,
+    *,
+    attempts=DEFAULT_ATTEMPTS,
+    base_delay=DEFAULT_BASE_DELAY,
+    max_delay=DEFAULT_MAX_DELAY,
+    deadline=None,
+    on_retry=None,
+    clock=time.monotonic,
+    sleep=time.sleep,
+):
+    """Call ``fn`` and retry transient errors with exponential backoff and full jitter.
+
+    No retry is started if its backoff would end after ``deadline`` (a
+    ``clock`` value); the last error is raised instead. ``on_retry`` is
+    called with the error before every retry.
+    """
+    for attempt in range(attempts):
+        try:
+            return fn()
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            if attempt + 1 >= attempts or not is_transient(e):
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2**attempt))
+            if deadline is not None and clock() + delay >= deadline:
+                raise
+            if on_retry is not None:
+                on_retry(e)
+            sleep(delay)
+    raise AssertionError("unreachable")
@@ -0,0 +1,237 @@
+import base64
+import math
+import re
+import threading
+import time
+from array import array
+
+# Buckets per window; aggregates move forward one bucket (window / buckets) at a time
+DEFAULT_BUCKETS = 24
+
+# Per bucket: sum, min, max and count of the samples that fell into it
+_FIELDS = 4
+
+# Exported statistics, in the order RingBuffer.aggregate() returns them
+STATISTICS = (("min", "minimum"), ("max", "maximum"), ("avg", "mean"))
+
+_WINDOW = re.compile(r"^(\d+)([smhd])$")
+_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_window(text):
+    """Parse a window like "30m", "24h" or "7d" into seconds."""
+    match = _WINDOW.match(text.strip())
+    if not match or int(match.group(1)) == 0:
+        raise ValueError(f"Invalid window '{text}', expected e.g. 1h, 24h or 7d")
+    return int(match.group(1)) * _UNITS[match.group(2)]
+
+
+def format_window(seconds):
+    """Format a window in seconds with the largest unit that divides it."""
+    for unit in ("d", "h", "m"):
+        if seconds % _UNITS[unit] == 0:
+            return f"{seconds // _UNITS[unit]}{unit}"
+    return f"{seconds}s"
+
+
+class RingBuffer:
+    """Count, sum, min and max of one series per time bucket of a window.
+
+    The buckets live in two flat arrays, so a buffer takes a fixed
+    ``buckets * 40`` bytes plus a small constant, however many samples
+    it sees. Aggregates are cached until a sample arrives or the window
+    moves on by a bucket.
+    """
+
+    __slots__ = ("width", "stats", "bucket_ids", "_cached_bucket", "_cached")
+
+    def __init__(self, window, buckets=DEFAULT_BUCKETS):
+        self.width = window / buckets
+        self.stats = array("d", bytes(8 * _FIELDS * buckets))
+        self.bucket_ids = array("q", [-1]) * buckets
+        self._cached_bucket = None
+        self._cached = None
+
+    def add(self, timestamp, value):
+        bucket_id = int(timestamp // self.width)
+        slot = bucket_id % len(self.bucket_ids)
+        i = slot * _FIELDS
+        stats = self.stats
+        if self.bucket_ids[slot] == bucket_id:
+            stats[i] += value
+            stats[i + 1] = min(stats[i + 1], value)
+            stats[i + 2] = max(stats[i + 2], value)
+            stats[i + 3] += 1
+        elif self.bucket_ids[slot] < bucket_id:
+            # Reuse the slot of a bucket that has left the window
+            self.bucket_ids[slot] = bucket_id
+            stats[i], stats[i + 1], stats[i + 2], stats[i + 3] = value, value, value, 1
+        else:
+            return  # Older than the window
+        self._cached_bucket = None
+
+    def aggregate(self, now):
+        """Return ``(min, max, mean)`` over the window ending at ``now``, or None."""
+        current = int(now // self.width)
+        if self._cached_bucket == current:
+            return self._cached
+
+        oldest = current - len(self.bucket_ids) + 1
+        stats = self.stats
+        total = count = 0.0
+        low, high = math.inf, -math.inf
+        for slot, bucket_id in enumerate(self.bucket_ids):
+            if oldest <= bucket_id <= current:
+                i = slot * _FIELDS
+                total += stats[i]
+                low = min(low, stats[i + 1])
+                high = max(high, stats[i + 2])
+                count += stats[i + 3]
+
+        self._cached = (low, high, total / count) if count else None
+        self._cached_bucket = current
+        return self._cached
+
+    def export(self):
+        return {
+            "stats": base64.b64encode(self.stats.tobytes()).decode("ascii"),
+            "bucket_ids": base64.b64encode(self.bucket_ids.tobytes()).decode("ascii"),
+        }
+
+    def restore(self, state):
+        stats = array("d", base64.b64decode(state["stats"]))
+        bucket_ids = array("q", base64.b64decode(state["bucket_ids"]))
+        if len(stats) != len(self.stats) or len(bucket_ids) != len(self.bucket_ids):
+            return  # Saved with a different bucket count
+        self.stats, self.bucket_ids = stats, bucket_ids
+        self._cached_bucket = None
+
+    def __sizeof__(self):
+        return object.__sizeof__(self) + self.stats.__sizeof__() + self.bucket_ids.__sizeof__()
+
+
+class RollingAggregates:
+    """Rolling min, max and mean of every sensor of every device over fixed windows.
+
+    Each reading is added once, keyed by its ``time`` field, so polls that
+    return the same sample again don't skew the mean. ``windows`` are in
+    seconds.
+    """
+
+    def __init__(self, windows, buckets=DEFAULT_BUCKETS, clock=time.time):
+        self.windows = sorted(windows)
+        self.buckets = buckets
+        self.clock = clock
+        self._buffers = {}  # device_id -> metric_name -> [RingBuffer per window]
+        self._last_sample = {}  # device_id -> time of the last added reading
+        self._documentation = {}  # metric_name -> sensor documentation
+        self._lock = threading.Lock()
+
+    def add_reading(self, device_id, data, sensor_map, fetched_at):
+        """Add the exported values of one reading."""
+        sample_time = data.get("time")
+        if not isinstance(sample_time, (int, float)):
+            sample_time = fetched_at
+        with self._lock:
+            if sample_time <= self._last_sample.get(device_id, -math.inf):
+                return
+            self._last_sample[device_id] = sample_time
+            for key, value in data.items():
+                sensor = sensor_map.lookup(key, value)
+                if sensor is None or value is None:
+                    continue
+                self._documentation[sensor.metric_name] = sensor.documentation
+                for buffer in self.__series__(device_id, sensor.metric_name):
+                    buffer.add(sample_time, sensor.convert(value))
+
+    def gauges(self, device_ids=None, metric_names=None):
+        """Return ``(name, documentation, values)`` of one gauge per sensor and statistic.
+
+        ``values`` maps ``(device_id, window)`` to the statistic; series
+        without samples in a window are left out. ``device_ids`` and
+        ``metric_names`` limit the gauges to those devices and sensors.
+        """
+        with self._lock:
+            if device_ids is None:
+                selected = self._buffers.items()
+            else:
+                selected = [(d, self._buffers[d]) for d in device_ids if d in self._buffers]
+            values_by_metric = self.__aggregate__(selected, metric_names)
+            documentation = dict(self._documentation)
+
+        return [
+            (
+                f"{metric_name}_{statistic}",
+                f"{documentation.get(metric_name, metric_name)}, {description} over the window",
+                by_series,
+            )
+            for metric_name, values in values_by_metric.items()
+            for (statistic, description), by_series in zip(STATISTICS, values)
+        ]
+
+    def memory_bytes(self):
+        """Return the memory held by the ring buffers."""
+        with self._lock:
+            return sum(
+                b.__sizeof__()
+                for series in self._buffers.values()
+                for buffers in series.values()
+                for b in buffers
+            )
+
+    def export(self):
+        with self._lock:
+            return {
+                "windows": self.windows,
+                "buckets": self.buckets,
+                "last_sample": dict(self._last_sample),
+                "documentation": dict(self._documentation),
+                "series": [
+                    [device_id, metric_name, [b.export() for b in buffers]]
+                    for device_id, series in self._buffers.items()
+                    for metric_name, buffers in series.items()
+                ],
+            }
+
+    def restore(self, state):
+        """Restore buffers saved by ``export()`` if windows and buckets still match."""
+        if state.get("windows") != self.windows or state.get("buckets") != self.buckets:
+            return
+        with self._lock:
+            self._last_sample.update(state.get("last_sample", {}))
+            self._documentation.update(state.get("documentation", {}))
+            for device_id, metric_name, buffer_states in state.get("series", []):
+                for buffer, buffer_state in zip(
+                    self.__series__(device_id, metric_name), buffer_states
+                ):
+                    buffer.restore(buffer_state)
+
+    def __aggregate__(self, selected, metric_names):
+        """Return metric name to one ``(device_id, window) -> value`` dict per statistic."""
+        now = self.clock()
+        labels = [format_window(window) for window in self.windows]
+        values_by_metric = {}
+        for device_id, series in selected:
+            for metric_name, buffers in series.items():
+                if metric_names is not None and metric_name not in metric_names:
+                    continue
+                values = values_by_metric.get(metric_name)
+                if values is None:
+                    values = values_by_metric[metric_name] = tuple({} for _ in STATISTICS)
+                for label, aggregate in zip(labels, (b.aggregate(now) for b in buffers)):
+                    if aggregate is None:
+                        continue
+                    for by_series, value in zip(values, aggregate):
+                        by_series[(device_id, label)] = value
+        return values_by_metric
+
+    def __series__(self, device_id, metric_name):
+        series = self._buffers.get(device_id)
+        if series is None:
+            series = self._buffers[device_id] = {}
+        buffers = series.get(metric_name)
+        if buffers is None:
+            buffers = series[metric_name] = [
+                RingBuffer(window, self.buckets) for window in self.windows
+            ]
+        return buffers
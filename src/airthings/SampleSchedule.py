@@ -0,0 +1,88 @@
+import threading
+import time
+
+# Bounds for the learned reporting interval of a device (in seconds)
+MIN_SAMPLE_INTERVAL = 60
+MAX_SAMPLE_INTERVAL = 3600
+
+# Time between a sample being taken and it being available from the API (in seconds)
+DEFAULT_UPLOAD_DELAY = 30
+
+# Weight of a new observation in the smoothed interval
+SMOOTHING = 0.3
+
+
+class _DeviceSchedule:
+    __slots__ = ("sample_time", "interval", "due_at")
+
+    def __init__(self, sample_time):
+        self.sample_time = sample_time
+        self.interval = None
+        self.due_at = 0.0
+
+
+class SampleSchedule:
+    """Learn how often each device reports and when its next sample is due.
+
+    ``observe()`` is fed the ``time`` field of every fetched reading. Once two
+    distinct samples of a device were seen, it is only due again after its
+    next sample is expected to be available; a fetch that returns no new
+    sample is retried after a short backoff. Devices without a learned
+    interval are always due.
+    """
+
+    def __init__(self, upload_delay=DEFAULT_UPLOAD_DELAY, clock=time.time):
+        self.upload_delay = upload_delay
+        self.clock = clock
+        self._devices = {}
+        self._lock = threading.Lock()
+
+    def observe(self, device_id, sample_time):
+        """Record the sample time of a freshly fetched reading."""
+        if not isinstance(sample_time, (int, float)):
+            return
+        with self._lock:
+            schedule = self._devices.get(device_id)
+            if schedule is None:
+                self._devices[device_id] = _DeviceSchedule(sample_time)
+                return
+
+            if sample_time > schedule.sample_time:
+                self.__learn_interval__(schedule, sample_time - schedule.sample_time)
+                schedule.sample_time = sample_time
+                if schedule.interval is not None:
+                    schedule.due_at = sample_time + schedule.interval + self.upload_delay
+            elif schedule.interval is not None:
+                # The expected sample is late; look again shortly
+                schedule.due_at = self.clock() + max(self.upload_delay, schedule.interval / 10)
+
+    def is_due(self, device_id):
+        with self._lock:
+            schedule = self._devices.get(device_id)
+            return schedule is None or self.clock() >= schedule.due_at
+
+    def intervals(self, device_ids=None):
+        """Return the learned reporting interval of every device that has one.
+
+        ``device_ids`` limits the result to those devices.
+        """
+        with self._lock:
+            if device_ids is None:
+                selected = self._devices.items()
+            else:
+                selected = [(d, self._devices[d]) for d in device_ids if d in self._devices]
+            return {
+                device_id: schedule.interval
+                for device_id, schedule in selected
+                if schedule.interval is not None
+            }
+
+    @staticmethod
+    def __learn_interval__(schedule, elapsed):
+        if schedule.interval is None:
+            observed = elapsed
+        else:
+            # Fetching late skips samples; count them instead of learning a longer interval
+            observed = elapsed / max(1, round(elapsed / schedule.interval))
+            observed = schedule.interval + (observed - schedule.interval) * SMOOTHING
+        schedule.interval = min(MAX_SAMPLE_INTERVAL, max(MIN_SAMPLE_INTERVAL, observed))
@@ -0,0 +1,162 @@
+import re
+from typing import Callable, NamedTuple
+
+from prometheus_client.metrics_core import GaugeMetricFamily
+
+
+class Sensor(NamedTuple):
+    key: str  # Field name in the API response
+    metric_name: str
+    documentation: str
+    unit: str = ""  # OpenMetrics unit, the suffix of metric_name
+    convert: Callable = float
+
+
+SENSORS = (
+    Sensor("battery", "airthings_battery_percent", "Battery level", "percent"),
+    Sensor("co2", "airthings_co2_parts_per_million", "CO2 concentration", "parts_per_million"),
+    Sensor("humidity", "airthings_humidity_percent", "Relative humidity", "percent"),
+    Sensor("light", "airthings_light_percent", "Light level", "percent"),
+    Sensor("lux", "airthings_light_lux", "Illuminance", "lux"),
+    Sensor("mold", "airthings_mold_risk_index", "Mold risk index"),
+    Sensor(
+        "pm1",
+        "airthings_pm1_micrograms_per_cubic_meter",
+        "PM1 particulate matter",
+        "micrograms_per_cubic_meter",
+    ),
+    Sensor(
+        "pm25",
+        "airthings_pm25_micrograms_per_cubic_meter",
+        "PM2.5 particulate matter",
+        "micrograms_per_cubic_meter",
+    ),
+    Sensor("pressure", "airthings_pressure_hectopascals", "Air pressure", "hectopascals"),
+    Sensor(
+        "pressureDifference",
+        "airthings_pressure_difference_pascals",
+        "Pressure difference to the outside",
+        "pascals",
+    ),
+    Sensor(
+        "radonShortTermAvg",
+        "airthings_radon_short_term_average_becquerels_per_cubic_meter",
+        "Radon level, short-term average",
+        "becquerels_per_cubic_meter",
+    ),
+    Sensor(
+        "radonLongTermAvg",
+        "airthings_radon_long_term_average_becquerels_per_cubic_meter",
+        "Radon level, long-term average",
+        "becquerels_per_cubic_meter",
+    ),
+    Sensor("rssi", "airthings_rssi_dbm", "Signal strength to the relay device", "dbm"),
+    Sensor("sla", "airthings_sound_level_a_weighted_decibels", "Sound level", "decibels"),
+    Sensor("temp", "airthings_temperature_celsius", "Temperature", "celsius"),
+    Sensor(
+        "outdoorTemp", "airthings_outdoor_temperature_celsius", "Outdoor temperature", "celsius"
+    ),
+    Sensor(
+        "outdoorHumidity",
+        "airthings_outdoor_humidity_percent",
+        "Outdoor relative humidity",
+        "percent",
+    ),
+    Sensor(
+        "outdoorPressure",
+        "airthings_outdoor_pressure_hectopascals",
+        "Outdoor air pressure",
+        "hectopascals",
+    ),
+    Sensor("virusRisk", "airthings_virus_risk_index", "Virus survival risk index"),
+    Sensor(
+        "voc", "airthings_voc_parts_per_billion", "Volatile Organic Compounds", "parts_per_billion"
+    ),
+)
+
+# Fields that are never exported, not even by the generic fallback
+IGNORED_KEYS = frozenset({"time", "relayDeviceType"})
+
+_UNKNOWN = object()
+
+_CAMEL_BOUNDARY = re.compile(r"(?<=[a-z0-9])(?=[A-Z])")
+
+
+def generic_sensor(key):
+    """Build a sensor for an API field that is not in the mapping table."""
+    metric_name = "airthings_" + re.sub(r"[^a-z0-9_]", "_", _CAMEL_BOUNDARY.sub("_", key).lower())
+    return Sensor(key, metric_name, f"Airthings sensor value '{key}'")
+
+
+class SensorMap:
+    """Lookup table from API field to sensor, compiled once at startup.
+
+    With ``generic`` enabled, numeric fields that are not in the table are
+    exported under a name derived from the field; otherwise they are dropped.
+    ``allow`` and ``deny`` list API fields or metric names; with ``allow``
+    only those sensors are exported, and sensors in ``deny`` never are.
+    """
+
+    def __init__(self, sensors=SENSORS, generic=False, *, allow=None, deny=None):
+        self.generic = generic
+        self.allow = frozenset(allow) if allow else None
+        self.deny = frozenset(deny or ())
+        self.by_key = {
+            sensor.key: sensor if self.__permitted__(sensor) else None for sensor in sensors
+        }
+        # None marks fields that were looked at and are not exported
+        for key in IGNORED_KEYS:
+            self.by_key[key] = None
+
+    def lookup(self, key, value):
+        """Return the sensor for an API field, or None if it is not exported."""
+        sensor = self.by_key.get(key, _UNKNOWN)
+        if sensor is not _UNKNOWN:
+            return sensor
+        # Only fields missing from the table get here
+        if not self.generic:
+            self.by_key[key] = None
+            return None
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return None
+        sensor = generic_sensor(key)
+        if not self.__permitted__(sensor):
+            sensor = None
+        self.by_key[key] = sensor
+        return sensor
+
+    def metric_names(self, names):
+        """Return the metric names of sensors given by API field or metric name."""
+        metric_names = set(names)
+        for name in names:
+            sensor = self.by_key.get(name)
+            if sensor is not None:
+                metric_names.add(sensor.metric_name)
+            elif self.generic:
+                metric_names.add(generic_sensor(name).metric_name)
+        return frozenset(metric_names)
+
+    def __permitted__(self, sensor):
+        names = (sensor.key, sensor.metric_name)
+        if self.allow is not None and not any(name in self.allow for name in names):
+            return False
+        return not any(name in self.deny for name in names)
+
+    def add_samples(self, families, data, labels, timestamp=None):
+        """Add one sample per exported field of ``data`` to its sensor's metric family.
+
+        ``families`` maps metric names to families and is filled on demand,
+        so only sensors some device reports get a family.
+        """
+        for key, value in data.items():
+            sensor = self.lookup(key, value)
+            if sensor is None or value is None:
+                continue
+            family = families.get(sensor.metric_name)
+            if family is None:
+                family = families[sensor.metric_name] = GaugeMetricFamily(
+                    sensor.metric_name, sensor.documentation, unit=sensor.unit
+                )
+            family.add_sample(
+                sensor.metric_name, value=sensor.convert(value), labels=labels, timestamp=timestamp
+            )
@@ -0,0 +1,56 @@
+import threading
+import time
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.finished_at = None
+
+
+class SingleFlight:
+    """Share one in-flight call, and its recent outcome, between callers.
+
+    Callers arriving while a call runs wait for it and get its result or
+    exception instead of starting their own. Callers arriving within
+    ``window`` seconds after it finished get the same outcome too; ``do()``
+    can override the window per call.
+    """
+
+    def __init__(self, window=0.0, clock=time.monotonic):
+        self.window = window
+        self.clock = clock
+        self.coalesced = 0  # Callers that shared another caller's call
+        self._lock = threading.Lock()
+        self._call = None
+
+    def do(self, fn, window=None):
+        window = self.window if window is None else window
+        with self._lock:
+            call = self._call
+            if call is not None and (
+                not call.done.is_set() or self.clock() - call.finished_at < window
+            ):
+                self.coalesced += 1
+                leader = False
+            else:
+                call = self._call = _Call()
+                leader = True
+
+        if leader:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+                raise
+            finally:
+                call.finished_at = self.clock()
+                call.done.set()
+            return call.result
+
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
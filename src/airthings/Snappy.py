@@ -0,0 +1,122 @@
+# Snappy block format, as used by Prometheus remote-write. The greedy
+# compressor needs no native dependency; it compresses less than the
+# reference implementation, but any Snappy decoder reads its output.
+
+# Matches never reach further back than one block
+_BLOCK_SIZE = 1 << 16
+
+_MIN_MATCH = 4
+
+
+def encode_varint(value):
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def compress(data):
+    data = bytes(data)
+    out = bytearray(encode_varint(len(data)))
+    for start in range(0, len(data), _BLOCK_SIZE):
+        _compress_block(data[start : start + _BLOCK_SIZE], out)
+    return bytes(out)
+
+
+def decompress(data):
+    length, pos = _decode_varint(data, 0)
+    out = bytearray()
+    while pos < len(data):
+        tag = data[pos]
+        kind = tag & 3
+        pos += 1
+        if kind == 0:
+            size = tag >> 2
+            if size >= 60:
+                extra = size - 59
+                size = int.from_bytes(data[pos : pos + extra], "little")
+                pos += extra
+            size += 1
+            out += data[pos : pos + size]
+            pos += size
+            continue
+        if kind == 1:
+            size = ((tag >> 2) & 7) + 4
+            offset = ((tag >> 5) << 8) | data[pos]
+            pos += 1
+        else:
+            width = 2 if kind == 2 else 4
+            size = (tag >> 2) + 1
+            offset = int.from_bytes(data[pos : pos + width], "little")
+            pos += width
+        if not 0 < offset <= len(out):
+            raise ValueError("Corrupt snappy data: copy offset out of range")
+        start = len(out) - offset
+        if offset >= size:
+            out += out[start : start + size]
+        else:
+            # Overlapping copy repeats the last ``offset`` bytes
+            for i in range(size):
+                out.append(out[start + i])
+    if len(out) != length:
+        raise ValueError("Corrupt snappy data: length mismatch")
+    return bytes(out)
+
+
+def _compress_block(block, out):
+    table = {}
+    literal_start = i = 0
+    end = len(block) - _MIN_MATCH
+    while i <= end:
+        key = block[i : i + _MIN_MATCH]
+        candidate = table.get(key)
+        table[key] = i
+        if candidate is None:
+            i += 1
+            continue
+        length = _MIN_MATCH
+        while i + length < len(block) and block[candidate + length] == block[i + length]:
+            length += 1
+        _emit_literal(block[literal_start:i], out)
+        _emit_copy(i - candidate, length, out)
+        i += length
+        literal_start = i
+    _emit_literal(block[literal_start:], out)
+
+
+def _emit_literal(literal, out):
+    if not literal:
+        return
+    size = len(literal) - 1
+    if size < 60:
+        out.append(size << 2)
+    else:
+        extra = (size.bit_length() + 7) // 8
+        out.append((59 + extra) << 2)
+        out += size.to_bytes(extra, "little")
+    out += literal
+
+
+def _emit_copy(offset, length, out):
+    while length > 0:
+        if 4 <= length <= 11 and offset < 2048:
+            out.append(((offset >> 8) << 5) | ((length - 4) << 2) | 1)
+            out.append(offset & 0xFF)
+            return
+        size = min(length, 64)
+        out.append(((size - 1) << 2) | 2)
+        out += offset.to_bytes(2, "little")
+        length -= size
+
+
+def _decode_varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
@@ -0,0 +1,23 @@
+from typing import Dict, NamedTuple
+
+
+class DeviceReading(NamedTuple):
+    """Latest sensor values of one device and when they were fetched."""
+
+    data: dict
+    updated_at: float  # Unix timestamp of the successful fetch
+
+
+class Snapshot(NamedTuple):
+    """Immutable view of the latest readings of all devices.
+
+    A new snapshot is built for every poll and swapped in with a single
+    attribute assignment, so readers never observe a half-updated state.
+    ``generation`` increases with every swap.
+    """
+
+    generation: int
+    readings: Dict[str, DeviceReading]
+
+
+EMPTY_SNAPSHOT = Snapshot(0, {})
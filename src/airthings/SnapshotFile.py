@@ -0,0 +1,113 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"AIRTHSNP"
+
+# Bumped whenever the layout of the snapshot file changes incompatibly
+SNAPSHOT_FILE_VERSION = 1
+
+# Magic, version, snapshot generation, body length, Unix time of the write
+HEADER = struct.Struct("<8sIQQd")
+
+
+class SnapshotFile:
+    """Collector state shared from the leader replica to its followers.
+
+    The file starts with a fixed binary header holding the snapshot
+    generation, followed by the state of ``CloudCollector.export_state()``
+    as JSON. The leader replaces the file atomically with every new
+    snapshot. Readers keep it memory-mapped and, while the file is
+    unchanged, only look at the header, so checking for a new snapshot
+    neither copies nor parses anything. Loading a new snapshot decodes the
+    JSON straight from the mapping, without copying it into a bytes object
+    first.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._map = None
+        self._identity = None  # (inode, mtime) of the mapped file
+        self._warned_version = None
+
+    def write(self, generation, state):
+        """Atomically replace the file with a new snapshot."""
+        body = json.dumps(state, separators=(",", ":")).encode()
+        header = HEADER.pack(MAGIC, SNAPSHOT_FILE_VERSION, generation, len(body), time.time())
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".airthings-snapshot-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(header)
+                f.write(body)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def generation(self):
+        """Return the generation of the current snapshot, or None if there is none."""
+        header = self.__header__()
+        return header[2] if header else None
+
+    def load(self):
+        """Return the state of the current snapshot, or None if there is none."""
+        header = self.__header__()
+        if header is None:
+            return None
+        try:
+            # Released before the mapping may be closed on the next remap
+            with memoryview(self._map)[HEADER.size : HEADER.size + header[3]] as body:
+                return json.loads(str(body, "utf-8"))
+        except ValueError as e:
+            logger.warning("⚠️ Ignoring unreadable snapshot file %s: %s", self.path, e)
+            return None
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        self._map = self._identity = None
+
+    def __header__(self):
+        if not self.__remap__():
+            return None
+        header = HEADER.unpack_from(self._map, 0)
+        magic, version, _, length, _ = header
+        if magic != MAGIC or HEADER.size + length > len(self._map):
+            return None
+        if version != SNAPSHOT_FILE_VERSION:
+            if self._warned_version != version:
+                logger.warning("⚠️ Ignoring snapshot file %s with unknown version", self.path)
+                self._warned_version = version
+            return None
+        return header
+
+    def __remap__(self):
+        """Map the file again if it was replaced; return False if there is none."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self.close()
+            return False
+        if (stat.st_ino, stat.st_mtime_ns) == self._identity:
+            return True
+        self.close()
+        try:
+            with open(self.path, "rb") as f:
+                # The file may have been replaced again since the stat() above
+                stat = os.fstat(f.fileno())
+                if stat.st_size < HEADER.size:
+                    return False
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return False
+        self._identity = (stat.st_ino, stat.st_mtime_ns)
+        return True
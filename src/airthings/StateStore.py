@@ -0,0 +1,49 @@
+import json
+import logging
+import os
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+# Bumped whenever the layout of the state file changes incompatibly
+STATE_VERSION = 1
+
+
+class StateStore:
+    """Keep exporter state in a JSON file that survives restarts.
+
+    The file is replaced atomically on every save, so a crash mid-write
+    leaves the previous state behind instead of a truncated file. A missing,
+    unreadable or outdated file is treated as having no state at all.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        """Return the saved state dict, or None if there is none."""
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning("⚠️ Ignoring unreadable state file %s: %s", self.path, e)
+            return None
+
+        if not isinstance(state, dict) or state.get("version") != STATE_VERSION:
+            logger.warning("⚠️ Ignoring state file %s with unknown version", self.path)
+            return None
+        return state
+
+    def save(self, state):
+        """Atomically replace the state file with ``state``."""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".airthings-state-")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({**state, "version": STATE_VERSION}, f, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
@@ -0,0 +1,119 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Airthings access tokens are valid for three hours; used when the token
+# response does not carry an expires_in field
+DEFAULT_TOKEN_LIFETIME = 10800
+
+# Refresh the token this many seconds before it actually expires
+DEFAULT_REFRESH_MARGIN = 300
+
+
+class TokenManager:  # pylint: disable=too-many-instance-attributes
+    """Cache an OAuth access token and refresh it shortly before it expires.
+
+    ``fetch_token`` is called without arguments and must return a tuple of
+    ``(access_token, expires_in_seconds)``. Once the cached token enters the
+    refresh margin it keeps being served while a background thread fetches
+    its replacement, so scrapes never wait on the token endpoint unless the
+    token has actually expired.
+    """
+
+    def __init__(self, fetch_token, refresh_margin=DEFAULT_REFRESH_MARGIN, clock=time.monotonic):
+        self.fetch_token = fetch_token
+        self.refresh_margin = refresh_margin
+        self.clock = clock
+        self.access_token = None
+        self.expires_at = None
+        self.fetched_at = None
+        self.refresh_count = 0
+        self._lock = threading.Lock()
+        self._background_refresh = None
+
+    def get_token(self):
+        """Return a valid access token, fetching one only when needed."""
+        with self._lock:
+            now = self.clock()
+            if self.access_token is None or now >= self.expires_at:
+                return self.__refresh_locked__()
+
+            if now >= self.expires_at - self.refresh_margin:
+                self.__start_background_refresh__()
+            return self.access_token
+
+    def invalidate(self, access_token=None):
+        """Forget the cached token, e.g. after the API answered 401.
+
+        When ``access_token`` is given the cache is only cleared if it still
+        holds that token, so concurrent callers don't throw away a token that
+        was refreshed in the meantime.
+        """
+        with self._lock:
+            if access_token is None or access_token == self.access_token:
+                self.access_token = None
+                self.expires_at = None
+
+    def export(self):
+        """Return ``(access_token, expires_at, fetched_at)`` with Unix timestamps, or None.
+
+        ``fetched_at`` is None if the fetch time is unknown.
+        """
+        with self._lock:
+            if self.access_token is None:
+                return None
+            offset = time.time() - self.clock()
+            fetched_at = None if self.fetched_at is None else self.fetched_at + offset
+            return self.access_token, self.expires_at + offset, fetched_at
+
+    def restore(self, access_token, expires_at, fetched_at=None):
+        """Cache a token saved by ``export()``, unless it has expired since."""
+        now = time.time()
+        expires_in = expires_at - now
+        if expires_in <= 0:
+            return
+        with self._lock:
+            self.access_token = access_token
+            self.expires_at = self.clock() + expires_in
+            if fetched_at is not None:
+                self.fetched_at = self.clock() - (now - fetched_at)
+
+    def token_age(self):
+        """Seconds since the cached token was fetched, or None without a token."""
+        if self.fetched_at is None:
+            return None
+        return self.clock() - self.fetched_at
+
+    def __refresh_locked__(self):
+        access_token, expires_in = self.fetch_token()
+        self.__store_locked__(access_token, expires_in)
+        return access_token
+
+    def __store_locked__(self, access_token, expires_in):
+        now = self.clock()
+        self.access_token = access_token
+        self.expires_at = now + expires_in
+        self.fetched_at = now
+        self.refresh_count += 1
+        logger.debug("Fetched new access token (expires in %ss)", expires_in)
+
+    def __start_background_refresh__(self):
+        if self._background_refresh is not None and self._background_refresh.is_alive():
+            return
+        self._background_refresh = threading.Thread(
+            target=self.__background_refresh__, name="airthings-token-refresh", daemon=True
+        )
+        self._background_refresh.start()
+
+    def __background_refresh__(self):
+        # Fetch outside the lock so callers keep getting the current token meanwhile
+        try:
+            access_token, expires_in = self.fetch_token()
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            # The old token is still valid; the next call will retry
+            logger.warning("Background token refresh failed: %s", e)
+            return
+        with self._lock:
+            self.__store_locked__(access_token, expires_in)
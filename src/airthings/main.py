@@ -1,77 +1,586 @@
 import argparse
 import logging
-from http.server import BaseHTTPRequestHandler, HTTPServer
+import os
+import signal
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from functools import partial
 
-from prometheus_client import REGISTRY, generate_latest
+from prometheus_client import REGISTRY
 
-from airthings.CloudCollector import CloudCollector, RateLimitException
+from airthings.Accounts import Accounts, load_accounts_config
+from airthings.CloudCollector import (
+    API_URL,
+    CONNECT_TIMEOUT,
+    DEFAULT_COALESCE_WINDOW,
+    DEFAULT_DEVICE_TIMEOUT,
+    DEFAULT_MAX_WORKERS,
+    DEFAULT_SCRAPE_TIMEOUT,
+    REQUEST_TIMEOUT,
+    TOKEN_URL,
+    CloudCollector,
+    RateLimitException,
+)
+from airthings.DeviceDirectory import DEFAULT_DISCOVERY_TTL
+from airthings.ExporterServer import (
+    DEFAULT_MAX_CONCURRENT_SCRAPES,
+    DEFAULT_REQUEST_TIMEOUT,
+    ExporterServer,
+)
+from airthings.Lease import DEFAULT_CHECK_INTERVAL, FileLease
+from airthings.MetricsCache import MetricsCache
+from airthings.Poller import Poller
+from airthings.PushFormats import (
+    DEFAULT_PUSH_BATCH_SIZE,
+    DEFAULT_PUSH_INTERVAL,
+    DEFAULT_PUSH_QUEUE_SIZE,
+    DEFAULT_SPILL_MAX_BYTES,
+    PUSH_FORMATS,
+)
+from airthings.RollingAggregates import DEFAULT_BUCKETS, parse_window
+from airthings.StateStore import StateStore
 
 logger = logging.getLogger(__name__)
 
-parser = argparse.ArgumentParser(
-    prog="airthings-exporter", description="Prometheus exporter for Airthings devices"
-)
-parser.add_argument("--client-id")
-parser.add_argument("--client-secret")
-parser.add_argument("--device-id", action="append")
-parser.add_argument("--port", type=int, default=8000, help="Port to listen on (default: 8000)")
-args = parser.parse_args()
-
-# Create and register collector
-collector = CloudCollector(args.client_id, args.client_secret, args.device_id)
-REGISTRY.register(collector)
-
-# Try initial API check to see if we're rate limited
-try:
-    list(collector.collect())
-    logger.info("✅ Initial API check successful")
-except RateLimitException as e:
-    logger.warning("⚠️ Rate limited at startup (limited until %s)", e.retry_after_time)
-except Exception as e:  # pylint: disable=broad-exception-caught
-    logger.error("❌ Initial API check failed: %s", e)
-
-
-class HealthCheckHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        if self.path == "/health":
-            self.send_response(200)
-            self.send_header("Content-Type", "text/plain")
-            self.end_headers()
-            self.wfile.write(b"OK")
-        elif self.path == "/metrics":
-            try:
-                output = generate_latest(REGISTRY)
-                self.send_response(200)
-                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
-                self.end_headers()
-                self.wfile.write(output)
-            except RateLimitException as e:
-                self.send_response(429)
-                self.send_header("Retry-After", str(e.retry_after_seconds))
-                self.send_header("Content-Type", "text/plain")
-                self.end_headers()
-                message = f"Rate limited. Retry after {e.retry_after_time}"
-                self.wfile.write(message.encode())
-            except Exception as e:  # pylint: disable=broad-exception-caught
-                self.send_response(500)
-                self.send_header("Content-Type", "text/plain")
-                self.end_headers()
-                self.wfile.write(f"Error generating metrics: {str(e)}".encode())
-        else:
-            self.send_response(404)
-            self.end_headers()
-
-    def log_message(self, fmt, *log_args):  # pylint: disable=arguments-differ
-        # Only log errors, suppress normal HTTP logs to reduce noise
-        if "code 4" in str(log_args) or "code 5" in str(log_args):
-            logger.info(fmt, *log_args)
-
-
-def main():
-    server = HTTPServer(("", args.port), HealthCheckHandler)
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="airthings-exporter", description="Prometheus exporter for Airthings devices"
+    )
+    parser.add_argument("--client-id")
+    parser.add_argument("--client-secret")
+    parser.add_argument("--device-id", action="append")
+    parser.add_argument(
+        "--discover",
+        action="store_true",
+        help="Discover devices from the account and fetch them with one request per location",
+    )
+    parser.add_argument(
+        "--discovery-ttl",
+        type=float,
+        default=DEFAULT_DISCOVERY_TTL,
+        help="Seconds between refreshes of the discovered devices "
+        f"(default: {DEFAULT_DISCOVERY_TTL})",
+    )
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on (default: 8000)")
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=0,
+        help="Poll the API in the background every N seconds and serve scrapes from the "
+        "last snapshot (default: 0, poll on every scrape)",
+    )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=DEFAULT_MAX_WORKERS,
+        help=f"Number of devices fetched concurrently (default: {DEFAULT_MAX_WORKERS})",
+    )
+    parser.add_argument(
+        "--scrape-timeout",
+        type=float,
+        default=DEFAULT_SCRAPE_TIMEOUT,
+        help="Deadline in seconds for fetching all devices; slower devices keep their last "
+        f"reading (default: {DEFAULT_SCRAPE_TIMEOUT})",
+    )
+    parser.add_argument(
+        "--device-timeout",
+        type=float,
+        default=DEFAULT_DEVICE_TIMEOUT,
+        help="Deadline in seconds for fetching one device or location, including retries "
+        f"(default: {DEFAULT_DEVICE_TIMEOUT})",
+    )
+    parser.add_argument(
+        "--connect-timeout",
+        type=float,
+        default=CONNECT_TIMEOUT,
+        help=f"Timeout in seconds for connecting to the API (default: {CONNECT_TIMEOUT})",
+    )
+    parser.add_argument(
+        "--read-timeout",
+        type=float,
+        default=REQUEST_TIMEOUT,
+        help=f"Timeout in seconds for reading an API response (default: {REQUEST_TIMEOUT})",
+    )
+    parser.add_argument(
+        "--max-concurrent-scrapes",
+        type=int,
+        default=DEFAULT_MAX_CONCURRENT_SCRAPES,
+        help="Number of /metrics requests served at the same time; further requests get a 503 "
+        f"(default: {DEFAULT_MAX_CONCURRENT_SCRAPES})",
+    )
+    parser.add_argument(
+        "--request-timeout",
+        type=float,
+        default=DEFAULT_REQUEST_TIMEOUT,
+        help="Socket timeout in seconds for HTTP clients of the exporter "
+        f"(default: {DEFAULT_REQUEST_TIMEOUT})",
+    )
+    parser.add_argument(
+        "--coalesce-window",
+        type=float,
+        default=DEFAULT_COALESCE_WINDOW,
+        help="Scrapes within N seconds of the last poll share its result instead of polling "
+        f"again (default: {DEFAULT_COALESCE_WINDOW})",
+    )
+    parser.add_argument(
+        "--generic-sensors",
+        action="store_true",
+        help="Export numeric API fields without a known metric name as airthings_<field>",
+    )
+    parser.add_argument(
+        "--sensor-allow",
+        type=sensor_names,
+        help="Comma-separated API fields or metric names, e.g. temp,co2; only these "
+        "sensors are exported (default: all)",
+    )
+    parser.add_argument(
+        "--sensor-deny",
+        type=sensor_names,
+        help="Comma-separated API fields or metric names of sensors never to export, "
+        "e.g. rssi,battery",
+    )
+    parser.add_argument(
+        "--api-url", default=API_URL, help=f"Base URL of the Airthings API (default: {API_URL})"
+    )
+    parser.add_argument(
+        "--token-url",
+        default=TOKEN_URL,
+        help=f"URL of the Airthings token endpoint (default: {TOKEN_URL})",
+    )
+    parser.add_argument(
+        "--state-file",
+        help="Keep the last readings, access token and rate limit in this file so restarts "
+        "serve cached metrics and don't spend API requests (default: disabled)",
+    )
+    parser.add_argument(
+        "--adaptive-polling",
+        action="store_true",
+        help="Learn how often each device reports from its sample times and only fetch it "
+        "once a new sample is expected",
+    )
+    parser.add_argument(
+        "--sample-timestamps",
+        action="store_true",
+        help="Export sensor values with the time the device took the sample",
+    )
+    parser.add_argument(
+        "--aggregate-windows",
+        type=aggregate_windows,
+        default=(),
+        help="Comma-separated windows, e.g. 1h,24h,7d, over which to export the rolling "
+        "min, max and mean of every sensor (default: disabled)",
+    )
+    parser.add_argument(
+        "--aggregate-buckets",
+        type=int,
+        default=DEFAULT_BUCKETS,
+        help="Buckets per aggregate window; more buckets move the window in smaller steps "
+        f"at the cost of memory (default: {DEFAULT_BUCKETS})",
+    )
+    parser.add_argument(
+        "--device-metadata",
+        action="store_true",
+        help="Export airthings_device_info with the name, model and location of each device; "
+        "needs an API client with the read:device scope",
+    )
+    parser.add_argument(
+        "--device-labels",
+        action="store_true",
+        help="Add name and location labels to sensor values (implies --device-metadata)",
+    )
+    parser.add_argument(
+        "--accounts-file",
+        help="JSON file with credentials of several Airthings accounts, served on "
+        "/probe?account=<name>",
+    )
+    parser.add_argument(
+        "--push-url",
+        help="Push new readings to this Prometheus remote-write or OTLP/HTTP metrics URL; "
+        "needs --poll-interval (default: disabled)",
+    )
+    parser.add_argument(
+        "--push-format",
+        choices=sorted(PUSH_FORMATS),
+        default="remote-write",
+        help="Protocol of --push-url (default: remote-write)",
+    )
+    parser.add_argument(
+        "--push-header",
+        action="append",
+        default=[],
+        metavar="NAME: VALUE",
+        help="HTTP header sent with every push, e.g. for authorization; may be repeated",
+    )
+    parser.add_argument(
+        "--push-batch-size",
+        type=int,
+        default=DEFAULT_PUSH_BATCH_SIZE,
+        help=f"Samples per push request (default: {DEFAULT_PUSH_BATCH_SIZE})",
+    )
+    parser.add_argument(
+        "--push-interval",
+        type=float,
+        default=DEFAULT_PUSH_INTERVAL,
+        help="Seconds after which a partly filled batch is pushed "
+        f"(default: {DEFAULT_PUSH_INTERVAL})",
+    )
+    parser.add_argument(
+        "--push-queue-size",
+        type=int,
+        default=DEFAULT_PUSH_QUEUE_SIZE,
+        help="Samples held in memory for pushing; the oldest are dropped beyond this "
+        f"(default: {DEFAULT_PUSH_QUEUE_SIZE})",
+    )
+    parser.add_argument(
+        "--push-spill-dir",
+        help="Directory for batches that could not be pushed, sent once the endpoint is "
+        "back (default: disabled, such batches are dropped)",
+    )
+    parser.add_argument(
+        "--push-spill-max-bytes",
+        type=int,
+        default=DEFAULT_SPILL_MAX_BYTES,
+        help=f"Size limit of --push-spill-dir (default: {DEFAULT_SPILL_MAX_BYTES})",
+    )
+    parser.add_argument(
+        "--disable-pull",
+        action="store_true",
+        help="Don't serve /metrics, e.g. when readings are only pushed",
+    )
+    parser.add_argument(
+        "--ha-dir",
+        help="Directory on a volume shared by all replicas; they elect a leader through a "
+        "lock file there, only the leader polls the API and the others serve its snapshot; "
+        "needs --poll-interval (default: disabled)",
+    )
+    parser.add_argument(
+        "--ha-check-interval",
+        type=float,
+        default=DEFAULT_CHECK_INTERVAL,
+        help="Seconds between checks of a follower for a new snapshot or a missing leader "
+        f"(default: {DEFAULT_CHECK_INTERVAL})",
+    )
+    parser.add_argument(
+        "--debug-endpoints",
+        action="store_true",
+        help="Serve /debug/profile, /debug/memory and /debug/state for troubleshooting; "
+        "don't expose them publicly",
+    )
+    return parser
+
+
+def build_backfill_parser():
+    parser = argparse.ArgumentParser(
+        prog="airthings-exporter backfill",
+        description="Write the sample history of devices as OpenMetrics for "
+        "'promtool tsdb create-blocks-from openmetrics'",
+    )
+    parser.add_argument("--client-id")
+    parser.add_argument("--client-secret")
+    parser.add_argument(
+        "--device-id",
+        action="append",
+        help="Device to backfill; may be repeated (default: all devices of the account)",
+    )
+    parser.add_argument(
+        "--from",
+        dest="start",
+        type=timestamp,
+        required=True,
+        help="Start of the range, e.g. 2024-05-01 or 2024-05-01T12:00:00Z",
+    )
+    parser.add_argument("--to", dest="end", type=timestamp, help="End of the range (default: now)")
+    parser.add_argument(
+        "--output",
+        required=True,
+        help="OpenMetrics file to write; progress is kept in <output>.checkpoint so an "
+        "interrupted run continues where it stopped",
+    )
+    parser.add_argument("--api-url", default=API_URL)
+    parser.add_argument("--token-url", default=TOKEN_URL)
+    parser.add_argument("--connect-timeout", type=float, default=CONNECT_TIMEOUT)
+    parser.add_argument("--read-timeout", type=float, default=REQUEST_TIMEOUT)
+    return parser
+
+
+def timestamp(text):
+    """Parse an ISO 8601 date or time, UTC unless it has an offset, into Unix time."""
+    try:
+        parsed = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(f"Invalid time '{text}'") from e
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def aggregate_windows(text):
+    try:
+        return tuple(parse_window(window) for window in text.split(",") if window.strip())
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e)) from e
+
+
+def sensor_names(text):
+    names = tuple(name.strip() for name in text.split(",") if name.strip())
+    if not names:
+        raise argparse.ArgumentTypeError("Expected at least one sensor")
+    return names
+
+
+def parse_args(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.push_url and not args.poll_interval:
+        parser.error("--push-url needs --poll-interval")
+    if args.ha_dir and not args.poll_interval:
+        parser.error("--ha-dir needs --poll-interval")
+    return args
+
+
+def collector_options(args):
+    """Collector settings shared by the default collector and all accounts."""
+    return {
+        "poll_on_collect": not args.poll_interval,
+        "max_workers": args.max_workers,
+        "scrape_timeout": args.scrape_timeout,
+        "device_timeout": args.device_timeout,
+        "connect_timeout": args.connect_timeout,
+        "read_timeout": args.read_timeout,
+        "discovery_ttl": args.discovery_ttl,
+        "coalesce_window": args.coalesce_window,
+        "generic_sensors": args.generic_sensors,
+        "sensor_allow": args.sensor_allow,
+        "sensor_deny": args.sensor_deny,
+        "api_url": args.api_url,
+        "token_url": args.token_url,
+        "adaptive": args.adaptive_polling,
+        "sample_timestamps": args.sample_timestamps,
+        "aggregate_windows": args.aggregate_windows,
+        "aggregate_buckets": args.aggregate_buckets,
+        "device_metadata": args.device_metadata,
+        "device_labels": args.device_labels,
+    }
+
+
+def restore_state(collector):
+    state = collector.state_store.load() if collector.state_store else None
+    if state is not None:
+        collector.restore_state(state)
+        logger.info("💾 Restored state with %d device reading(s)", len(collector.snapshot.readings))
+
+
+def create_account_collector(args, settings):
+    """Build the collector of one account from the accounts file."""
+    state_file = settings.get("state_file")
+    collector = CloudCollector(
+        settings["client_id"],
+        settings["client_secret"],
+        settings.get("device_ids"),
+        discover=settings.get("discover", args.discover),
+        state_store=StateStore(state_file) if state_file else None,
+        **collector_options(args),
+    )
+    restore_state(collector)
+    return collector
+
+
+def create_exporter(args, registry=REGISTRY):
+    """Build the collectors and bind the HTTP server without calling the API.
+
+    Returns ``(server, collector)``; the collectors of ``--accounts-file``
+    are available as ``server.accounts``. Saved state is restored here, so a
+    restarted exporter serves its cached metrics as soon as it listens.
+    """
+    collector = CloudCollector(
+        args.client_id,
+        args.client_secret,
+        args.device_id,
+        discover=args.discover,
+        state_store=StateStore(args.state_file) if args.state_file else None,
+        **collector_options(args),
+    )
+    restore_state(collector)
+    registry.register(collector)
+
+    accounts = None
+    if args.accounts_file:
+        accounts = Accounts(
+            load_accounts_config(args.accounts_file), partial(create_account_collector, args)
+        )
+        logger.info("Serving %d account(s) on /probe", len(accounts))
+
+    debug = None
+    if args.debug_endpoints:
+        # pylint: disable-next=import-outside-toplevel
+        from airthings.DebugEndpoints import DebugEndpoints
+
+        debug = DebugEndpoints(collector, accounts)
+
+    server = ExporterServer(
+        ("", args.port),
+        None if args.disable_pull else MetricsCache(registry, collector),
+        max_concurrent_scrapes=args.max_concurrent_scrapes,
+        request_timeout=args.request_timeout,
+        ready_check=collector.has_data,
+        accounts=accounts,
+        debug=debug,
+    )
+    return server, collector
+
+
+def warm_up(collector, args, accounts=None):
+    """Start fetching data in the background so startup never waits on the API.
+
+    With ``--poll-interval`` every collector gets a Poller, or with
+    ``--ha-dir`` a LeaderElection; the started pollers are returned.
+    Otherwise only the default collector is checked once, and accounts are
+    polled when they are first probed.
+    """
+    if args.ha_dir:
+        collectors = [("default", collector)]
+        collectors += [(f"account-{a.name}", a.collector) for a in accounts or ()]
+        return [start_leader_election(c, name, args) for name, c in collectors]
+    if args.poll_interval:
+        collectors = [collector] + [account.collector for account in accounts or ()]
+        pollers = [start_poller(c, args.poll_interval) for c in collectors]
+        return pollers
+
+    if not collector.has_data():
+        threading.Thread(
+            target=initial_api_check, args=(collector,), name="airthings-warm-up", daemon=True
+        ).start()
+    return []
+
+
+def create_pusher(args, collector, accounts=None):
+    """Start pushing the readings of every collector, if --push-url is set."""
+    if not args.push_url:
+        return None
+    from airthings.Pusher import Pusher  # pylint: disable=import-outside-toplevel
+
+    headers = dict((part.strip() for part in header.split(":", 1)) for header in args.push_header)
+    pusher = Pusher(
+        args.push_url,
+        args.push_format,
+        batch_size=args.push_batch_size,
+        flush_interval=args.push_interval,
+        queue_size=args.push_queue_size,
+        spill_dir=args.push_spill_dir,
+        spill_max_bytes=args.push_spill_max_bytes,
+        headers=headers,
+    )
+    for c in [collector] + [account.collector for account in accounts or ()]:
+        pusher.attach(c)
+    logger.info("📤 Pushing readings to %s (%s)", args.push_url, args.push_format)
+    return pusher.start()
+
+
+def start_poller(collector, interval):
+    initial_delay = 0
+    if collector.snapshot.readings:
+        # Don't poll again before a restored snapshot is a full interval old
+        last_update = max(r.updated_at for r in collector.snapshot.readings.values())
+        initial_delay = max(0, last_update + interval - time.time())
+    poller = Poller(collector, interval, initial_delay=initial_delay)
+    poller.start()
+    return poller
+
+
+def start_leader_election(collector, name, args):
+    from airthings.LeaderElection import LeaderElection  # pylint: disable=import-outside-toplevel
+    from airthings.SnapshotFile import SnapshotFile  # pylint: disable=import-outside-toplevel
+
+    os.makedirs(args.ha_dir, exist_ok=True)
+    election = LeaderElection(
+        collector,
+        FileLease(os.path.join(args.ha_dir, f"{name}.lease")),
+        SnapshotFile(os.path.join(args.ha_dir, f"{name}.snapshot")),
+        args.poll_interval,
+        name=name,
+        check_interval=args.ha_check_interval,
+    )
+    return election.start()
+
+
+def initial_api_check(collector):
+    # Fill the snapshot and find out whether we're rate limited
+    try:
+        collector.poll()
+        logger.info("✅ Initial API check successful")
+    except RateLimitException as e:
+        logger.warning("⚠️ Rate limited at startup (limited until %s)", e.retry_after_time)
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        logger.error("❌ Initial API check failed: %s", e)
+
+
+def backfill(argv):
+    from airthings.Backfill import Backfill  # pylint: disable=import-outside-toplevel
+
+    args = build_backfill_parser().parse_args(argv)
+    collector = CloudCollector(
+        args.client_id,
+        args.client_secret,
+        args.device_id,
+        poll_on_collect=False,
+        api_url=args.api_url,
+        token_url=args.token_url,
+        connect_timeout=args.connect_timeout,
+        read_timeout=args.read_timeout,
+        # Sample history needs the read:device scope, which discovery asks for
+        discover=True,
+    )
+    device_ids = args.device_id or list(
+        collector.directory.get_devices(collector.token_manager.get_token())
+    )
+    end = args.end if args.end is not None else time.time()
+    Backfill(collector, args.output, start=args.start, end=end).run(device_ids)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == "backfill":
+        backfill(argv[1:])
+        return
+
+    args = parse_args(argv)
+    server, collector = create_exporter(args)
+    pusher = create_pusher(args, collector, server.accounts)
+    pollers = warm_up(collector, args, server.accounts)
+
+    def shutdown(signum, _frame):
+        logger.info("Received %s, shutting down", signal.Signals(signum).name)
+        # shutdown() waits for serve_forever() to return, so it can't run on this thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
     print(f"Now listening on port {args.port}")
-    print("Endpoints: /metrics, /health")
-    server.serve_forever()
+    endpoints = ["/health", "/ready"]
+    if server.metrics_cache is not None:
+        endpoints.insert(0, "/metrics")
+    if server.accounts:
+        endpoints.append("/probe")
+    if server.debug is not None:
+        endpoints += ["/debug/profile", "/debug/memory", "/debug/state"]
+    print(f"Endpoints: {', '.join(endpoints)}")
+    try:
+        server.serve_forever()
+    finally:
+        # Waits for in-flight requests to finish
+        server.server_close()
+        for poller in pollers:
+            poller.stop()
+        if pusher is not None:
+            pusher.stop()
+        collector.save_state()
+        for account in server.accounts or ():
+            account.collector.save_state()
 
 
 if __name__ == "__main__":
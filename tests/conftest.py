@@ -1,5 +1,7 @@
 import pytest
 
+from airthings.CloudCollector import CloudCollector
+
 
 @pytest.fixture
 def mock_access_token():
@@ -36,3 +38,26 @@ def mock_device_data():
         "temp": 22.5,
         "voc": 150,
     }
+
+
+@pytest.fixture(name="make_collector")
+def make_collector_fixture():
+    """Factory of collectors talking to a FakeAirthingsAPI.
+
+    Collectors fetch all devices of the fake API unless ``device_ids`` is
+    given, poll in the background like with --poll-interval and don't
+    coalesce polls; keyword arguments override any option.
+    """
+
+    def make_collector(api, device_ids=None, **options):
+        options = {"poll_on_collect": False, "coalesce_window": 0, **options}
+        return CloudCollector(
+            "client_id",
+            "client_secret",
+            api.device_ids if device_ids is None else device_ids,
+            api_url=api.api_url,
+            token_url=api.token_url,
+            **options,
+        )
+
+    return make_collector
@@ -0,0 +1,250 @@
+"""Local stand-in for the Airthings token and device API.
+
+Serves a fleet of synthetic devices with configurable latency, jitter and
+rate limiting, and counts the requests it receives per endpoint.
+"""
+
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+ACCESS_TOKEN = "fake-access-token"
+
+DEVICE_PATH = re.compile(r"^/v1/devices/([^/]+)/latest-samples$")
+LOCATION_PATH = re.compile(r"^/v1/locations/([^/]+)/latest-samples$")
+HISTORY_PATH = re.compile(r"^/v1/devices/([^/]+)/samples$")
+
+# Interval between the samples served by the history endpoint (in seconds)
+HISTORY_INTERVAL = 300
+
+
+def device_data(index, now):
+    """Return plausible, slowly varying sensor values for a synthetic device."""
+    return {
+        "battery": 100 - index % 50,
+        "co2": 400 + index % 600,
+        "humidity": 30.0 + index % 40,
+        "pm1": float(index % 10),
+        "pm25": float(index % 15),
+        "pressure": 1000.0 + index % 30,
+        "radonShortTermAvg": float(index % 150),
+        "temp": 18.0 + (index % 80) / 10,
+        "time": int(now) - index % 300,
+        "voc": 50 + index % 500,
+    }
+
+
+def history_page(index, query, page_size):
+    """Return one page of columnar history between the ``start`` and ``end`` query times."""
+    start, end = (
+        int(datetime.fromisoformat(query[name][0].replace("Z", "+00:00")).timestamp())
+        for name in ("start", "end")
+    )
+    first = -(-start // HISTORY_INTERVAL) * HISTORY_INTERVAL
+    times = list(range(first, end + 1, HISTORY_INTERVAL))
+    offset = int(query.get("cursor", ["0"])[0])
+    samples = [dict(device_data(index, t), time=t) for t in times[offset : offset + page_size]]
+
+    page = {"data": {key: [sample[key] for sample in samples] for key in device_data(index, 0)}}
+    if offset + page_size < len(times):
+        page["cursor"] = str(offset + page_size)
+    return page
+
+
+class FakeAirthingsAPI(ThreadingHTTPServer):
+    """Fake Airthings API listening on a local port.
+
+    ``latency`` and ``jitter`` delay every response in seconds. At most
+    ``rate_limit`` device API requests are answered per ``rate_limit_window``
+    seconds; further requests get a 429 with ``X-RateLimit-*`` headers, as do
+    requests picked with probability ``throttle_probability``. The history
+    endpoint serves a sample every five minutes in pages of
+    ``history_page_size``.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        *,
+        devices=10,
+        devices_per_location=50,
+        latency=0.0,
+        jitter=0.0,
+        rate_limit=None,
+        rate_limit_window=3600,
+        throttle_probability=0.0,
+        history_page_size=100,
+        port=0,
+    ):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.device_ids = [f"{2930000000 + i}" for i in range(devices)]
+        self.device_index = {device_id: i for i, device_id in enumerate(self.device_ids)}
+        self.locations = {
+            f"location-{i // devices_per_location}": self.device_ids[i : i + devices_per_location]
+            for i in range(0, devices, devices_per_location)
+        }
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.rate_limit_window = rate_limit_window
+        self.throttle_probability = throttle_probability
+        self.history_page_size = history_page_size
+        self.requests = Counter()
+        self._lock = threading.Lock()
+        self._window_started = time.time()
+        self._window_requests = 0
+        self._thread = None
+
+    @property
+    def api_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    @property
+    def token_url(self):
+        return f"{self.api_url}/token"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def total_requests(self, exclude_token=True):
+        with self._lock:
+            return sum(
+                count
+                for endpoint, count in self.requests.items()
+                if not (exclude_token and endpoint == "token")
+            )
+
+    def count_request(self, endpoint):
+        """Record a request and return the rate limit state after it."""
+        with self._lock:
+            self.requests[endpoint] += 1
+            now = time.time()
+            if now - self._window_started >= self.rate_limit_window:
+                self._window_started = now
+                self._window_requests = 0
+            reset_at = int(self._window_started + self.rate_limit_window)
+            if endpoint == "token":
+                return False, None, reset_at
+            self._window_requests += 1
+            limited = self.rate_limit is not None and self._window_requests > self.rate_limit
+            if random.random() < self.throttle_probability:
+                limited = True
+            remaining = None
+            if self.rate_limit is not None:
+                remaining = max(0, self.rate_limit - self._window_requests)
+            return limited, remaining, reset_at
+
+    def delay(self):
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        if urlparse(self.path).path != "/v1/token":
+            self.__send_json__(404, {"error": "not found"})
+            return
+        self.server.count_request("token")
+        self.server.delay()
+        self.__send_json__(200, {"access_token": ACCESS_TOKEN, "expires_in": 10800})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        endpoint, body = self.__route__(url.path, parse_qs(url.query))
+        if endpoint is None:
+            self.__send_json__(404, {"error": "not found"})
+            return
+
+        limited, remaining, reset_at = self.server.count_request(endpoint)
+        self.server.delay()
+        headers = {"X-RateLimit-Reset": str(reset_at)}
+        if remaining is not None:
+            headers["X-RateLimit-Limit"] = str(self.server.rate_limit)
+            headers["X-RateLimit-Remaining"] = str(remaining)
+
+        if self.headers.get("Authorization") != f"Bearer {ACCESS_TOKEN}":
+            self.__send_json__(401, {"error": "unauthorized"}, headers)
+        elif limited:
+            headers["X-RateLimit-Retry-After"] = str(max(0, reset_at - int(time.time())))
+            self.__send_json__(429, {"error": "rate limited"}, headers)
+        else:
+            self.__send_json__(200, body(), headers)
+
+    def __route__(self, path, query):
+        api = self.server
+        now = time.time()
+        if path == "/v1/devices":
+            return "devices", lambda: {
+                "devices": [
+                    {
+                        "id": device_id,
+                        "deviceType": "WAVE_PLUS",
+                        "sensors": ["temp", "humidity", "co2"],
+                        "segment": {"name": f"Room {device_id[-4:]}"},
+                        "location": {"id": location_id},
+                    }
+                    for location_id, device_ids in api.locations.items()
+                    for device_id in device_ids
+                ]
+            }
+        if path == "/v1/locations":
+            return "locations", lambda: {
+                "locations": [
+                    {"id": location_id, "name": location_id} for location_id in api.locations
+                ]
+            }
+        match = DEVICE_PATH.match(path)
+        if match and match.group(1) in api.device_index:
+            index = api.device_index[match.group(1)]
+            return "devices/latest-samples", lambda: {"data": device_data(index, now)}
+        match = LOCATION_PATH.match(path)
+        if match and match.group(1) in api.locations:
+            device_ids = api.locations[match.group(1)]
+            return "locations/latest-samples", lambda: {
+                "devices": [
+                    {"id": device_id, "data": device_data(api.device_index[device_id], now)}
+                    for device_id in device_ids
+                ]
+            }
+        match = HISTORY_PATH.match(path)
+        if match and match.group(1) in api.device_index:
+            index = api.device_index[match.group(1)]
+            return "devices/samples", lambda: history_page(index, query, api.history_page_size)
+        return None, None
+
+    def __send_json__(self, status, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
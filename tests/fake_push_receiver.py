@@ -0,0 +1,120 @@
+"""Local stand-in for a Prometheus remote-write or OTLP/HTTP receiver.
+
+Decodes every pushed request into ``(metric_name, device_id, value,
+timestamp_seconds)`` tuples, and can fail a number of requests first to
+simulate an outage.
+"""
+
+import gzip
+import json
+import struct
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from airthings import Snappy
+
+
+def _varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def parse_message(data):
+    """Return ``(field_number, value)`` pairs of a protobuf message."""
+    fields = []
+    pos = 0
+    while pos < len(data):
+        key, pos = _varint(data, pos)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, pos = _varint(data, pos)
+        elif wire_type == 1:
+            (value,) = struct.unpack("<d", data[pos : pos + 8])
+            pos += 8
+        elif wire_type == 2:
+            length, pos = _varint(data, pos)
+            value = data[pos : pos + length]
+            pos += length
+        else:
+            raise ValueError(f"Unexpected wire type {wire_type}")
+        fields.append((number, value))
+    return fields
+
+
+def decode_remote_write(body):
+    samples = []
+    for _, series in parse_message(Snappy.decompress(body)):
+        labels, points = {}, []
+        for number, value in parse_message(series):
+            if number == 1:
+                label = dict(parse_message(value))
+                labels[label[1].decode()] = label[2].decode()
+            else:
+                point = dict(parse_message(value))
+                points.append((point[1], point[2] / 1000))
+        samples += [(labels["__name__"], labels["device_id"], v, t) for v, t in points]
+    return samples
+
+
+def decode_otlp(body):
+    samples = []
+    payload = json.loads(gzip.decompress(body))
+    for resource in payload["resourceMetrics"]:
+        for scope in resource["scopeMetrics"]:
+            for metric in scope["metrics"]:
+                for point in metric["gauge"]["dataPoints"]:
+                    device_id = point["attributes"][0]["value"]["stringValue"]
+                    timestamp = int(point["timeUnixNano"]) / 1e9
+                    samples.append((metric["name"], device_id, point["asDouble"], timestamp))
+    return samples
+
+
+class FakePushReceiver(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, *, fail_requests=0, fail_status=503):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.fail_requests = fail_requests
+        self.fail_status = fail_status
+        self.requests = []  # (path, headers) of every request
+        self.samples = []
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        server = self.server
+        with server._lock:  # pylint: disable=protected-access
+            server.requests.append((self.path, dict(self.headers)))
+            if server.fail_requests > 0:
+                server.fail_requests -= 1
+                status = server.fail_status
+            else:
+                decode = decode_otlp if self.path == "/v1/metrics" else decode_remote_write
+                server.samples += decode(body)
+                status = 204
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
@@ -0,0 +1,170 @@
+"""Benchmark the exporter against a local fake Airthings API.
+
+Starts the fake API and the real exporter (``python -m airthings.main``) in
+a subprocess, scrapes /metrics repeatedly and reports scrape latency, API
+calls per scrape, CPU time and RSS of the exporter process.
+
+    python -m tests.loadtest --devices 1000 --latency 0.05 --scrapes 20
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import requests
+
+from tests.fake_airthings_api import FakeAirthingsAPI
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def process_stats(pid):
+    """Return (cpu_seconds, rss_bytes) of a process, or (None, None) without /proc."""
+    try:
+        with open(f"/proc/{pid}/stat", encoding="ascii") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/statm", encoding="ascii") as f:
+            rss_pages = int(f.read().split()[1])
+    except OSError:
+        return None, None
+    ticks = os.sysconf("SC_CLK_TCK")
+    cpu_seconds = (int(fields[11]) + int(fields[12])) / ticks
+    return cpu_seconds, rss_pages * os.sysconf("SC_PAGE_SIZE")
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def wait_until_listening(url, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Exporter exited with code {process.returncode}")
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.05)
+    raise TimeoutError(f"Exporter did not start listening on {url}")
+
+
+def wait_until_ready(url, timeout=30):
+    """Wait for the exporter's first poll; a rate-limited exporter never gets ready."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if requests.get(url, timeout=1).status_code == 200:
+            return
+        time.sleep(0.05)
+
+
+def run(
+    *,
+    devices=10,
+    scrapes=10,
+    latency=0.0,
+    jitter=0.0,
+    rate_limit=None,
+    throttle_probability=0.0,
+    exporter_args=(),
+):
+    """Run the benchmark and return its results as a dict."""
+    with FakeAirthingsAPI(
+        devices=devices,
+        latency=latency,
+        jitter=jitter,
+        rate_limit=rate_limit,
+        throttle_probability=throttle_probability,
+    ) as api:
+        port = free_port()
+        command = [
+            sys.executable,
+            "-m",
+            "airthings.main",
+            "--client-id",
+            "loadtest",
+            "--client-secret",
+            "loadtest",
+            "--api-url",
+            api.api_url,
+            "--token-url",
+            api.token_url,
+            "--port",
+            str(port),
+            *exporter_args,
+        ]
+        if "--discover" not in exporter_args:
+            for device_id in api.device_ids:
+                command += ["--device-id", device_id]
+
+        with subprocess.Popen(
+            command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        ) as process:
+            try:
+                base_url = f"http://127.0.0.1:{port}"
+                wait_until_listening(f"{base_url}/health", process)
+                wait_until_ready(f"{base_url}/ready")
+                cpu_before, _ = process_stats(process.pid)
+                calls_before = api.total_requests()
+
+                latencies = []
+                statuses = []
+                with requests.Session() as session:
+                    for _ in range(scrapes):
+                        started = time.perf_counter()
+                        response = session.get(f"{base_url}/metrics", timeout=120)
+                        latencies.append(time.perf_counter() - started)
+                        statuses.append(response.status_code)
+
+                cpu_after, rss = process_stats(process.pid)
+                api_calls = api.total_requests() - calls_before
+            finally:
+                process.terminate()
+                process.wait(timeout=30)
+
+    return {
+        "devices": devices,
+        "scrapes": scrapes,
+        "scrape_p50_seconds": statistics.median(latencies),
+        "scrape_p99_seconds": percentile(latencies, 0.99),
+        "api_calls_per_scrape": api_calls / scrapes,
+        "cpu_seconds": None if cpu_before is None else cpu_after - cpu_before,
+        "rss_bytes": rss,
+        "status_codes": dict(sorted((code, statuses.count(code)) for code in set(statuses))),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=100, help="Fleet size (1 to 5000)")
+    parser.add_argument("--scrapes", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.05, help="API latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.02, help="API jitter in seconds")
+    parser.add_argument("--rate-limit", type=int, help="API requests allowed per hour")
+    parser.add_argument("--throttle-probability", type=float, default=0.0)
+    args, exporter_args = parser.parse_known_args(argv)
+
+    results = run(
+        devices=args.devices,
+        scrapes=args.scrapes,
+        latency=args.latency,
+        jitter=args.jitter,
+        rate_limit=args.rate_limit,
+        throttle_probability=args.throttle_probability,
+        exporter_args=exporter_args,
+    )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import json
+import threading
+import time
+from unittest.mock import Mock
+
+import pytest
+import requests
+
+from airthings.Accounts import Accounts, load_accounts_config
+from airthings.CloudCollector import CloudCollector
+from airthings.ExporterServer import ExporterServer
+
+
+def api_session(status_code, mock_device_data):
+    """Session answering every API call with the given status."""
+    session = Mock()
+    session.post.return_value = Mock(status_code=200, headers={})
+    session.post.return_value.json.return_value = {"access_token": "token"}
+    session.get.return_value = Mock(status_code=status_code)
+    session.get.return_value.headers = {"X-RateLimit-Reset": str(int(time.time()) + 600)}
+    session.get.return_value.json.return_value = {"data": mock_device_data}
+    return session
+
+
+class TestAccounts:
+    def test_load_config(self, tmp_path):
+        """Test that accounts are read from the config file."""
+        path = tmp_path / "accounts.json"
+        path.write_text(
+            json.dumps({"accounts": {"a": {"client_id": "id", "client_secret": "secret"}}})
+        )
+        assert load_accounts_config(str(path)) == {
+            "a": {"client_id": "id", "client_secret": "secret"}
+        }
+
+    def test_load_config_rejects_incomplete_accounts(self, tmp_path):
+        """Test that accounts without credentials are reported by name."""
+        path = tmp_path / "accounts.json"
+        path.write_text(json.dumps({"accounts": {"a": {"client_id": "id"}}}))
+        with pytest.raises(ValueError, match="'a' is missing client_secret"):
+            load_accounts_config(str(path))
+
+        path.write_text(json.dumps({"accounts": {}}))
+        with pytest.raises(ValueError):
+            load_accounts_config(str(path))
+
+    def test_probe_isolates_rate_limited_account(self, mock_device_data):
+        """Test that a throttled account doesn't affect the others."""
+        sessions = {
+            "throttled": api_session(429, mock_device_data),
+            "healthy": api_session(200, mock_device_data),
+        }
+        accounts = Accounts(
+            {name: {"client_id": name, "client_secret": "secret"} for name in sessions},
+            lambda settings: CloudCollector(
+                settings["client_id"],
+                settings["client_secret"],
+                ["device1"],
+                session=sessions[settings["client_id"]],
+            ),
+        )
+        server = ExporterServer(("127.0.0.1", 0), Mock(), accounts=accounts)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_address[1]}"
+        try:
+            throttled = requests.get(f"{base_url}/probe?account=throttled", timeout=5)
+            healthy = requests.get(f"{base_url}/probe?account=healthy", timeout=5)
+            unknown = requests.get(f"{base_url}/probe?account=other", timeout=5)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        assert throttled.status_code == 429
+        assert healthy.status_code == 200
+        assert 'airthings_co2_parts_per_million{device_id="device1"} 450.0' in healthy.text
+        assert "process_cpu_seconds_total" not in healthy.text
+        assert unknown.status_code == 404
+        assert accounts.get("throttled").collector.rate_limit_until is not None
+        assert accounts.get("healthy").collector.rate_limit_until is None
@@ -0,0 +1,107 @@
+import os
+
+import pytest
+from prometheus_client.openmetrics.parser import text_string_to_metric_families
+
+from airthings.Backfill import Backfill, history_rows
+from airthings.CloudCollector import RateLimitException
+from airthings.main import main
+from tests.fake_airthings_api import FakeAirthingsAPI
+
+START = 1700000000
+END = START + 86400
+
+
+def samples(path):
+    with open(path, encoding="utf-8") as f:
+        families = text_string_to_metric_families(f.read())
+        return [
+            (s.name, s.labels["device_id"], s.value, float(s.timestamp))
+            for f in families
+            for s in f.samples
+        ]
+
+
+class TestBackfill:
+    def test_history_rows(self):
+        """Test that columnar pages are turned into one dict per sample."""
+        page = {"time": [1, 2], "temp": [20.5, 21.0], "co2": [400]}
+        assert list(history_rows(page)) == [
+            {"time": 1, "temp": 20.5, "co2": 400},
+            {"time": 2, "temp": 21.0},
+        ]
+        assert not list(history_rows({}))
+
+    def test_subcommand_writes_openmetrics(self, tmp_path):
+        """Test that the backfill subcommand writes every page of every device."""
+        output = tmp_path / "history.om"
+        with FakeAirthingsAPI(devices=2, history_page_size=100) as api:
+            main(
+                ["backfill", "--client-id", "id", "--client-secret", "secret"]
+                + ["--api-url", api.api_url, "--token-url", api.token_url]
+                + ["--from", "2023-11-14T22:13:20Z", "--to", "2023-11-15T22:13:20Z"]
+                + ["--output", str(output)]
+            )
+            # Two devices found by discovery, 288 samples each in pages of 100
+            assert api.requests["devices/samples"] == 6
+
+        text = output.read_text()
+        assert text.endswith("# EOF\n")
+        assert "# UNIT airthings_temperature_celsius celsius\n" in text
+        temperatures = [s for s in samples(output) if s[0] == "airthings_temperature_celsius"]
+        assert len(temperatures) == 2 * 288
+        assert {s[3] for s in temperatures} == set(range(1700000100, END + 1, 300))
+        assert os.listdir(tmp_path) == ["history.om"]
+
+    def test_resume_from_checkpoint(self, tmp_path, make_collector):
+        """Test that an interrupted backfill continues from its checkpoint."""
+        with FakeAirthingsAPI(devices=2, history_page_size=100) as api:
+            Backfill(make_collector(api), str(tmp_path / "full.om"), start=START, end=END).run(
+                api.device_ids
+            )
+
+            collector = make_collector(api)
+            get_sample_history = collector.get_sample_history
+            calls = []
+
+            def fail_on_fourth_page(*args):
+                calls.append(args)
+                if len(calls) == 4:
+                    raise ConnectionError("connection reset")
+                return get_sample_history(*args)
+
+            collector.get_sample_history = fail_on_fourth_page
+            output = str(tmp_path / "resumed.om")
+            with pytest.raises(ConnectionError):
+                Backfill(collector, output, start=START, end=END).run(api.device_ids)
+            assert os.path.exists(f"{output}.checkpoint")
+
+            requests_before = api.requests["devices/samples"]
+            Backfill(make_collector(api), output, start=START, end=END).run(api.device_ids)
+            # Only the three pages of the second device are fetched again
+            assert api.requests["devices/samples"] - requests_before == 3
+
+        assert samples(output) == samples(tmp_path / "full.om")
+        assert not os.path.exists(f"{output}.checkpoint")
+
+    def test_waits_out_rate_limits(self, tmp_path, make_collector):
+        """Test that a rate limited page is requested again after the advertised wait."""
+        with FakeAirthingsAPI(devices=1) as api:
+            collector = make_collector(api)
+            get_sample_history = collector.get_sample_history
+            responses = [RateLimitException(120, "later")]
+
+            def rate_limited_once(*args):
+                if responses:
+                    raise responses.pop()
+                return get_sample_history(*args)
+
+            collector.get_sample_history = rate_limited_once
+            slept = []
+            output = str(tmp_path / "history.om")
+            Backfill(collector, output, start=START, end=START + 3600, sleep=slept.append).run(
+                api.device_ids
+            )
+
+        assert slept == [120]
+        assert len(samples(output)) == 12 * 9
@@ -0,0 +1,50 @@
+from airthings.CircuitBreaker import CircuitBreaker
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestCircuitBreaker:
+    def test_opens_after_consecutive_failures(self):
+        """Test that a key is skipped after repeated failures until the cool-down ends."""
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=2, cooldown=60, clock=clock)
+
+        assert not breaker.record_failure("device1")
+        assert breaker.allow("device1")
+        assert breaker.record_failure("device1")
+        assert not breaker.allow("device1")
+        assert breaker.allow("device2")
+        assert breaker.open_circuits() == ["device1"]
+
+        clock.now = 60
+        # One trial fetch after the cool-down
+        assert breaker.allow("device1")
+        assert not breaker.allow("device1")
+
+    def test_success_closes_circuit(self):
+        """Test that a successful trial fetch resets the failure count."""
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=1, cooldown=60, clock=clock)
+        breaker.record_failure("device1")
+        clock.now = 60
+        assert breaker.allow("device1")
+        breaker.record_success("device1")
+        assert breaker.allow("device1")
+        assert breaker.open_circuits() == []
+
+    def test_failed_trial_reopens_circuit(self):
+        """Test that a failed trial fetch starts another cool-down."""
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=1, cooldown=60, clock=clock)
+        breaker.record_failure("device1")
+        clock.now = 60
+        assert breaker.allow("device1")
+        assert not breaker.record_failure("device1")
+        clock.now = 119
+        assert not breaker.allow("device1")
@@ -1,9 +1,19 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest.mock import Mock, patch
 
 import pytest
+import requests
+from prometheus_client import REGISTRY, CollectorRegistry, generate_latest
 from prometheus_client.metrics_core import GaugeMetricFamily
+from prometheus_client.parser import text_string_to_metric_families
 
-from airthings.CloudCollector import CloudCollector
+from airthings.CloudCollector import API_URL, CloudCollector, RateLimitException
+from airthings.MetricsCache import MetricsCache
+from airthings.StateStore import StateStore
+from tests.fake_airthings_api import FakeAirthingsAPI
 
 
 class TestCloudCollector:
@@ -18,7 +28,7 @@ class TestCloudCollector:
         assert collector.client_secret == mock_client_credentials["client_secret"]
         assert collector.device_id_list == [mock_device_id]
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_get_access_token(self, mock_post, mock_client_credentials, mock_access_token):
         """Test access token retrieval."""
         mock_post.return_value.json.return_value = {"access_token": mock_access_token}
@@ -38,9 +48,9 @@ class TestCloudCollector:
         assert call_args[1]["data"]["grant_type"] == "client_credentials"
         assert call_args[1]["data"]["client_id"] == mock_client_credentials["client_id"]
         assert call_args[1]["data"]["client_secret"] == mock_client_credentials["client_secret"]
-        assert call_args[1]["timeout"] == 30
+        assert call_args[1]["timeout"] == (10, 30)
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     def test_get_cloud_data(self, mock_get, mock_access_token, mock_device_id, mock_device_data):
         """Test fetching cloud data for a device."""
         mock_get.return_value.json.return_value = {"data": mock_device_data}
@@ -53,20 +63,20 @@ class TestCloudCollector:
         mock_get.assert_called_once_with(
             f"https://ext-api.airthings.com/v1/devices/{mock_device_id}/latest-samples",
             headers={"Authorization": f"Bearer {mock_access_token}"},
-            timeout=30,
+            timeout=(10, 30),
         )
 
     def test_add_samples_all_metrics(self, mock_device_id, mock_device_data):
         """Test adding all available metrics to gauge."""
         collector = CloudCollector("client_id", "client_secret", [mock_device_id])
-        gauge = GaugeMetricFamily("airthings_gauge", "Airthings sensor values")
+        families = {}
 
         # Call the dunder method directly
-        collector.__add_samples__(gauge, mock_device_data, mock_device_id)
+        collector.__add_samples__(families, mock_device_data, mock_device_id)
 
-        # Verify samples were added
-        samples = list(gauge.samples)
-        sample_names = [s.name for s in samples]
+        # Verify one family per sensor was added
+        sample_names = [s.name for family in families.values() for s in family.samples]
+        assert sorted(families) == sorted(sample_names)
 
         expected_metrics = [
             "airthings_battery_percent",
@@ -86,14 +96,13 @@ class TestCloudCollector:
     def test_add_samples_partial_data(self, mock_device_id):
         """Test adding samples with partial device data."""
         collector = CloudCollector("client_id", "client_secret", [mock_device_id])
-        gauge = GaugeMetricFamily("airthings_gauge", "Airthings sensor values")
+        families = {}
 
         partial_data = {"temp": 21.5, "humidity": 50.0}
         # Call the dunder method directly
-        collector.__add_samples__(gauge, partial_data, mock_device_id)
+        collector.__add_samples__(families, partial_data, mock_device_id)
 
-        samples = list(gauge.samples)
-        sample_names = [s.name for s in samples]
+        sample_names = [s.name for family in families.values() for s in family.samples]
 
         assert "airthings_temperature_celsius" in sample_names
         assert "airthings_humidity_percent" in sample_names
@@ -102,17 +111,19 @@ class TestCloudCollector:
     def test_add_samples_with_device_label(self, mock_device_id, mock_device_data):
         """Test that device_id is added as a label to metrics."""
         collector = CloudCollector("client_id", "client_secret", [mock_device_id])
-        gauge = GaugeMetricFamily("airthings_gauge", "Airthings sensor values")
+        families = {}
 
         # Call the dunder method directly
-        collector.__add_samples__(gauge, mock_device_data, mock_device_id)
+        collector.__add_samples__(families, mock_device_data, mock_device_id)
 
-        samples = list(gauge.samples)
-        for sample in samples:
-            assert sample.labels["device_id"] == mock_device_id
+        for family in families.values():
+            assert family.type == "gauge"
+            for sample in family.samples:
+                assert sample.labels["device_id"] == mock_device_id
+        assert families["airthings_temperature_celsius"].unit == "celsius"
 
-    @patch("requests.post")
-    @patch("requests.get")
+    @patch("requests.Session.post")
+    @patch("requests.Session.get")
     def test_collect(
         self,
         mock_get,
@@ -128,13 +139,22 @@ class TestCloudCollector:
         collector = CloudCollector("client_id", "client_secret", device_ids)
         metrics = list(collector.collect())
 
-        assert len(metrics) == 1
+        names = [m.name for m in metrics]
+        assert names[0] == "airthings_battery_percent"
+        assert {
+            "airthings_temperature_celsius",
+            "airthings_last_update_timestamp_seconds",
+            "airthings_exporter_token_age_seconds",
+            "airthings_exporter_token_refreshes",
+            "airthings_exporter_http_requests",
+            "airthings_exporter_rate_limit_remaining",
+        } <= set(names)
         assert isinstance(metrics[0], GaugeMetricFamily)
         mock_post.assert_called_once()
         assert mock_get.call_count == len(device_ids)
 
-    @patch("requests.post")
-    @patch("requests.get")
+    @patch("requests.Session.post")
+    @patch("requests.Session.get")
     def test_collect_multiple_devices(
         self,
         mock_get,
@@ -150,5 +170,588 @@ class TestCloudCollector:
         collector = CloudCollector("client_id", "client_secret", device_ids)
         metrics = list(collector.collect())
 
-        assert len(metrics) == 1
+        temperature = next(m for m in metrics if m.name == "airthings_temperature_celsius")
+        assert [s.labels["device_id"] for s in temperature.samples] == device_ids
         assert mock_get.call_count == len(device_ids)
+
+    @patch("requests.Session.post")
+    @patch("requests.Session.get")
+    def test_collect_reuses_access_token(
+        self, mock_get, mock_post, mock_access_token, mock_device_data
+    ):
+        """Test that the access token is cached across scrapes."""
+        mock_post.return_value.json.return_value = {
+            "access_token": mock_access_token,
+            "expires_in": 10800,
+        }
+        mock_get.return_value.json.return_value = {"data": mock_device_data}
+
+        collector = CloudCollector("client_id", "client_secret", ["device1"], coalesce_window=0)
+        list(collector.collect())
+        list(collector.collect())
+
+        mock_post.assert_called_once()
+        assert mock_get.call_count == 2
+
+    @patch("requests.Session.post")
+    @patch("requests.Session.get")
+    def test_get_cloud_data_refreshes_token_on_401(
+        self, mock_get, mock_post, mock_device_id, mock_device_data
+    ):
+        """Test that a 401 response refreshes the token once and retries."""
+        mock_post.return_value.json.return_value = {"access_token": "new_token"}
+        unauthorized = Mock(status_code=401)
+        ok = Mock(status_code=200)
+        ok.json.return_value = {"data": mock_device_data}
+        mock_get.side_effect = [unauthorized, ok]
+
+        collector = CloudCollector("client_id", "client_secret", [mock_device_id])
+        data = collector.__get_cloud_data__("old_token", mock_device_id)
+
+        assert data == mock_device_data
+        mock_post.assert_called_once()
+        assert mock_get.call_args[1]["headers"] == {"Authorization": "Bearer new_token"}
+
+    @patch("requests.Session.post")
+    @patch("requests.Session.get")
+    def test_collect_without_poll_reads_snapshot(
+        self, mock_get, mock_post, mock_access_token, mock_device_data
+    ):
+        """Test that collect() serves the snapshot without API calls when polled externally."""
+        mock_post.return_value.json.return_value = {"access_token": mock_access_token}
+        mock_get.return_value.json.return_value = {"data": mock_device_data}
+
+        collector = CloudCollector(
+            "client_id", "client_secret", ["device1", "device2"], poll_on_collect=False
+        )
+        metrics = {m.name: m for m in collector.collect()}
+        assert "airthings_temperature_celsius" not in metrics
+        assert metrics["airthings_last_update_timestamp_seconds"].samples == []
+
+        snapshot = collector.poll()
+        assert snapshot.generation == 1
+        assert set(snapshot.readings) == {"device1", "device2"}
+        api_calls = mock_get.call_count
+
+        metrics = {m.name: m for m in collector.collect()}
+        assert mock_get.call_count == api_calls
+        assert len(metrics["airthings_temperature_celsius"].samples) == 2
+        last_update = metrics["airthings_last_update_timestamp_seconds"].samples
+        assert {s.labels["device_id"] for s in last_update} == {"device1", "device2"}
+        assert all(
+            s.value == snapshot.readings[s.labels["device_id"]].updated_at for s in last_update
+        )
+
+    @patch("requests.Session.post")
+    @patch("requests.Session.get")
+    def test_poll_keeps_snapshot_while_rate_limited(
+        self, mock_get, mock_post, mock_access_token, mock_device_data
+    ):
+        """Test that the last snapshot is kept while the API is rate limited."""
+        mock_post.return_value.json.return_value = {"access_token": mock_access_token}
+        mock_get.return_value.json.return_value = {"data": mock_device_data}
+
+        collector = CloudCollector("client_id", "client_secret", ["device1"])
+        snapshot = collector.poll()
+        collector.rate_limit_until = datetime.now(timezone.utc) + timedelta(minutes=5)
+
+        assert collector.poll() is snapshot
+        assert mock_get.call_count == 1
+
+    def test_fetch_devices_runs_concurrently(self, mock_device_data):
+        """Test that device fetches overlap and results keep the configured order."""
+        device_ids = ["device1", "device2", "device3", "device4"]
+        collector = CloudCollector("client_id", "client_secret", device_ids, max_workers=4)
+
+        def slow_fetch(_access_token, device_id):
+            # Finish in reverse order to check the merge is deterministic
+            time.sleep(0.05 * (len(device_ids) - device_ids.index(device_id)))
+            return dict(mock_device_data, device=device_id)
+
+        with patch.object(collector, "__get_cloud_data__", side_effect=slow_fetch):
+            started = time.monotonic()
+            fetched = collector.__fetch_devices__("token", device_ids)
+            elapsed = time.monotonic() - started
+
+        assert list(fetched) == device_ids
+        assert all(fetched[d].data["device"] == d for d in device_ids)
+        assert elapsed < 0.35
+
+    def test_fetch_devices_respects_deadline(self, mock_device_data):
+        """Test that slow devices are skipped once the scrape deadline passes."""
+        collector = CloudCollector(
+            "client_id", "client_secret", ["fast", "slow"], scrape_timeout=0.1
+        )
+
+        def fetch(_access_token, device_id):
+            if device_id == "slow":
+                time.sleep(0.5)
+            return mock_device_data
+
+        with patch.object(collector, "__get_cloud_data__", side_effect=fetch):
+            fetched = collector.__fetch_devices__("token", ["fast", "slow"])
+
+        assert list(fetched) == ["fast"]
+
+    def test_fetch_devices_cancels_on_rate_limit(self, mock_device_data):
+        """Test that a rate limit cancels fetches that have not started yet."""
+        device_ids = [f"device{i}" for i in range(10)]
+        collector = CloudCollector("client_id", "client_secret", device_ids, max_workers=1)
+        calls = []
+
+        def fetch(_access_token, device_id):
+            calls.append(device_id)
+            if device_id == "device0":
+                raise RateLimitException(60, "later")
+            return mock_device_data
+
+        with patch.object(collector, "__get_cloud_data__", side_effect=fetch):
+            with pytest.raises(RateLimitException):
+                collector.__fetch_devices__("token", device_ids)
+            collector._executor.shutdown(wait=True)
+
+        assert len(calls) < len(device_ids)
+
+    def test_rate_limit_leaves_cancelled_devices_up(self):
+        """Test that fetches stopped by a rate limit neither run nor mark their devices down."""
+        device_ids = [f"device{i}" for i in range(10)]
+        collector = CloudCollector("client_id", "client_secret", device_ids, max_workers=2)
+        collector.device_up = dict.fromkeys(device_ids, 1)
+        calls = []
+
+        def fetch(_access_token, device_id):
+            calls.append(device_id)
+            if device_id == "device0":
+                collector.rate_limit_until = datetime.now(timezone.utc) + timedelta(minutes=1)
+                raise RateLimitException(60, collector.rate_limit_until)
+            time.sleep(0.05)
+            return {}
+
+        with patch.object(collector, "__get_cloud_data__", side_effect=fetch):
+            with pytest.raises(RateLimitException):
+                collector.__fetch_devices__("token", device_ids)
+            collector._executor.shutdown(wait=True)
+
+        # Only a fetch already running next to the rate limited one gets through
+        assert "device0" in calls and len(calls) <= 2
+        assert collector.device_up == dict.fromkeys(device_ids, 1)
+
+    def test_poll_keeps_readings_fetched_before_rate_limit(self, mock_device_data):
+        """Test that readings fetched before a rate limit are kept in the snapshot."""
+        device_ids = [f"device{i}" for i in range(4)]
+        collector = CloudCollector("client_id", "client_secret", device_ids, max_workers=1)
+
+        def fetch(_access_token, device_id):
+            if device_id == "device2":
+                raise RateLimitException(60, "later")
+            return mock_device_data
+
+        with patch.object(collector, "__get_access_token__", return_value="token"):
+            with patch.object(collector, "__get_cloud_data__", side_effect=fetch):
+                with pytest.raises(RateLimitException):
+                    collector.poll()
+            collector._executor.shutdown(wait=True)
+
+        readings = collector.snapshot.readings
+        assert "device0" in readings and "device1" in readings
+        assert "device2" not in readings
+        assert collector.snapshot.generation == 1
+
+    def test_custom_session_and_timeouts(self, mock_access_token, mock_device_data):
+        """Test that a pluggable session and separate timeouts are used for API calls."""
+        session = Mock()
+        session.get.return_value.json.return_value = {"data": mock_device_data}
+
+        collector = CloudCollector(
+            "client_id", "client_secret", ["device1"], session=session, connect_timeout=2
+        )
+        collector.__get_cloud_data__(mock_access_token, "device1")
+
+        assert session.get.call_args[1]["timeout"] == (2, 30)
+        # Connection metrics are skipped for sessions without urllib3 pools
+        assert collector.__connection_stats__() == (0, 0)
+
+    def test_connection_stats_count_reused_connections(self):
+        """Test that keep-alive connections are reused and counted."""
+
+        class KeepAliveHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                body = b"{}"
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+        server.daemon_threads = True
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            collector = CloudCollector("client_id", "client_secret", ["device1"])
+            url = f"http://127.0.0.1:{server.server_address[1]}/"
+            for _ in range(3):
+                collector.session.get(url, timeout=5).raise_for_status()
+            stats = collector.__connection_stats__()
+        finally:
+            collector.session.close()
+            server.shutdown()
+            server.server_close()
+
+        assert stats == (1, 2)
+
+    @patch("requests.Session.post")
+    @patch("requests.Session.get")
+    def test_poll_with_discovery_fetches_per_location(
+        self, mock_get, mock_post, mock_access_token, mock_device_data
+    ):
+        """Test that discovery fetches one latest-samples request per location."""
+        mock_post.return_value.json.return_value = {"access_token": mock_access_token}
+        responses = {
+            "/locations": {"locations": [{"id": "loc1"}, {"id": "loc2"}]},
+            "/devices": {
+                "devices": [
+                    {"id": "1", "location": {"id": "loc1"}},
+                    {"id": "2", "location": {"id": "loc1"}},
+                    {"id": "3", "location": {"id": "loc2"}},
+                ]
+            },
+            "/locations/loc1/latest-samples": {
+                "devices": [{"id": "1", "data": mock_device_data}, {"id": "2", "data": {}}]
+            },
+            "/locations/loc2/latest-samples": {"devices": [{"id": "3", "data": {}}]},
+            "/devices/extra/latest-samples": {"data": {"temp": 20.0}},
+        }
+
+        def get(url, **_kwargs):
+            response = Mock(status_code=200)
+            response.json.return_value = responses[url.removeprefix(API_URL)]
+            return response
+
+        mock_get.side_effect = get
+
+        collector = CloudCollector(
+            "client_id", "client_secret", ["extra"], discover=True, coalesce_window=0
+        )
+        snapshot = collector.poll()
+
+        assert list(snapshot.readings) == ["extra", "1", "2", "3"]
+        assert snapshot.readings["1"].data == mock_device_data
+        # Two discovery calls, two locations and one device outside any location
+        assert mock_get.call_count == 5
+        assert "read:device " in mock_post.call_args[1]["data"]["scope"]
+
+        collector.poll()
+        assert mock_get.call_count == 8
+
+    @patch("requests.Session.post")
+    @patch("requests.Session.get")
+    def test_poll_follows_rate_limit_budget(
+        self, mock_get, mock_post, mock_access_token, mock_device_data
+    ):
+        """Test that polling pauses and rotates devices when the budget runs low."""
+        mock_post.return_value.json.return_value = {"access_token": mock_access_token}
+        reset_at = int(time.time()) + 3600
+        remaining = [6]
+
+        def get(url, **_kwargs):
+            remaining[0] -= 1
+            response = Mock(status_code=200)
+            response.headers = {
+                "X-RateLimit-Limit": "120",
+                "X-RateLimit-Remaining": str(remaining[0]),
+                "X-RateLimit-Reset": str(reset_at),
+            }
+            response.json.return_value = {"data": dict(mock_device_data, url=url)}
+            return response
+
+        mock_get.side_effect = get
+        device_ids = ["device1", "device2", "device3"]
+        collector = CloudCollector("client_id", "client_secret", device_ids, coalesce_window=0)
+
+        collector.poll()
+        assert mock_get.call_count == 3
+        assert collector.budget.remaining == 3
+        # One request left above the reserve: wait for the window to reset
+        assert collector.budget.next_poll_at == reset_at
+        collector.poll()
+        assert mock_get.call_count == 3
+
+        # After the window reset only part of the fleet fits, so devices rotate
+        collector.budget.next_poll_at = 0
+        remaining[0] = 5
+        collector.budget.remaining = 4
+        collector.poll()
+        assert mock_get.call_count == 5
+        assert collector._rotation == 2
+
+    @patch("requests.Session.post")
+    @patch("requests.Session.get")
+    def test_overlapping_polls_are_coalesced(
+        self, mock_get, mock_post, mock_access_token, mock_device_data
+    ):
+        """Test that overlapping scrapes share one fetch."""
+        mock_post.return_value.json.return_value = {"access_token": mock_access_token}
+
+        def slow_get(*_args, **_kwargs):
+            time.sleep(0.2)
+            response = Mock(status_code=200)
+            response.json.return_value = {"data": mock_device_data}
+            return response
+
+        mock_get.side_effect = slow_get
+        collector = CloudCollector("client_id", "client_secret", ["device1"])
+
+        threads = [threading.Thread(target=lambda: list(collector.collect())) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert mock_get.call_count == 1
+        metrics = {m.name: m for m in collector.collect()}
+        assert metrics["airthings_exporter_coalesced_polls"].samples[0].value == 3
+
+    @patch("requests.Session.post")
+    @patch("requests.Session.get")
+    def test_self_instrumentation(self, mock_get, mock_post, mock_access_token, mock_device_data):
+        """Test that API latency, fetch durations and rate limit events are recorded."""
+        mock_post.return_value.status_code = 200
+        mock_post.return_value.json.return_value = {"access_token": mock_access_token}
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.json.return_value = {"data": mock_device_data}
+
+        def sample(name, labels):
+            return REGISTRY.get_sample_value(name, labels) or 0
+
+        latest_samples = {"endpoint": "devices/latest-samples", "status_code": "200"}
+        requests_before = sample(
+            "airthings_exporter_api_request_duration_seconds_count", latest_samples
+        )
+
+        collector = CloudCollector("client_id", "client_secret", ["device1", "device2"])
+        metrics = {m.name: m for m in collector.collect()}
+
+        assert (
+            sample("airthings_exporter_api_request_duration_seconds_count", latest_samples)
+            == requests_before + 2
+        )
+        fetch_durations = metrics["airthings_exporter_device_fetch_duration_seconds"].samples
+        assert {s.labels["device_id"] for s in fetch_durations} == {"device1", "device2"}
+        assert metrics["airthings_exporter_rate_limited_until_timestamp_seconds"].samples == []
+
+        rate_limits_before = sample(
+            "airthings_exporter_rate_limit_events_total", {"endpoint": "devices/latest-samples"}
+        )
+        mock_get.return_value.status_code = 429
+        mock_get.return_value.headers = {"X-RateLimit-Reset": str(int(time.time()) + 60)}
+        with pytest.raises(RateLimitException):
+            collector.__get_cloud_data__(mock_access_token, "device1")
+        assert (
+            sample(
+                "airthings_exporter_rate_limit_events_total",
+                {"endpoint": "devices/latest-samples"},
+            )
+            == rate_limits_before + 1
+        )
+        metrics = {m.name: m for m in collector.collect()}
+        rate_limited_until = metrics["airthings_exporter_rate_limited_until_timestamp_seconds"]
+        assert rate_limited_until.samples[0].value == collector.rate_limit_until.timestamp()
+
+    @patch("requests.Session.post")
+    @patch("requests.Session.get")
+    def test_state_survives_restart(
+        self, mock_get, mock_post, tmp_path, mock_access_token, mock_device_data
+    ):
+        """Test that a restarted collector serves saved readings without API calls."""
+        mock_post.return_value.json.return_value = {"access_token": mock_access_token}
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.headers = {}
+        mock_get.return_value.json.return_value = {"data": mock_device_data}
+        store = StateStore(str(tmp_path / "state.json"))
+
+        collector = CloudCollector(
+            "client_id", "client_secret", ["device1"], state_store=store, coalesce_window=0
+        )
+        collector.poll()
+        mock_get.return_value.status_code = 429
+        mock_get.return_value.headers = {"X-RateLimit-Reset": str(int(time.time()) + 600)}
+        with pytest.raises(RateLimitException):
+            collector.poll()
+
+        restarted = CloudCollector(
+            "client_id", "client_secret", ["device1"], poll_on_collect=True, coalesce_window=0
+        )
+        restarted.restore_state(store.load())
+        mock_get.reset_mock()
+        mock_post.reset_mock()
+
+        metrics = {m.name: m for m in restarted.collect()}
+        assert restarted.rate_limit_until == collector.rate_limit_until
+        assert restarted.snapshot.readings == collector.snapshot.readings
+        co2 = metrics["airthings_co2_parts_per_million"].samples
+        assert co2[0].value == mock_device_data["co2"]
+        mock_get.assert_not_called()
+        # The token age carries on from the saved fetch time
+        assert metrics["airthings_exporter_token_age_seconds"].samples[0].value >= 0
+
+        # The saved token is reused once polling is allowed again
+        restarted.rate_limit_until = None
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.headers = {}
+        restarted.poll()
+        mock_post.assert_not_called()
+        assert mock_get.call_args[1]["headers"]["Authorization"] == f"Bearer {mock_access_token}"
+
+    def test_state_is_saved_only_when_changed(self):
+        """Test that polls that change nothing don't rewrite the state file."""
+        store = Mock()
+        collector = CloudCollector("client_id", "client_secret", [], state_store=store)
+        collector.save_state()
+        collector.save_state()
+        store.save.assert_called_once()
+
+        collector.snapshot = collector.snapshot._replace(generation=1)
+        collector.save_state()
+        assert store.save.call_count == 2
+
+    @patch("requests.Session.post")
+    @patch("requests.Session.get")
+    def test_adaptive_polling_skips_devices_without_new_samples(
+        self, mock_get, mock_post, mock_access_token, mock_device_data
+    ):
+        """Test that devices are only fetched again once a new sample is expected."""
+        mock_post.return_value.json.return_value = {"access_token": mock_access_token}
+        now = int(time.time())
+        sample_times = {"fast": [now - 300, now], "slow": [now - 3600, now - 60]}
+
+        def get(url, **_kwargs):
+            device_id = url.split("/")[-2]
+            response = Mock(status_code=200, headers={})
+            response.json.return_value = {
+                "data": dict(mock_device_data, time=sample_times[device_id].pop(0))
+            }
+            return response
+
+        mock_get.side_effect = get
+        collector = CloudCollector(
+            "client_id",
+            "client_secret",
+            ["fast", "slow"],
+            adaptive=True,
+            sample_timestamps=True,
+            coalesce_window=0,
+        )
+        collector.poll()
+        collector.poll()
+        assert mock_get.call_count == 4
+        generation = collector.snapshot.generation
+
+        # Neither device has a new sample yet; the snapshot is kept as is
+        collector.poll()
+        assert mock_get.call_count == 4
+        assert collector.snapshot.generation == generation
+
+        metrics = {m.name: m for m in collector.collect()}
+        assert metrics["airthings_exporter_skipped_fetches"].samples[0].value == 4
+        intervals = {
+            s.labels["device_id"]: s.value
+            for s in metrics["airthings_exporter_device_sample_interval_seconds"].samples
+        }
+        assert intervals == {"fast": 300, "slow": 3540}
+        timestamps = {
+            s.labels["device_id"]: s.timestamp
+            for s in metrics["airthings_temperature_celsius"].samples
+        }
+        assert timestamps == {"fast": now, "slow": now - 60}
+
+    @patch("airthings.Retry.time.sleep")
+    def test_failing_device_does_not_fail_poll(self, _sleep, mock_device_data):
+        """Test that other devices are served while one keeps failing."""
+        collector = CloudCollector(
+            "client_id", "client_secret", ["ok", "broken"], poll_on_collect=False, coalesce_window=0
+        )
+        calls = []
+
+        def fetch(_access_token, device_id):
+            calls.append(device_id)
+            if device_id == "broken":
+                raise requests.ConnectionError("connection reset")
+            return mock_device_data
+
+        with (
+            patch.object(collector, "__get_access_token__", return_value="token"),
+            patch.object(collector, "__get_cloud_data__", side_effect=fetch),
+        ):
+            for _ in range(3):
+                collector.poll()
+            # The circuit of the broken device is open now
+            collector.poll()
+
+        # Three attempts per poll until the circuit opened
+        assert calls.count("broken") == 9
+        assert calls.count("ok") == 4
+        assert list(collector.snapshot.readings) == ["ok"]
+        metrics = {m.name: m for m in collector.collect()}
+        up = {s.labels["device_id"]: s.value for s in metrics["airthings_device_up"].samples}
+        assert up == {"ok": 1, "broken": 0}
+
+    def test_request_timeout_follows_device_deadline(self):
+        """Test that requests of a fetch never outlast its deadline."""
+        collector = CloudCollector("client_id", "client_secret", [], read_timeout=30)
+        assert collector.__request_timeout__() == (10, 30)
+        collector._fetch_deadline.value = time.monotonic() + 2
+        connect_timeout, read_timeout = collector.__request_timeout__()
+        assert connect_timeout == 10
+        assert 1 < read_timeout <= 2
+
+    def test_failing_metadata_adds_no_requests_per_poll(self, make_collector):
+        """Test that metadata missing e.g. for lack of the read:device scope isn't refetched."""
+        with FakeAirthingsAPI(devices=2) as api:
+            collector = make_collector(api, device_metadata=True)
+            api_get = Mock(side_effect=RuntimeError("403 Forbidden"))
+            collector.directory.api_get = api_get
+            for _ in range(5):
+                collector.poll()
+
+        assert api_get.call_count == 1
+        assert len(collector.snapshot.readings) == 2
+
+    def test_device_metadata_labels(self, make_collector):
+        """Test the device info metric and name/location labels without extra API calls."""
+        with FakeAirthingsAPI(devices=2) as api:
+            collector = make_collector(api, device_labels=True)
+            registry = CollectorRegistry()
+            registry.register(collector)
+            collector.poll()
+            families = {
+                f.name: f
+                for f in text_string_to_metric_families(generate_latest(registry).decode())
+            }
+            streamed = MetricsCache(registry, collector).get().body.decode()
+            collector.poll()
+            assert api.requests["devices"] == 1
+
+        device_id = api.device_ids[0]
+        info = {s.labels["device_id"]: s.labels for s in families["airthings_device_info"].samples}
+        assert info[device_id] == {
+            "device_id": device_id,
+            "name": f"Room {device_id[-4:]}",
+            "model": "WAVE_PLUS",
+            "location_id": "location-0",
+            "location": "location-0",
+        }
+        temperature = families["airthings_temperature_celsius"].samples[0]
+        assert temperature.labels == {
+            "device_id": device_id,
+            "name": f"Room {device_id[-4:]}",
+            "location": "location-0",
+        }
+        assert (
+            f'airthings_temperature_celsius{{device_id="{device_id}",'
+            f'name="Room {device_id[-4:]}",location="location-0"}}' in streamed
+        )
@@ -0,0 +1,131 @@
+import json
+import pstats
+import threading
+import tracemalloc
+
+import pytest
+import requests
+
+from airthings.DebugEndpoints import DebugEndpoints
+from airthings.ExporterServer import ExporterServer
+from tests.fake_airthings_api import ACCESS_TOKEN, FakeAirthingsAPI
+
+
+def busy_loop(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+@pytest.fixture(name="busy_thread")
+def busy_thread_fixture():
+    stop = threading.Event()
+    thread = threading.Thread(target=busy_loop, args=(stop,), name="busy-worker", daemon=True)
+    thread.start()
+    yield thread
+    stop.set()
+    thread.join()
+
+
+@pytest.fixture(name="polled_collector")
+def polled_collector_fixture(make_collector):
+    with FakeAirthingsAPI(devices=2) as api:
+        collector = make_collector(api)
+        collector.poll()
+        yield collector
+
+
+class TestDebugEndpoints:
+    def test_profile_collapsed_stacks(self, busy_thread):
+        """Test that the profile samples other threads in collapsed stack format."""
+        response = DebugEndpoints(None).handle("/debug/profile", "seconds=0.3")
+
+        assert response.status == 200
+        busy = [line for line in response.body.decode().splitlines() if "busy_loop" in line]
+        assert busy
+        assert all(line.startswith(f"{busy_thread.name};") for line in busy)
+        assert sum(int(line.rsplit(" ", 1)[1]) for line in busy) > 5
+
+    def test_profile_as_pstats(self, busy_thread, tmp_path):
+        """Test that format=pstats returns a file pstats can load."""
+        response = DebugEndpoints(None).handle("/debug/profile", "seconds=0.3&format=pstats")
+
+        path = tmp_path / "profile.pstats"
+        path.write_bytes(response.body)
+        stats = pstats.Stats(str(path))
+        functions = {name for _, _, name in stats.stats}
+        assert "busy_loop" in functions
+        assert busy_thread.is_alive()
+
+    @pytest.mark.parametrize("query", ["seconds=0", "seconds=3600", "seconds=soon", "format=svg"])
+    def test_invalid_profile_request(self, query):
+        assert DebugEndpoints(None).handle("/debug/profile", query).status == 400
+
+    def test_memory_top_and_diff(self):
+        """Test that tracing starts on the first request and later ones show changes."""
+        endpoints = DebugEndpoints(None)
+        was_tracing = tracemalloc.is_tracing()
+        try:
+            endpoints.handle("/debug/memory", "")
+            assert tracemalloc.is_tracing()
+            first = endpoints.handle("/debug/memory", "limit=5").body.decode()
+            retained = [bytearray(1000) for _ in range(1000)]
+            second = endpoints.handle("/debug/memory", "limit=5").body.decode()
+        finally:
+            if not was_tracing:
+                tracemalloc.stop()
+
+        assert "Top 5 allocation sites" in first
+        assert "changes since the previous request" not in first
+        changes = second.split("changes since the previous request:")[1]
+        assert "test_debug_endpoints.py" in changes
+        assert len(retained) == 1000
+
+    def test_memory_stop(self):
+        """Test that ?stop=1 stops tracing and the next request starts afresh."""
+        endpoints = DebugEndpoints(None)
+        was_tracing = tracemalloc.is_tracing()
+        try:
+            endpoints.handle("/debug/memory", "")
+            endpoints.handle("/debug/memory", "")
+            response = endpoints.handle("/debug/memory", "stop=1")
+            assert response.body == b"Stopped tracing allocations\n"
+            assert not tracemalloc.is_tracing()
+            assert b"not being traced" in endpoints.handle("/debug/memory", "stop=1").body
+
+            endpoints.handle("/debug/memory", "")
+            second = endpoints.handle("/debug/memory", "").body.decode()
+            assert "changes since the previous request" not in second
+        finally:
+            if was_tracing:
+                tracemalloc.start()
+            else:
+                tracemalloc.stop()
+
+    def test_state(self, polled_collector):
+        """Test the token, rate limit and per-device state, without the token itself."""
+        response = DebugEndpoints(polled_collector).handle("/debug/state", "")
+
+        assert response.content_type == "application/json"
+        assert ACCESS_TOKEN.encode() not in response.body
+        state = json.loads(response.body)["default"]
+        assert state["token"]["cached"]
+        assert state["token"]["refreshes"] == 1
+        assert state["rate_limit"]["limited_until"] is None
+        assert state["snapshot"]["devices"] == 2
+        for device in state["devices"].values():
+            assert device["up"] == 1
+            assert device["last_fetch_duration_seconds"] > 0
+
+    def test_served_only_when_enabled(self, polled_collector):
+        """Test that /debug/* is a 404 unless the server has debug endpoints."""
+        for debug, status in ((None, 404), (DebugEndpoints(polled_collector), 200)):
+            server = ExporterServer(("127.0.0.1", 0), None, debug=debug)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            try:
+                response = requests.get(
+                    f"http://127.0.0.1:{server.server_address[1]}/debug/state", timeout=5
+                )
+                assert response.status_code == status
+            finally:
+                server.shutdown()
+                server.server_close()
@@ -0,0 +1,108 @@
+from unittest.mock import Mock
+
+import pytest
+
+from airthings.DeviceDirectory import UNKNOWN_DEVICE_REFRESH, DeviceDirectory, DeviceInfo
+
+LOCATIONS = {"locations": [{"id": "loc1", "name": "Home"}]}
+DEVICES = {
+    "devices": [
+        {"id": "2", "deviceType": "VIEW_PLUS", "sensors": ["temp"], "location": {"id": "loc1"}},
+        {
+            "id": "1",
+            "deviceType": "WAVE_MINI",
+            "sensors": ["temp"],
+            "segment": {"name": "Bedroom"},
+            "location": {"id": "loc1"},
+        },
+        {"id": "hub", "deviceType": "HUB", "sensors": [], "location": {"id": "loc1"}},
+    ]
+}
+
+
+def fake_api_get(_access_token, path, _context):
+    return {"/locations": LOCATIONS, "/devices": DEVICES}[path]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestDeviceDirectory:
+    def test_get_devices(self):
+        """Test that devices are discovered with their location and hubs are skipped."""
+        directory = DeviceDirectory(fake_api_get)
+        devices = directory.get_devices("token")
+
+        assert list(devices) == ["1", "2"]
+        assert devices["1"] == DeviceInfo("1", "WAVE_MINI", "loc1", "Home", "Bedroom")
+        assert devices["2"].name is None
+
+    def test_get_devices_is_cached_until_ttl(self):
+        """Test that discovery only hits the API again after the TTL."""
+        api_get = Mock(side_effect=fake_api_get)
+        clock = FakeClock()
+        directory = DeviceDirectory(api_get, ttl=60, clock=clock)
+
+        directory.get_devices("token")
+        directory.get_devices("token")
+        assert api_get.call_count == 2
+
+        clock.now += 60
+        directory.get_devices("token")
+        assert api_get.call_count == 4
+
+    def test_failed_refresh_keeps_known_devices(self):
+        """Test that a failed refresh serves the previously discovered devices."""
+        api_get = Mock(side_effect=fake_api_get)
+        clock = FakeClock()
+        directory = DeviceDirectory(api_get, ttl=60, clock=clock)
+        devices = directory.get_devices("token")
+
+        api_get.side_effect = RuntimeError("API Error")
+        clock.now += 60
+        assert directory.get_devices("token") == devices
+
+    def test_failed_initial_discovery_raises(self):
+        """Test that discovery errors are raised when nothing is known yet."""
+        directory = DeviceDirectory(Mock(side_effect=RuntimeError("API Error")))
+        with pytest.raises(RuntimeError):
+            directory.get_devices("token")
+
+    def test_failed_refresh_is_retried_later(self):
+        """Test that a failing discovery is not retried on every call."""
+        api_get = Mock(side_effect=RuntimeError("403 Forbidden"))
+        clock = FakeClock()
+        directory = DeviceDirectory(api_get, ttl=3600, clock=clock)
+        for _ in range(3):
+            with pytest.raises(RuntimeError):
+                directory.get_devices("token")
+        assert api_get.call_count == 1
+
+        api_get.side_effect = fake_api_get
+        clock.now += UNKNOWN_DEVICE_REFRESH
+        assert list(directory.get_devices("token")) == ["1", "2"]
+        assert api_get.call_count == 3
+
+    def test_unknown_device_triggers_early_refresh(self):
+        """Test that a device missing from the list refreshes it early, but not too often."""
+        api_get = Mock(side_effect=fake_api_get)
+        clock = FakeClock()
+        directory = DeviceDirectory(api_get, ttl=3600, clock=clock)
+        directory.get_devices("token")
+        assert directory.generation == 1
+
+        directory.get_devices("token", ["1", "new"])
+        assert api_get.call_count == 2
+
+        clock.now += UNKNOWN_DEVICE_REFRESH
+        directory.get_devices("token", ["1"])
+        assert api_get.call_count == 2
+        directory.get_devices("token", ["1", "new"])
+        assert api_get.call_count == 4
+        # Nothing changed, so derived caches stay valid
+        assert directory.generation == 1
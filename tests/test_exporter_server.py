@@ -0,0 +1,139 @@
+import gzip
+import threading
+import time
+from unittest.mock import Mock
+
+import pytest
+import requests
+
+from airthings.CloudCollector import RateLimitException
+from airthings.ExporterServer import ExporterServer
+from airthings.MetricsCache import RenderedMetrics
+from airthings.MetricsSlice import MetricsSlice
+
+BODY = b"airthings_gauge 1.0\n"
+
+
+@pytest.fixture
+def metrics_cache():
+    cache = Mock()
+    cache.get.return_value = RenderedMetrics(1, BODY, gzip.compress(BODY), '"etag1"')
+    return cache
+
+
+@pytest.fixture
+def exporter_server(metrics_cache):
+    server = ExporterServer(("127.0.0.1", 0), metrics_cache, max_concurrent_scrapes=1)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def url(server, path):
+    return f"http://127.0.0.1:{server.server_address[1]}{path}"
+
+
+class TestExporterServer:
+    def test_health(self, exporter_server):
+        """Test the health endpoint."""
+        response = requests.get(url(exporter_server, "/health"), timeout=5)
+        assert response.status_code == 200
+        assert response.text == "OK"
+
+    def test_metrics(self, exporter_server):
+        """Test that metrics are served with ETag and gzip support."""
+        response = requests.get(url(exporter_server, "/metrics"), timeout=5)
+        assert response.status_code == 200
+        assert response.content == BODY
+        assert response.headers["ETag"] == '"etag1-gz"'
+        assert response.headers["Content-Encoding"] == "gzip"
+
+        response = requests.get(
+            url(exporter_server, "/metrics"),
+            headers={"Accept-Encoding": "identity"},
+            timeout=5,
+        )
+        assert "Content-Encoding" not in response.headers
+        assert response.headers["ETag"] == '"etag1"'
+        assert response.content == BODY
+
+    def test_metrics_not_modified(self, exporter_server):
+        """Test that a matching If-None-Match returns 304 for the same encoding only."""
+        response = requests.get(
+            url(exporter_server, "/metrics"), headers={"If-None-Match": '"etag1-gz"'}, timeout=5
+        )
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["ETag"] == '"etag1-gz"'
+        assert response.headers["Vary"] == "Accept, Accept-Encoding"
+
+        response = requests.get(
+            url(exporter_server, "/metrics"),
+            headers={"If-None-Match": '"etag1-gz"', "Accept-Encoding": "identity"},
+            timeout=5,
+        )
+        assert response.status_code == 200
+        assert response.headers["ETag"] == '"etag1"'
+
+    def test_metrics_rate_limited(self, exporter_server, metrics_cache):
+        """Test that rate limits are reported as 429."""
+        metrics_cache.get.side_effect = RateLimitException(60, "later")
+        response = requests.get(url(exporter_server, "/metrics"), timeout=5)
+        assert response.status_code == 429
+        assert response.headers["Retry-After"] == "60"
+
+    def test_metrics_slice(self, exporter_server, metrics_cache):
+        """Test that slice parameters reach the cache and invalid ones get a 400."""
+        response = requests.get(url(exporter_server, "/metrics?shard=1/3&sensor=temp"), timeout=5)
+        assert response.status_code == 200
+        assert metrics_cache.get.call_args[1]["metrics_slice"] == MetricsSlice(
+            sensors=("temp",), shard=(1, 3)
+        )
+
+        response = requests.get(url(exporter_server, "/metrics?shard=3/3"), timeout=5)
+        assert response.status_code == 400
+        assert "Invalid shard" in response.text
+
+    def test_not_found(self, exporter_server):
+        """Test unknown paths."""
+        assert requests.get(url(exporter_server, "/other"), timeout=5).status_code == 404
+
+    def test_health_does_not_wait_for_slow_scrape(self, exporter_server, metrics_cache):
+        """Test that /health answers while a scrape is blocked and excess scrapes get 503."""
+        release = threading.Event()
+        rendered = metrics_cache.get.return_value
+
+        def slow_get(**_kwargs):
+            release.wait(5)
+            return rendered
+
+        metrics_cache.get.side_effect = slow_get
+        scrape = threading.Thread(
+            target=requests.get, args=(url(exporter_server, "/metrics"),), kwargs={"timeout": 10}
+        )
+        scrape.start()
+        time.sleep(0.1)
+        try:
+            started = time.monotonic()
+            assert requests.get(url(exporter_server, "/health"), timeout=5).status_code == 200
+            assert time.monotonic() - started < 1
+            # The only scrape slot is taken
+            assert requests.get(url(exporter_server, "/metrics"), timeout=5).status_code == 503
+        finally:
+            release.set()
+            scrape.join()
+
+    def test_ready(self, metrics_cache):
+        """Test that /ready follows the readiness check."""
+        ready = Mock(return_value=False)
+        server = ExporterServer(("127.0.0.1", 0), metrics_cache, ready_check=ready)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            assert requests.get(url(server, "/ready"), timeout=5).status_code == 503
+            ready.return_value = True
+            assert requests.get(url(server, "/ready"), timeout=5).status_code == 200
+        finally:
+            server.shutdown()
+            server.server_close()
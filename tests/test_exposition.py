@@ -0,0 +1,114 @@
+import math
+
+import pytest
+from prometheus_client import CollectorRegistry, generate_latest
+from prometheus_client.openmetrics.exposition import generate_latest as generate_latest_openmetrics
+from prometheus_client.openmetrics.parser import text_string_to_metric_families as parse_openmetrics
+from prometheus_client.parser import text_string_to_metric_families
+from prometheus_client.utils import floatToGoString
+
+from airthings.CloudCollector import CloudCollector
+from airthings.Exposition import format_value
+from airthings.MetricsCache import CONTENT_TYPE_OPENMETRICS, MetricsCache
+from airthings.Snapshot import DeviceReading, Snapshot
+
+
+def make_collector(readings, sample_timestamps=False):
+    collector = CloudCollector(
+        "client_id",
+        "client_secret",
+        list(readings),
+        poll_on_collect=False,
+        sample_timestamps=sample_timestamps,
+        generic_sensors=True,
+    )
+    collector.snapshot = Snapshot(
+        1, {device_id: DeviceReading(data, 1700000000.5) for device_id, data in readings.items()}
+    )
+    collector.device_up = {device_id: 1 for device_id in readings}
+    registry = CollectorRegistry()
+    registry.register(collector)
+    return collector, registry
+
+
+def fleet(devices, mock_device_data):
+    return {str(2930000000 + i): dict(mock_device_data, time=1700000000) for i in range(devices)}
+
+
+def device_samples(families):
+    return sorted(
+        (s.name, tuple(sorted(s.labels.items())), s.value, s.timestamp)
+        for family in families
+        for s in family.samples
+        if "device_id" in s.labels
+    )
+
+
+class TestExposition:
+    @pytest.mark.parametrize("sample_timestamps", [False, True])
+    def test_streamed_text_matches_registry(self, mock_device_data, sample_timestamps):
+        """Test that the streamed families equal the ones rendered through the registry."""
+        readings = fleet(3, mock_device_data)
+        readings['odd"id\\'] = {"temp": 1e20, "humidity": float("inf"), "newSensor": 2}
+        collector, registry = make_collector(readings, sample_timestamps)
+
+        expected = generate_latest(registry).decode()
+        streamed = MetricsCache(registry, collector).get().body.decode()
+
+        assert device_samples(text_string_to_metric_families(streamed)) == device_samples(
+            text_string_to_metric_families(expected)
+        )
+        assert streamed.count("# TYPE airthings_temperature_celsius gauge\n") == 1
+
+    def test_streamed_openmetrics_matches_registry(self, mock_device_data):
+        """Test the OpenMetrics rendering, including units and the EOF marker."""
+        collector, registry = make_collector(fleet(3, mock_device_data), sample_timestamps=True)
+
+        expected = generate_latest_openmetrics(registry).decode()
+        rendered = MetricsCache(registry, collector).get(openmetrics=True)
+        streamed = rendered.body.decode()
+
+        assert rendered.content_type == CONTENT_TYPE_OPENMETRICS
+        assert streamed.endswith("# EOF\n") and streamed.count("# EOF") == 1
+        assert "# UNIT airthings_temperature_celsius celsius\n" in streamed
+        assert device_samples(parse_openmetrics(streamed)) == device_samples(
+            parse_openmetrics(expected)
+        )
+
+    @pytest.mark.parametrize("value", [22.5, 450, 1e20, 1.5e-7, -0.0, math.inf, -math.inf])
+    def test_format_value(self, value):
+        """Test that values are spelled like prometheus_client spells them."""
+        assert format_value(value) == floatToGoString(value)
+
+    def test_format_nan(self):
+        assert format_value(math.nan) == "NaN"
+
+
+@pytest.fixture(scope="module")
+def large_fleet():
+    data = {
+        "battery": 95,
+        "co2": 450,
+        "humidity": 45.5,
+        "pm1": 2.1,
+        "pm25": 3.5,
+        "pressure": 1013.25,
+        "radonShortTermAvg": 25.0,
+        "temp": 22.5,
+        "voc": 150,
+    }
+    return make_collector(fleet(10000, data))
+
+
+def test_benchmark_streamed_render_10000_devices(benchmark, large_fleet):
+    """Benchmark rendering the per-device families of 10,000 devices from the snapshot."""
+    collector, _registry = large_fleet
+    body = benchmark.pedantic(collector.render_device_metrics, rounds=5, iterations=1)
+    assert body.count("airthings_temperature_celsius{") == 10000
+
+
+def test_benchmark_registry_render_10000_devices(benchmark, large_fleet):
+    """Benchmark the same families rendered through Sample objects, for comparison."""
+    _collector, registry = large_fleet
+    body = benchmark.pedantic(generate_latest, args=(registry,), rounds=5, iterations=1)
+    assert body.count(b"airthings_temperature_celsius{") == 10000
@@ -0,0 +1,52 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from airthings.Instrumentation import CountingHTTPAdapter, connection_stats, endpoint_name
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b"{}"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+class TestInstrumentation:
+    def test_endpoint_name(self):
+        """Test that ids are stripped from endpoint labels."""
+        assert endpoint_name("/devices/1234/latest-samples") == "devices/latest-samples"
+        assert endpoint_name("/locations/abc/latest-samples") == "locations/latest-samples"
+        assert endpoint_name("/devices") == "devices"
+        assert endpoint_name("/locations") == "locations"
+
+    def test_connection_stats_survive_evicted_pools(self):
+        """Test that request counts keep growing when a connection pool is evicted."""
+        server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+        server.daemon_threads = True
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        session = requests.Session()
+        # Keep a single pool, so each host change evicts the pool of the other host
+        session.mount("http://", CountingHTTPAdapter(pool_connections=1))
+        port = server.server_address[1]
+        try:
+            stats = []
+            for host in ["127.0.0.1", "127.0.0.1", "localhost", "localhost", "127.0.0.1"]:
+                session.get(f"http://{host}:{port}/", timeout=5).raise_for_status()
+                stats.append(connection_stats(session))
+        finally:
+            session.close()
+            server.shutdown()
+            server.server_close()
+
+        assert stats == [(1, 0), (1, 1), (2, 1), (2, 2), (3, 2)]
+        assert connection_stats(session) == (3, 2)
@@ -50,8 +50,8 @@ class TestIntegration:
         assert "# HELP" in content
         assert "# TYPE" in content
 
-    @patch("requests.post")
-    @patch("requests.get")
+    @patch("requests.Session.post")
+    @patch("requests.Session.get")
     def test_collector_integration(
         self, mock_get, mock_post, mock_device_data, mock_access_token, mock_device_id
     ):
@@ -69,8 +69,7 @@ class TestIntegration:
             metrics = list(collector.collect())
 
             assert len(metrics) > 0
-            gauge = metrics[0]
-            samples = list(gauge.samples)
+            samples = [s for metric in metrics for s in metric.samples]
 
             # Verify metric names
             sample_names = [s.name for s in samples]
@@ -86,7 +85,7 @@ class TestIntegration:
             # Cleanup: unregister collector
             REGISTRY.unregister(collector)
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_api_error_handling(self, mock_post, mock_device_id):
         """Test handling of API errors - should raise exception to be caught by HTTP handler."""
         # Simulate API error
@@ -98,8 +97,8 @@ class TestIntegration:
         with pytest.raises(requests.exceptions.RequestException):
             list(collector.collect())
 
-    @patch("requests.post")
-    @patch("requests.get")
+    @patch("requests.Session.post")
+    @patch("requests.Session.get")
     def test_missing_data_fields(self, mock_get, mock_post, mock_access_token, mock_device_id):
         """Test collector handles missing data fields gracefully."""
         # Setup mocks with incomplete data
@@ -0,0 +1,183 @@
+import time
+
+import pytest
+
+from airthings.LeaderElection import LeaderElection
+from airthings.Lease import FileLease
+from airthings.SnapshotFile import HEADER, MAGIC, SnapshotFile
+from tests.fake_airthings_api import FakeAirthingsAPI
+
+
+class FakeClock:
+    def __init__(self, now=1700000000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def make_replica(collector, tmp_path, clock=None):
+    return LeaderElection(
+        collector,
+        FileLease(str(tmp_path / "default.lease")),
+        SnapshotFile(str(tmp_path / "default.snapshot")),
+        300,
+        clock=clock or FakeClock(),
+    )
+
+
+class TestFileLease:
+    def test_only_one_holder(self, tmp_path):
+        """Test that the lease is exclusive until its holder releases it."""
+        path = str(tmp_path / "leader.lease")
+        first, second = FileLease(path, "first"), FileLease(path, "second")
+
+        assert first.try_acquire()
+        assert first.try_acquire()
+        assert not second.try_acquire()
+
+        first.release()
+        assert second.try_acquire()
+        assert not first.try_acquire()
+        second.release()
+
+    def test_handover_state(self, tmp_path):
+        """Test that the next holder reads what the previous one wrote."""
+        path = str(tmp_path / "leader.lease")
+        first = FileLease(path, "first")
+        assert first.read() is None
+        first.try_acquire()
+        first.write({"rate_limit_until": 1700000900, "budget": None})
+        first.write({"rate_limit_until": 1700000000})
+        first.release()
+
+        assert FileLease(path).read() == {"rate_limit_until": 1700000000, "holder": "first"}
+
+
+class TestSnapshotFile:
+    def test_write_and_load(self, tmp_path):
+        path = str(tmp_path / "snapshot")
+        writer, reader = SnapshotFile(path), SnapshotFile(path)
+        assert reader.generation() is None
+
+        writer.write(3, {"readings": {"1": {"data": {"temp": 21.5}, "updated_at": 1.0}}})
+        assert reader.generation() == 3
+        assert reader.load()["readings"]["1"]["data"] == {"temp": 21.5}
+
+        # A reader keeps the old mapping until the file is replaced
+        writer.write(4, {"readings": {}})
+        assert reader.generation() == 4
+        assert reader.load() == {"readings": {}}
+        reader.close()
+
+    def test_unknown_version_is_ignored(self, tmp_path):
+        path = tmp_path / "snapshot"
+        path.write_bytes(HEADER.pack(MAGIC, 99, 1, 2, 0.0) + b"{}")
+        assert SnapshotFile(str(path)).generation() is None
+
+    @pytest.mark.parametrize("content", [b"", b"not a snapshot file at all", b"AIRTHSNP"])
+    def test_corrupt_file_is_ignored(self, tmp_path, content):
+        path = tmp_path / "snapshot"
+        path.write_bytes(content)
+        assert SnapshotFile(str(path)).load() is None
+
+
+class TestLeaderElection:
+    def test_only_the_leader_polls(self, tmp_path, make_collector):
+        """Test that a follower serves the leader's snapshot without API calls."""
+        with FakeAirthingsAPI(devices=3) as api:
+            leader = make_replica(make_collector(api), tmp_path)
+            follower = make_replica(make_collector(api), tmp_path)
+            leader.poll()
+            follower.poll()
+
+            assert leader.leading and not follower.leading
+            assert api.total_requests() == 3
+            assert follower.collector.snapshot == leader.collector.snapshot
+            assert follower.collector.has_data()
+
+            # Within the interval neither replica polls again
+            leader.poll()
+            follower.poll()
+            assert api.total_requests() == 3
+            leader.stop()
+            follower.stop()
+
+    def test_follower_serves_device_status(self, tmp_path, make_collector):
+        """Test that followers expose the leader's device up and fetch duration gauges."""
+        with FakeAirthingsAPI(devices=2) as api:
+            leader = make_replica(make_collector(api), tmp_path)
+            follower = make_replica(make_collector(api), tmp_path)
+            leader.poll()
+            follower.poll()
+            metrics = {m.name: m for m in follower.collector.collect()}
+            leader.stop()
+            follower.stop()
+
+        up = {s.labels["device_id"]: s.value for s in metrics["airthings_device_up"].samples}
+        assert up == {device_id: 1 for device_id in api.device_ids}
+        durations = metrics["airthings_exporter_device_fetch_duration_seconds"].samples
+        assert {s.labels["device_id"] for s in durations} == set(api.device_ids)
+        assert follower.collector.fetch_durations == leader.collector.fetch_durations
+
+    def test_failover_keeps_the_rate_limit(self, tmp_path, make_collector):
+        """Test that the next leader continues the snapshot and waits out a rate limit."""
+        with FakeAirthingsAPI(devices=2) as api:
+            clock = FakeClock(time.time())
+            leader = make_replica(make_collector(api), tmp_path, clock)
+            follower = make_replica(make_collector(api), tmp_path, clock)
+            leader.poll()
+            follower.poll()
+            generation = leader.collector.snapshot.generation
+
+            leader.collector.restore_limits({"rate_limit_until": time.time() + 3600})
+            clock.now += 301
+            leader.poll()
+            leader.stop()
+
+            clock.now += 301
+            follower.poll()
+
+            assert follower.leading
+            assert follower.collector.rate_limit_until == leader.collector.rate_limit_until
+            assert follower.collector.snapshot.generation == generation
+            assert api.total_requests() == 2
+            follower.stop()
+
+    def test_failover_clears_an_expired_rate_limit(self, tmp_path, make_collector):
+        """Test that a rate limit the leader no longer has is cleared on takeover."""
+        with FakeAirthingsAPI(devices=2) as api:
+            clock = FakeClock(time.time())
+            leader = make_replica(make_collector(api), tmp_path, clock)
+            follower = make_replica(make_collector(api), tmp_path, clock)
+            leader.poll()
+            follower.poll()
+            follower.collector.restore_limits({"rate_limit_until": time.time() + 3600})
+
+            clock.now += 301
+            leader.poll()
+            leader.stop()
+            clock.now += 301
+            follower.poll()
+
+            assert follower.leading
+            assert follower.collector.rate_limit_until is None
+            follower.stop()
+
+    def test_new_leader_waits_for_the_interval(self, tmp_path, make_collector):
+        """Test that taking over doesn't poll before the shared snapshot is an interval old."""
+        with FakeAirthingsAPI(devices=2) as api:
+            clock = FakeClock(time.time())
+            leader = make_replica(make_collector(api), tmp_path, clock)
+            leader.poll()
+            leader.stop()
+
+            successor = make_replica(make_collector(api), tmp_path, clock)
+            successor.poll()
+            assert successor.leading
+            assert api.total_requests() == 2
+
+            clock.now += 301
+            successor.poll()
+            assert api.total_requests() == 4
+            successor.stop()
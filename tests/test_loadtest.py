@@ -0,0 +1,45 @@
+import pytest
+
+from airthings.CloudCollector import RateLimitException
+from tests import loadtest
+from tests.fake_airthings_api import FakeAirthingsAPI
+
+
+class TestFakeAirthingsAPI:
+    def test_collector_against_fake_api(self, make_collector):
+        """Test a full poll over HTTP against the fake API."""
+        with FakeAirthingsAPI(devices=5) as api:
+            collector = make_collector(api)
+            snapshot = collector.poll()
+
+        assert list(snapshot.readings) == api.device_ids
+        assert api.requests["token"] == 1
+        assert api.requests["devices/latest-samples"] == 5
+
+    def test_discovery_against_fake_api(self, make_collector):
+        """Test that discovery needs one request per location."""
+        with FakeAirthingsAPI(devices=120, devices_per_location=50) as api:
+            collector = make_collector(api, [], discover=True)
+            snapshot = collector.poll()
+
+        assert len(snapshot.readings) == 120
+        assert api.requests["locations/latest-samples"] == 3
+        assert "devices/latest-samples" not in api.requests
+
+    def test_rate_limit_against_fake_api(self, make_collector):
+        """Test that injected 429s carry headers the collector understands."""
+        with FakeAirthingsAPI(devices=3, throttle_probability=1.0) as api:
+            collector = make_collector(api)
+            with pytest.raises(RateLimitException):
+                collector.poll()
+
+        assert collector.rate_limit_until is not None
+
+
+def test_loadtest_harness():
+    """Run the benchmark harness end to end with a small fleet."""
+    results = loadtest.run(devices=20, scrapes=3, exporter_args=["--coalesce-window", "0"])
+
+    assert results["status_codes"] == {200: 3}
+    assert results["api_calls_per_scrape"] == 20
+    assert results["scrape_p99_seconds"] >= results["scrape_p50_seconds"]
@@ -0,0 +1,165 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+import requests
+from prometheus_client import CollectorRegistry
+
+from airthings.main import create_exporter, create_pusher, parse_args, warm_up
+from tests.fake_airthings_api import FakeAirthingsAPI
+from tests.fake_push_receiver import FakePushReceiver
+
+
+def url(server, path):
+    return f"http://127.0.0.1:{server.server_address[1]}{path}"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def untraced_env():
+    """Return the environment without the variables that run coverage in subprocesses."""
+    return {k: v for k, v in os.environ.items() if not k.startswith("COVERAGE_PROCESS_")}
+
+
+def seconds_to_run(command):
+    started = time.perf_counter()
+    subprocess.run(command, check=True, timeout=30, env=untraced_env())
+    return time.perf_counter() - started
+
+
+def wait_for_port(process, port):
+    """Wait until a started exporter accepts connections on its port."""
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except ConnectionRefusedError:
+            assert process.poll() is None, "the exporter exited"
+            time.sleep(0.005)
+
+
+class TestMain:
+    def test_import_has_no_side_effects(self):
+        """Test that importing the exporter parses no arguments and configures no logging."""
+        code = (
+            "import logging, sys; sys.argv = ['airthings-exporter', '--unknown'];"
+            "import airthings.main; assert not logging.getLogger().handlers"
+        )
+        subprocess.run([sys.executable, "-c", code], check=True, timeout=30)
+
+    def test_listens_before_api_responds(self):
+        """Test that the port is served within 200ms of startup while warm-up waits on the API.
+
+        The exporter runs as a process from spawn until its port accepts
+        connections, so imports count. The start of a bare interpreter, timed
+        right before, is subtracted, and the best of three runs is taken to
+        keep out noise.
+        """
+        with FakeAirthingsAPI(devices=1, latency=0.5) as api:
+            argv = ["--client-id", "id", "--client-secret", "secret"]
+            argv += ["--api-url", api.api_url, "--token-url", api.token_url]
+            argv += ["--device-id", api.device_ids[0]]
+            startups = []
+            for _ in range(3):
+                interpreter = seconds_to_run([sys.executable, "-c", "pass"])
+                port = free_port()
+                started = time.perf_counter()
+                with subprocess.Popen(
+                    [sys.executable, "-m", "airthings.main", "--port", str(port)] + argv,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                    env=untraced_env(),
+                ) as process:
+                    try:
+                        wait_for_port(process, port)
+                        startups.append(time.perf_counter() - started - interpreter)
+
+                        base = f"http://127.0.0.1:{port}"
+                        assert requests.get(f"{base}/health", timeout=5).status_code == 200
+                        assert requests.get(f"{base}/ready", timeout=5).status_code == 503
+
+                        deadline = time.monotonic() + 10
+                        while requests.get(f"{base}/ready", timeout=5).status_code != 200:
+                            assert time.monotonic() < deadline
+                            time.sleep(0.05)
+                    finally:
+                        process.terminate()
+
+        assert min(startups) < 0.2
+
+    def test_probe_accounts_from_file(self, tmp_path):
+        """Test that accounts from --accounts-file are served on /probe."""
+        with FakeAirthingsAPI(devices=2) as api:
+            path = tmp_path / "accounts.json"
+            path.write_text(
+                json.dumps(
+                    {
+                        "accounts": {
+                            "building-a": {
+                                "client_id": "a",
+                                "client_secret": "secret",
+                                "device_ids": api.device_ids[:1],
+                            }
+                        }
+                    }
+                )
+            )
+            args = parse_args(
+                ["--api-url", api.api_url, "--token-url", api.token_url, "--port", "0"]
+                + ["--accounts-file", str(path)]
+            )
+            server, _collector = create_exporter(args, registry=CollectorRegistry())
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            try:
+                response = requests.get(url(server, "/probe?account=building-a"), timeout=5)
+            finally:
+                server.shutdown()
+                server.server_close()
+
+        assert response.status_code == 200
+        assert f'device_id="{api.device_ids[0]}"' in response.text
+        assert f'device_id="{api.device_ids[1]}"' not in response.text
+
+    def test_push_without_pull(self):
+        """Test that readings are pushed while /metrics is disabled."""
+        with FakeAirthingsAPI(devices=2) as api, FakePushReceiver() as receiver:
+            args = parse_args(
+                ["--api-url", api.api_url, "--token-url", api.token_url, "--port", "0"]
+                + ["--device-id", api.device_ids[0], "--poll-interval", "60", "--disable-pull"]
+                + ["--push-url", f"{receiver.url}/api/v1/write", "--push-interval", "0.1"]
+            )
+            server, collector = create_exporter(args, registry=CollectorRegistry())
+            pusher = create_pusher(args, collector)
+            pollers = warm_up(collector, args)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            try:
+                deadline = time.monotonic() + 10
+                while not receiver.samples and time.monotonic() < deadline:
+                    time.sleep(0.05)
+                assert requests.get(url(server, "/metrics"), timeout=5).status_code == 404
+                assert requests.get(url(server, "/ready"), timeout=5).status_code == 200
+            finally:
+                server.shutdown()
+                server.server_close()
+                for poller in pollers:
+                    poller.stop()
+                pusher.stop()
+
+        assert {device_id for _, device_id, _, _ in receiver.samples} == {api.device_ids[0]}
+
+    def test_push_needs_poll_interval(self):
+        with pytest.raises(SystemExit):
+            parse_args(["--push-url", "http://localhost:9090/api/v1/write"])
+
+    def test_ha_needs_poll_interval(self, tmp_path):
+        with pytest.raises(SystemExit):
+            parse_args(["--ha-dir", str(tmp_path)])
@@ -0,0 +1,117 @@
+import gzip
+from contextlib import contextmanager
+from unittest.mock import Mock
+
+import pytest
+from prometheus_client import CollectorRegistry
+from prometheus_client.metrics_core import GaugeMetricFamily
+
+from airthings.CloudCollector import RateLimitException
+from airthings.MetricsCache import MetricsCache, accepts_gzip, etag_matches
+from airthings.Snapshot import Snapshot
+from tests.fake_airthings_api import FakeAirthingsAPI
+
+
+class CountingCollector:
+    """Collector stand-in exposing a snapshot and counting renders."""
+
+    def __init__(self, poll_on_collect=False):
+        self.poll_on_collect = poll_on_collect
+        self.snapshot = Snapshot(1, {})
+        self.collect_count = 0
+        self.render_count = 0
+
+    def collect(self):
+        self.collect_count += 1
+        gauge = GaugeMetricFamily("airthings_exporter_scrapes", "Scrapes of the exporter")
+        gauge.add_metric([], self.collect_count)
+        yield gauge
+
+    @contextmanager
+    def streaming(self):
+        yield
+
+    def render_device_metrics(self, _openmetrics=False):
+        self.render_count += 1
+        return f"airthings_gauge {self.snapshot.generation}.0\n"
+
+
+def make_cache(poll_on_collect=False):
+    collector = CountingCollector(poll_on_collect)
+    registry = CollectorRegistry()
+    registry.register(collector)
+    return MetricsCache(registry, collector), collector
+
+
+class TestMetricsCache:
+    def test_device_metrics_are_cached_per_generation(self):
+        """Test that devices are only rendered again for a new snapshot, the registry always."""
+        cache, collector = make_cache()
+
+        first = cache.get(compress=True)
+        second = cache.get()
+        assert collector.render_count == 1
+        assert collector.collect_count == 2
+        assert b"airthings_gauge 1.0" in second.body
+        assert b"airthings_exporter_scrapes 2.0" in second.body
+        assert gzip.decompress(first.gzip_body) == first.body
+        assert second.gzip_body is None
+        assert second.etag != first.etag
+
+        collector.snapshot = Snapshot(2, {})
+        third = cache.get()
+        assert collector.render_count == 2
+        assert b"airthings_gauge 2.0" in third.body
+
+    def test_get_renders_every_time_when_polling_on_collect(self):
+        """Test that nothing is cached when each scrape polls the API."""
+        cache, collector = make_cache(poll_on_collect=True)
+
+        assert cache.get().gzip_body is None
+        assert cache.get(compress=True).gzip_body is not None
+        assert collector.render_count == 2
+        assert collector.collect_count == 2
+
+    def test_rate_limit_shows_without_new_snapshot(self, make_collector):
+        """Test that a throttled background poll is reported although no readings changed."""
+        with FakeAirthingsAPI(devices=2) as api:
+            collector = make_collector(api)
+            registry = CollectorRegistry()
+            registry.register(collector)
+            cache = MetricsCache(registry, collector)
+            collector.poll()
+            sample = b"\nairthings_exporter_rate_limited_until_timestamp_seconds "
+            assert sample not in cache.get().body
+
+            api.throttle_probability = 1.0
+            with pytest.raises(RateLimitException):
+                collector.poll()
+            after = cache.get()
+
+        assert after.generation == 1
+        assert sample in after.body
+
+    def test_get_propagates_errors(self):
+        """Test that collector errors reach the HTTP handler."""
+        registry = Mock()
+        cache = MetricsCache(registry)
+        registry.collect.side_effect = RuntimeError("API Error")
+        with pytest.raises(RuntimeError):
+            cache.get()
+
+    def test_accepts_gzip(self):
+        """Test Accept-Encoding parsing."""
+        assert accepts_gzip("gzip")
+        assert accepts_gzip("deflate, gzip;q=0.5")
+        assert accepts_gzip("*")
+        assert not accepts_gzip("gzip;q=0")
+        assert not accepts_gzip("identity")
+        assert not accepts_gzip(None)
+
+    def test_etag_matches(self):
+        """Test If-None-Match parsing."""
+        assert etag_matches('"abc"', '"abc"')
+        assert etag_matches('"other", W/"abc"', '"abc"')
+        assert etag_matches("*", '"abc"')
+        assert not etag_matches('"other"', '"abc"')
+        assert not etag_matches(None, '"abc"')
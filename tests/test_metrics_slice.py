@@ -0,0 +1,171 @@
+from collections import Counter
+
+import pytest
+from prometheus_client import CollectorRegistry
+from prometheus_client.parser import text_string_to_metric_families
+
+from airthings.CloudCollector import CloudCollector
+from airthings.MetricsCache import MetricsCache
+from airthings.MetricsSlice import MetricsSlice, ShardIndex, device_shard, jump_hash, parse_slice
+from tests.fake_airthings_api import FakeAirthingsAPI
+
+
+def samples(body):
+    return [
+        sample
+        for family in text_string_to_metric_families(body.decode())
+        for sample in family.samples
+    ]
+
+
+@pytest.fixture(name="fleet")
+def fleet_fixture(make_collector):
+    """A collector of 40 devices, polled in the background like with --poll-interval."""
+    with FakeAirthingsAPI(devices=40) as api:
+        collector = make_collector(api)
+        registry = CollectorRegistry()
+        registry.register(collector)
+        collector.poll()
+        yield MetricsCache(registry, collector), api
+
+
+class TestJumpHash:
+    def test_buckets_are_in_range_and_balanced(self):
+        """Test that keys spread evenly over the buckets."""
+        counts = Counter(jump_hash(key * 0x9E3779B97F4A7C15, 10) for key in range(10000))
+        assert set(counts) == set(range(10))
+        assert all(800 < count < 1200 for count in counts.values())
+
+    def test_growing_only_moves_keys_to_the_new_bucket(self):
+        """Test that going from n to n + 1 buckets moves about 1/(n + 1) of the keys."""
+        device_ids = [f"29300{i:05d}" for i in range(2000)]
+        before = {d: device_shard(d, 4) for d in device_ids}
+        after = {d: device_shard(d, 5) for d in device_ids}
+
+        moved = [d for d in device_ids if before[d] != after[d]]
+        assert all(after[d] == 4 for d in moved)
+        assert 300 < len(moved) < 500
+
+    def test_single_bucket(self):
+        assert jump_hash(12345, 1) == 0
+
+
+class TestParseSlice:
+    def test_no_slice(self):
+        assert parse_slice("") is None
+        assert parse_slice("account=home") is None
+
+    def test_filters(self):
+        """Test repeated and comma-separated devices and sensors."""
+        assert parse_slice("device=1,2&device=3&sensor=temp&shard=1/4") == MetricsSlice(
+            ("1", "2", "3"), ("temp",), (1, 4)
+        )
+
+    @pytest.mark.parametrize(
+        "query", ["shard=4/4", "shard=-1/4", "shard=0/0", "shard=a/b", "shard=1", "device="]
+    )
+    def test_invalid(self, query):
+        with pytest.raises(ValueError):
+            parse_slice(query)
+
+    def test_exporter_metrics(self):
+        """Test that the exporter's own metrics only go with the first shard."""
+        assert MetricsSlice(shard=(0, 4)).exporter_metrics
+        assert not MetricsSlice(shard=(1, 4)).exporter_metrics
+        assert not MetricsSlice(devices=("1",)).exporter_metrics
+        assert not MetricsSlice(sensors=("temp",), shard=(0, 4)).exporter_metrics
+
+
+class TestShardIndex:
+    def test_index_is_built_once_per_generation(self):
+        """Test that the devices are only looked at again for a new snapshot."""
+        index = ShardIndex()
+        calls = []
+
+        def known_devices():
+            calls.append(1)
+            return ["a", "b", "c", "d"]
+
+        shards = [index.devices(1, known_devices, i, 2) for i in range(2)]
+        assert sorted(shards[0] + shards[1]) == ["a", "b", "c", "d"]
+        assert index.devices(1, known_devices, 0, 2) == shards[0]
+        assert len(calls) == 1
+
+        index.devices(2, known_devices, 0, 2)
+        assert len(calls) == 2
+
+    def test_select_filters_devices_by_shard(self):
+        index = ShardIndex()
+        metrics_slice = MetricsSlice(devices=("a", "b", "c", "d"), shard=(1, 3))
+        selected = index.select(metrics_slice, 1, lambda: [])
+        assert selected == [d for d in "abcd" if device_shard(d, 3) == 1]
+
+
+class TestSlicedMetrics:
+    def test_shards_partition_the_fleet(self, fleet):
+        """Test that every device is in exactly one shard and no shard calls the API."""
+        cache, api = fleet
+        requests_before = sum(api.requests.values())
+
+        temperatures = Counter()
+        exporter_metrics = []
+        for index in range(3):
+            body = cache.get(metrics_slice=MetricsSlice(shard=(index, 3))).body
+            parsed = samples(body)
+            for s in parsed:
+                if s.name == "airthings_temperature_celsius":
+                    temperatures[s.labels["device_id"]] += 1
+                    assert device_shard(s.labels["device_id"], 3) == index
+            exporter_metrics.append(
+                any(s.name == "airthings_exporter_token_refreshes_total" for s in parsed)
+            )
+
+        assert temperatures == Counter({device_id: 1 for device_id in api.device_ids})
+        assert exporter_metrics == [True, False, False]
+        assert sum(api.requests.values()) == requests_before
+
+    def test_device_and_sensor_filter(self, fleet):
+        """Test that filters select devices and sensors by API field or metric name."""
+        cache, api = fleet
+        device_id = api.device_ids[5]
+        metrics_slice = parse_slice(
+            f"device={device_id}&sensor=temp,airthings_co2_parts_per_million"
+        )
+
+        parsed = samples(cache.get(metrics_slice=metrics_slice).body)
+
+        assert sorted((s.name, s.labels["device_id"]) for s in parsed) == [
+            ("airthings_co2_parts_per_million", device_id),
+            ("airthings_temperature_celsius", device_id),
+        ]
+
+    def test_device_gauges_follow_the_slice(self, fleet):
+        cache, api = fleet
+        device_id = api.device_ids[0]
+        parsed = samples(cache.get(metrics_slice=MetricsSlice(devices=(device_id,))).body)
+        up = [s for s in parsed if s.name == "airthings_device_up"]
+        assert [(s.labels["device_id"], s.value) for s in up] == [(device_id, 1.0)]
+
+    def test_slices_are_cached_per_generation(self, fleet):
+        cache, _ = fleet
+        metrics_slice = MetricsSlice(shard=(1, 2))
+        first = cache.get(metrics_slice=metrics_slice)
+        assert cache.get(metrics_slice=metrics_slice) is first
+
+        cache.collector.poll()
+        assert cache.get(metrics_slice=metrics_slice) is not first
+
+    def test_slices_need_background_polling(self):
+        """Test that slices are refused when scrapes poll, as slices alone would never poll."""
+        collector = CloudCollector("client_id", "client_secret", ["1"])
+        cache = MetricsCache(CollectorRegistry(), collector)
+
+        assert not cache.supports_slices
+        with pytest.raises(ValueError, match="--poll-interval"):
+            cache.get(metrics_slice=MetricsSlice(shard=(0, 2)))
+
+    def test_openmetrics_slice_ends_with_eof(self, fleet):
+        cache, _ = fleet
+        rendered = cache.get(openmetrics=True, metrics_slice=MetricsSlice(shard=(1, 2)))
+        assert rendered.body.endswith(b"# EOF\n")
+        assert rendered.body.count(b"# EOF") == 1
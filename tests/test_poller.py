@@ -0,0 +1,52 @@
+import time
+from unittest.mock import Mock, patch
+
+from airthings.CloudCollector import CloudCollector, RateLimitException
+from airthings.Poller import Poller
+
+
+class TestPoller:
+    def test_poll_once(self):
+        """Test that a poll cycle refreshes the collector snapshot."""
+        collector = Mock()
+        Poller(collector, 60).poll_once()
+        collector.poll.assert_called_once()
+
+    def test_poll_once_survives_errors(self):
+        """Test that API errors and rate limits don't stop the poller."""
+        collector = Mock()
+        collector.poll.side_effect = [
+            RateLimitException(60, "later"),
+            RuntimeError("API Error"),
+        ]
+        poller = Poller(collector, 60)
+        poller.poll_once()
+        poller.poll_once()
+        assert collector.poll.call_count == 2
+
+    def test_start_and_stop(self):
+        """Test that the background thread polls immediately and stops cleanly."""
+        collector = Mock()
+        poller = Poller(collector, 60)
+        poller.start()
+        poller.stop(timeout=5)
+        collector.poll.assert_called_once()
+        assert not poller._thread.is_alive()
+
+    def test_initial_delay(self):
+        """Test that the first poll waits for the initial delay."""
+        collector = Mock()
+        poller = Poller(collector, 60, initial_delay=60)
+        poller.start()
+        poller.stop(timeout=5)
+        collector.poll.assert_not_called()
+
+    def test_short_interval_ignores_coalesce_window(self):
+        """Test that background polls are not coalesced with the previous one."""
+        collector = CloudCollector("client_id", "client_secret", ["device1"], coalesce_window=5)
+        with patch.object(collector, "__poll__") as poll:
+            poller = Poller(collector, 0.05)
+            poller.start()
+            time.sleep(0.5)
+            poller.stop(timeout=5)
+        assert poll.call_count >= 4
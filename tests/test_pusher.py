@@ -0,0 +1,141 @@
+import os
+
+import pytest
+
+from airthings.CloudCollector import CloudCollector
+from airthings.Pusher import Pusher
+from airthings.Snapshot import DeviceReading
+from tests.fake_airthings_api import FakeAirthingsAPI
+from tests.fake_push_receiver import FakePushReceiver
+
+
+@pytest.fixture
+def collector():
+    return CloudCollector("client_id", "client_secret", ["device1"], poll_on_collect=False)
+
+
+def readings(sample_time, temp=21.5, device_id="device1"):
+    return {device_id: DeviceReading({"temp": temp, "co2": 450, "time": sample_time}, 0)}
+
+
+def make_pusher(receiver, push_format="remote-write", **options):
+    path = "/v1/metrics" if push_format == "otlp" else "/api/v1/write"
+    return Pusher(receiver.url + path, push_format, retry_delay=0, **options)
+
+
+class TestPusher:
+    @pytest.mark.parametrize("push_format", ["remote-write", "otlp"])
+    def test_pushes_polled_readings(self, push_format, make_collector):
+        """Test that every poll's readings reach the receiver with their sample times."""
+        with FakeAirthingsAPI(devices=2) as api, FakePushReceiver() as receiver:
+            collector = make_collector(api)
+            pusher = make_pusher(receiver, push_format)
+            pusher.attach(collector)
+            snapshot = collector.poll()
+            pusher.flush()
+
+        expected = sorted(
+            (sensor.metric_name, device_id, float(value), reading.data["time"])
+            for device_id, reading in snapshot.readings.items()
+            for key, value in reading.data.items()
+            if (sensor := collector.sensor_map.lookup(key, value)) is not None
+        )
+        assert sorted(receiver.samples) == expected
+        headers = receiver.requests[0][1]
+        if push_format == "remote-write":
+            assert headers["Content-Encoding"] == "snappy"
+            assert headers["Content-Type"] == "application/x-protobuf"
+        else:
+            assert headers["Content-Encoding"] == "gzip"
+
+    def test_readings_are_pushed_once(self, collector):
+        """Test that a reading returned by several polls is only pushed once."""
+        with FakePushReceiver() as receiver:
+            pusher = make_pusher(receiver)
+            pusher.add_readings(collector, readings(1700000000))
+            pusher.add_readings(collector, readings(1700000000))
+            pusher.add_readings(collector, readings(1700000300, temp=22.0))
+            pusher.flush()
+
+        temperatures = [s for s in receiver.samples if s[0] == "airthings_temperature_celsius"]
+        assert temperatures == [
+            ("airthings_temperature_celsius", "device1", 21.5, 1700000000),
+            ("airthings_temperature_celsius", "device1", 22.0, 1700000300),
+        ]
+
+    def test_batches_by_size(self, collector):
+        """Test that samples are split into requests of at most batch_size samples."""
+        with FakePushReceiver() as receiver:
+            pusher = make_pusher(receiver, batch_size=3)
+            for i in range(4):
+                pusher.add_readings(collector, readings(1700000000 + i * 300))
+            pusher.flush()
+
+        assert len(receiver.requests) == 3
+        assert len(receiver.samples) == 8
+
+    def test_queue_is_bounded(self, collector):
+        """Test that the oldest samples are dropped once the queue is full."""
+        with FakePushReceiver() as receiver:
+            pusher = make_pusher(receiver, queue_size=4)
+            for i in range(3):
+                pusher.add_readings(collector, readings(1700000000 + i * 300))
+            pusher.flush()
+
+        assert sorted({s[3] for s in receiver.samples}) == [1700000300, 1700000600]
+
+    def test_spills_during_outage_and_resends_in_order(self, collector, tmp_path):
+        """Test that batches failing during an outage are spilled and sent oldest first."""
+        spill_dir = str(tmp_path / "spill")
+        with FakePushReceiver(fail_requests=1000) as receiver:
+            pusher = make_pusher(receiver, spill_dir=spill_dir, attempts=2)
+            pusher.add_readings(collector, readings(1700000000))
+            pusher.flush()
+            pusher.add_readings(collector, readings(1700000300))
+            pusher.flush()
+            assert len(os.listdir(spill_dir)) == 2
+            assert not receiver.samples
+
+            receiver.fail_requests = 0
+            pusher.add_readings(collector, readings(1700000600))
+            pusher.flush()
+
+        assert [s[3] for s in receiver.samples] == [1700000000] * 2 + [1700000300] * 2 + [
+            1700000600
+        ] * 2
+        assert not os.listdir(spill_dir)
+
+    def test_spilled_batches_survive_restart(self, collector, tmp_path):
+        """Test that a new pusher sends what a previous one spilled."""
+        spill_dir = str(tmp_path / "spill")
+        with FakePushReceiver(fail_requests=1000) as receiver:
+            pusher = make_pusher(receiver, spill_dir=spill_dir, attempts=1)
+            pusher.add_readings(collector, readings(1700000000))
+            pusher.stop()
+
+            receiver.fail_requests = 0
+            make_pusher(receiver, spill_dir=spill_dir).flush()
+
+        assert len(receiver.samples) == 2
+
+    def test_client_errors_are_dropped(self, collector, tmp_path):
+        """Test that batches the receiver rejects are not spilled or retried."""
+        spill_dir = str(tmp_path / "spill")
+        with FakePushReceiver(fail_requests=1, fail_status=400) as receiver:
+            pusher = make_pusher(receiver, spill_dir=spill_dir)
+            pusher.add_readings(collector, readings(1700000000))
+            pusher.flush()
+
+        assert len(receiver.requests) == 1
+        assert not os.listdir(spill_dir)
+
+    def test_spill_directory_is_bounded(self, collector, tmp_path):
+        """Test that the oldest spilled batches are removed beyond the size limit."""
+        spill_dir = str(tmp_path / "spill")
+        with FakePushReceiver(fail_requests=1000) as receiver:
+            pusher = make_pusher(receiver, spill_dir=spill_dir, spill_max_bytes=1, attempts=1)
+            for i in range(3):
+                pusher.add_readings(collector, readings(1700000000 + i * 300))
+                pusher.flush()
+
+        assert len(os.listdir(spill_dir)) == 1
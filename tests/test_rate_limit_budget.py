@@ -0,0 +1,82 @@
+from airthings.RateLimitBudget import RateLimitBudget
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+def headers(remaining, reset_at, limit=120):
+    return {
+        "X-RateLimit-Limit": str(limit),
+        "X-RateLimit-Remaining": str(remaining),
+        "X-RateLimit-Reset": str(int(reset_at)),
+    }
+
+
+class TestRateLimitBudget:
+    def test_no_headers_means_no_throttling(self):
+        """Test that the budget allows everything without rate limit headers."""
+        budget = RateLimitBudget(clock=FakeClock())
+        budget.update({})
+        assert budget.plan(10) == 10
+        budget.record_cycle(10)
+        assert budget.plan(10) == 10
+
+    def test_cycles_are_spaced_over_the_window(self):
+        """Test that the remaining budget is spread until the window resets."""
+        clock = FakeClock()
+        budget = RateLimitBudget(reserve=0, clock=clock)
+        budget.update(headers(remaining=40, reset_at=clock.now + 3600))
+
+        assert budget.plan(10) == 10
+        budget.record_cycle(10)
+        # 40 requests left are four cycles of 10 in 3600 seconds
+        assert budget.next_poll_at == clock.now + 900
+        assert budget.plan(10) == 0
+
+        clock.now += 900
+        assert budget.plan(10) == 10
+
+    def test_partial_budget_limits_requests(self):
+        """Test that a budget smaller than one cycle only allows part of it."""
+        clock = FakeClock()
+        budget = RateLimitBudget(reserve=2, clock=clock)
+        budget.update(headers(remaining=7, reset_at=clock.now + 3600))
+        assert budget.plan(10) == 5
+
+    def test_exhausted_budget_waits_for_reset(self):
+        """Test that polling pauses until the window resets once the budget is used up."""
+        clock = FakeClock()
+        budget = RateLimitBudget(reserve=2, clock=clock)
+        reset_at = clock.now + 600
+        budget.update(headers(remaining=2, reset_at=reset_at))
+
+        budget.record_cycle(5)
+        assert budget.next_poll_at == reset_at
+        assert budget.plan(5) == 0
+
+        clock.now = reset_at
+        assert budget.plan(5) == 5
+
+    def test_update_keeps_lowest_remaining_within_window(self):
+        """Test that out-of-order responses don't raise the remaining count."""
+        clock = FakeClock()
+        budget = RateLimitBudget(clock=clock)
+        reset_at = clock.now + 3600
+        budget.update(headers(remaining=10, reset_at=reset_at))
+        budget.update(headers(remaining=12, reset_at=reset_at))
+        assert budget.remaining == 10
+
+        budget.update(headers(remaining=120, reset_at=reset_at + 3600))
+        assert budget.remaining == 120
+
+    def test_update_ignores_malformed_headers(self):
+        """Test that unparsable headers are ignored."""
+        budget = RateLimitBudget(clock=FakeClock())
+        budget.update({"X-RateLimit-Remaining": "soon", "X-RateLimit-Reset": None})
+        assert budget.remaining is None
+        assert budget.reset_at is None
@@ -0,0 +1,56 @@
+from unittest.mock import Mock
+
+import pytest
+import requests
+
+from airthings.CloudCollector import RateLimitException
+from airthings.Retry import call_with_retries, is_transient
+
+
+def http_error(status_code):
+    return requests.HTTPError(response=Mock(status_code=status_code))
+
+
+class TestRetry:
+    def test_is_transient(self):
+        """Test that only timeouts, connection errors and 5xx are retried."""
+        assert is_transient(requests.Timeout())
+        assert is_transient(requests.ConnectionError())
+        assert is_transient(http_error(503))
+        assert not is_transient(http_error(404))
+        assert not is_transient(KeyError("data"))
+        assert not is_transient(RateLimitException(60, "later"))
+
+    def test_retries_with_exponential_backoff(self):
+        """Test that transient errors are retried with growing, jittered delays."""
+        fn = Mock(side_effect=[requests.Timeout(), http_error(502), "ok"])
+        sleep = Mock()
+        on_retry = Mock()
+
+        assert call_with_retries(fn, base_delay=1, sleep=sleep, on_retry=on_retry) == "ok"
+        assert fn.call_count == 3
+        assert on_retry.call_count == 2
+        first, second = (c.args[0] for c in sleep.call_args_list)
+        assert 0 <= first <= 1
+        assert 0 <= second <= 2
+
+    def test_gives_up_after_attempts(self):
+        """Test that the last error is raised once all attempts failed."""
+        fn = Mock(side_effect=requests.Timeout())
+        with pytest.raises(requests.Timeout):
+            call_with_retries(fn, attempts=2, sleep=Mock())
+        assert fn.call_count == 2
+
+    def test_permanent_errors_are_not_retried(self):
+        """Test that client errors are raised right away."""
+        fn = Mock(side_effect=http_error(404))
+        with pytest.raises(requests.HTTPError):
+            call_with_retries(fn, sleep=Mock())
+        fn.assert_called_once()
+
+    def test_no_retry_past_deadline(self):
+        """Test that no retry starts if its backoff would end after the deadline."""
+        fn = Mock(side_effect=requests.Timeout())
+        with pytest.raises(requests.Timeout):
+            call_with_retries(fn, base_delay=1, deadline=100, clock=lambda: 100, sleep=Mock())
+        fn.assert_called_once()
@@ -0,0 +1,183 @@
+import json
+
+import pytest
+from prometheus_client import CollectorRegistry, generate_latest
+from prometheus_client.parser import text_string_to_metric_families
+
+from airthings.CloudCollector import CloudCollector
+from airthings.MetricsCache import MetricsCache
+from airthings.RollingAggregates import (
+    RingBuffer,
+    RollingAggregates,
+    format_window,
+    parse_window,
+)
+from airthings.Sensors import SensorMap
+
+HOUR = 3600
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1700000000.0
+
+    def __call__(self):
+        return self.now
+
+
+def window_samples(families):
+    return sorted(
+        (s.name, tuple(sorted(s.labels.items())), s.value)
+        for family in families
+        for s in family.samples
+        if "window" in s.labels
+    )
+
+
+class TestRingBuffer:
+    def test_aggregates_samples_in_window(self):
+        """Test min, max and mean over the samples of the window."""
+        buffer = RingBuffer(HOUR, buckets=12)
+        for offset, value in ((0, 20.0), (600, 24.0), (1200, 22.0)):
+            buffer.add(1700000000 + offset, value)
+
+        assert buffer.aggregate(1700001200) == (20.0, 24.0, 22.0)
+
+    def test_old_buckets_leave_the_window(self):
+        """Test that buckets older than the window no longer count."""
+        buffer = RingBuffer(HOUR, buckets=12)
+        buffer.add(1700000000, 100.0)
+        buffer.add(1700000000 + HOUR, 10.0)
+
+        assert buffer.aggregate(1700000000 + HOUR) == (10.0, 10.0, 10.0)
+        assert buffer.aggregate(1700000000 + 3 * HOUR) is None
+
+    def test_samples_older_than_the_ring_are_dropped(self):
+        """Test that a late sample doesn't overwrite a newer bucket in the same slot."""
+        buffer = RingBuffer(HOUR, buckets=12)
+        buffer.add(1700000000 + HOUR, 10.0)
+        buffer.add(1700000000, 100.0)
+
+        assert buffer.aggregate(1700000000 + HOUR) == (10.0, 10.0, 10.0)
+
+    def test_size_does_not_grow_with_samples(self):
+        """Test that the buffer's memory is fixed by its bucket count."""
+        buffer = RingBuffer(7 * 24 * HOUR)
+        size = buffer.__sizeof__()
+        for i in range(5000):
+            buffer.add(1700000000 + i * 300, float(i))
+
+        assert buffer.__sizeof__() == size
+        assert size < 1300
+
+
+class TestRollingAggregates:
+    def test_repeated_readings_are_added_once(self):
+        """Test that a reading returned by several polls doesn't skew the mean."""
+        aggregates = RollingAggregates([HOUR], clock=FakeClock())
+        sensor_map = SensorMap()
+        aggregates.add_reading("device1", {"temp": 20, "time": 1699999000}, sensor_map, 0)
+        aggregates.add_reading("device1", {"temp": 20, "time": 1699999000}, sensor_map, 0)
+        aggregates.add_reading("device1", {"temp": 26, "time": 1699999300}, sensor_map, 0)
+
+        gauges = {name: values for name, _, values in aggregates.gauges()}
+        assert gauges["airthings_temperature_celsius_avg"] == {("device1", "1h"): 23.0}
+        assert gauges["airthings_temperature_celsius_min"] == {("device1", "1h"): 20.0}
+        assert gauges["airthings_temperature_celsius_max"] == {("device1", "1h"): 26.0}
+
+    def test_gauges_of_some_devices_and_sensors(self):
+        """Test that gauges can be limited to a slice of the series."""
+        aggregates = RollingAggregates([HOUR], clock=FakeClock())
+        for device_id in ("device1", "device2"):
+            data = {"temp": 20, "co2": 600, "time": 1699999000}
+            aggregates.add_reading(device_id, data, SensorMap(), 0)
+
+        gauges = aggregates.gauges(["device2", "unknown"], {"airthings_co2_parts_per_million"})
+        assert {name: values for name, _, values in gauges} == {
+            f"airthings_co2_parts_per_million_{statistic}": {("device2", "1h"): 600.0}
+            for statistic in ("min", "max", "avg")
+        }
+
+    def test_export_and_restore(self):
+        """Test that buffers survive a JSON round trip into a fresh instance."""
+        clock = FakeClock()
+        aggregates = RollingAggregates([HOUR, 24 * HOUR], clock=clock)
+        aggregates.add_reading("device1", {"co2": 600, "time": 1699999000}, SensorMap(), 0)
+
+        restored = RollingAggregates([HOUR, 24 * HOUR], clock=clock)
+        restored.restore(json.loads(json.dumps(aggregates.export())))
+
+        assert restored.gauges() == aggregates.gauges()
+        # The restored sample is not added a second time
+        restored.add_reading("device1", {"co2": 900, "time": 1699999000}, SensorMap(), 0)
+        assert restored.gauges() == aggregates.gauges()
+
+    def test_restore_ignores_other_windows(self):
+        """Test that buffers saved with different windows are discarded."""
+        aggregates = RollingAggregates([HOUR], clock=FakeClock())
+        aggregates.add_reading("device1", {"co2": 600, "time": 1699999000}, SensorMap(), 0)
+
+        restored = RollingAggregates([2 * HOUR], clock=FakeClock())
+        restored.restore(aggregates.export())
+        assert restored.gauges() == []
+
+    @pytest.mark.parametrize(
+        "text, seconds", [("30m", 1800), ("1h", HOUR), ("24h", 24 * HOUR), ("7d", 604800)]
+    )
+    def test_parse_window(self, text, seconds):
+        assert parse_window(text) == seconds
+
+    @pytest.mark.parametrize("text", ["", "1w", "0h", "h", "-1h"])
+    def test_parse_invalid_window(self, text):
+        with pytest.raises(ValueError):
+            parse_window(text)
+
+    def test_format_window(self):
+        assert [format_window(s) for s in (90, 1800, 24 * HOUR, 604800)] == [
+            "90s",
+            "30m",
+            "1d",
+            "7d",
+        ]
+
+
+class TestCollectorAggregates:
+    def test_streamed_aggregates_match_registry(self, mock_device_data):
+        """Test that both renderings export the same windowed gauges."""
+        collector = CloudCollector(
+            "client_id",
+            "client_secret",
+            ["device1"],
+            poll_on_collect=False,
+            aggregate_windows=(HOUR, 7 * 24 * HOUR),
+        )
+        collector.aggregates.clock = FakeClock()
+        collector.__to_readings__({"device1": dict(mock_device_data, time=1699999000)}, 0.1)
+        registry = CollectorRegistry()
+        registry.register(collector)
+
+        expected = window_samples(
+            text_string_to_metric_families(generate_latest(registry).decode())
+        )
+        streamed = MetricsCache(registry, collector).get().body.decode()
+
+        assert window_samples(text_string_to_metric_families(streamed)) == expected
+        assert (
+            "airthings_temperature_celsius_max",
+            (("device_id", "device1"), ("window", "7d")),
+            22.5,
+        ) in expected
+        assert "airthings_exporter_aggregate_buffer_bytes" in streamed
+
+    def test_aggregates_persist_with_state(self, mock_device_data):
+        """Test that the buffers are part of the saved collector state."""
+        options = {"poll_on_collect": False, "aggregate_windows": (HOUR,)}
+        collector = CloudCollector("client_id", "client_secret", ["device1"], **options)
+        collector.__to_readings__({"device1": dict(mock_device_data, time=1699999000)}, 0.1)
+
+        restored = CloudCollector("client_id", "client_secret", ["device1"], **options)
+        restored.restore_state(json.loads(json.dumps(collector.export_state())))
+
+        clock = FakeClock()
+        collector.aggregates.clock = restored.aggregates.clock = clock
+        assert restored.aggregates.gauges() == collector.aggregates.gauges()
@@ -0,0 +1,63 @@
+from airthings.SampleSchedule import MAX_SAMPLE_INTERVAL, SampleSchedule
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 10000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestSampleSchedule:
+    def test_unknown_devices_are_due(self):
+        """Test that devices are fetched until their interval is known."""
+        schedule = SampleSchedule(clock=FakeClock())
+        assert schedule.is_due("device1")
+        schedule.observe("device1", 10000)
+        assert schedule.is_due("device1")
+        assert schedule.intervals() == {}
+
+    def test_due_after_next_expected_sample(self):
+        """Test that a device is due once its next sample should be uploaded."""
+        clock = FakeClock()
+        schedule = SampleSchedule(upload_delay=30, clock=clock)
+        schedule.observe("device1", 9700)
+        schedule.observe("device1", 10000)
+        assert schedule.intervals() == {"device1": 300}
+
+        clock.now = 10329
+        assert not schedule.is_due("device1")
+        clock.now = 10330
+        assert schedule.is_due("device1")
+
+    def test_late_sample_backs_off(self):
+        """Test that a fetch without a new sample is retried after a short backoff."""
+        clock = FakeClock()
+        schedule = SampleSchedule(upload_delay=30, clock=clock)
+        schedule.observe("device1", 6400)
+        schedule.observe("device1", 10000)
+
+        clock.now = 13630
+        schedule.observe("device1", 10000)
+        assert not schedule.is_due("device1")
+        clock.now = 13630 + 360
+        assert schedule.is_due("device1")
+
+    def test_skipped_samples_do_not_stretch_interval(self):
+        """Test that fetching late counts missed samples instead of learning a longer interval."""
+        schedule = SampleSchedule(clock=FakeClock())
+        schedule.observe("device1", 0)
+        schedule.observe("device1", 300)
+        schedule.observe("device1", 1200)
+        assert schedule.intervals()["device1"] == 300
+
+        schedule.observe("radon", 0)
+        schedule.observe("radon", 7200)
+        assert schedule.intervals()["radon"] == MAX_SAMPLE_INTERVAL
+
+    def test_readings_without_time_are_ignored(self):
+        """Test that devices without a sample time are always fetched."""
+        schedule = SampleSchedule(clock=FakeClock())
+        schedule.observe("device1", None)
+        assert schedule.is_due("device1")
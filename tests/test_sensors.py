@@ -0,0 +1,104 @@
+from airthings.Sensors import SENSORS, SensorMap, generic_sensor
+
+
+def samples(families):
+    return [s for family in families.values() for s in family.samples]
+
+
+class TestSensorMap:
+    def test_all_sensors_are_mapped(self):
+        """Test that every table entry produces its metric with a float value."""
+        sensor_map = SensorMap()
+        families = {}
+        data = {sensor.key: 1 for sensor in SENSORS}
+
+        sensor_map.add_samples(families, data, {"device_id": "1"})
+
+        assert [s.name for s in samples(families)] == [sensor.metric_name for sensor in SENSORS]
+        assert all(isinstance(s.value, float) for s in samples(families))
+
+    def test_new_fields(self):
+        """Test fields that were previously dropped."""
+        sensor_map = SensorMap()
+        families = {}
+        data = {"radonLongTermAvg": 40, "light": 12, "sla": 45, "mold": 2, "rssi": -60}
+
+        sensor_map.add_samples(families, data, {"device_id": "1"})
+
+        values = {s.name: s.value for s in samples(families)}
+        assert values == {
+            "airthings_radon_long_term_average_becquerels_per_cubic_meter": 40.0,
+            "airthings_light_percent": 12.0,
+            "airthings_sound_level_a_weighted_decibels": 45.0,
+            "airthings_mold_risk_index": 2.0,
+            "airthings_rssi_dbm": -60.0,
+        }
+
+    def test_unknown_fields_are_dropped_by_default(self):
+        """Test that unknown and ignored fields are not exported."""
+        sensor_map = SensorMap()
+        families = {}
+
+        sensor_map.add_samples(
+            families, {"time": 1700000000, "newSensor": 1, "temp": None}, {"device_id": "1"}
+        )
+
+        assert samples(families) == []
+
+    def test_generic_fallback(self):
+        """Test that unknown numeric fields are exported with a derived name."""
+        sensor_map = SensorMap(generic=True)
+        families = {}
+
+        sensor_map.add_samples(
+            families,
+            {"newSensorValue": 3, "relayDeviceType": "hub", "flag": True, "time": 1},
+            {"device_id": "1"},
+        )
+
+        assert [(s.name, s.value) for s in samples(families)] == [
+            ("airthings_new_sensor_value", 3.0)
+        ]
+
+    def test_allow_and_deny_lists(self):
+        """Test that sensors are selected by API field or metric name."""
+        sensor_map = SensorMap(generic=True, allow=["temp", "airthings_co2_parts_per_million"])
+        assert sensor_map.lookup("temp", 21.5).metric_name == "airthings_temperature_celsius"
+        assert sensor_map.lookup("co2", 450) is not None
+        assert sensor_map.lookup("humidity", 40) is None
+        assert sensor_map.lookup("newSensor", 1) is None
+
+        sensor_map = SensorMap(generic=True, deny=["rssi", "airthings_new_sensor"])
+        assert sensor_map.lookup("rssi", -60) is None
+        assert sensor_map.lookup("newSensor", 1) is None
+        assert sensor_map.lookup("temp", 21.5) is not None
+
+    def test_metric_names(self):
+        """Test resolving API fields and metric names to metric names."""
+        sensor_map = SensorMap(generic=True)
+        assert sensor_map.metric_names(["temp", "airthings_co2_parts_per_million", "pm10"]) >= {
+            "airthings_temperature_celsius",
+            "airthings_co2_parts_per_million",
+            "airthings_pm10",
+        }
+
+    def test_generic_sensor_name(self):
+        """Test metric names derived from API field names."""
+        assert generic_sensor("pm10").metric_name == "airthings_pm10"
+        assert generic_sensor("outdoorPm25").metric_name == "airthings_outdoor_pm25"
+
+
+def test_benchmark_add_samples_1000_devices(benchmark, mock_device_data):
+    """Benchmark sample generation for a fleet of 1,000 devices."""
+    sensor_map = SensorMap()
+    fleet = [({"device_id": str(i)}, dict(mock_device_data)) for i in range(1000)]
+
+    def add_fleet():
+        families = {}
+        for labels, data in fleet:
+            sensor_map.add_samples(families, data, labels)
+        return families
+
+    families = benchmark(add_fleet)
+    assert len(families) == len(mock_device_data)
+    assert len(samples(families)) == 1000 * len(mock_device_data)
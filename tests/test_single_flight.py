@@ -0,0 +1,85 @@
+import threading
+import time
+from unittest.mock import Mock
+
+import pytest
+
+from airthings.CloudCollector import RateLimitException
+from airthings.SingleFlight import SingleFlight
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestSingleFlight:
+    def test_concurrent_callers_share_one_call(self):
+        """Test that callers arriving during a call wait for its result."""
+        single_flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_call():
+            started.set()
+            release.wait(5)
+            return "result"
+
+        fn = Mock(side_effect=slow_call)
+        results = []
+
+        leader = threading.Thread(target=lambda: results.append(single_flight.do(fn)))
+        leader.start()
+        started.wait(5)
+        followers = [
+            threading.Thread(target=lambda: results.append(single_flight.do(fn))) for _ in range(3)
+        ]
+        for follower in followers:
+            follower.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join()
+
+        fn.assert_called_once()
+        assert results == ["result"] * 4
+        assert single_flight.coalesced == 3
+
+    def test_exception_is_shared(self):
+        """Test that a rate limit raised by the call reaches callers in the window."""
+        clock = FakeClock()
+        single_flight = SingleFlight(window=5, clock=clock)
+        fn = Mock(side_effect=RateLimitException(60, "later"))
+
+        with pytest.raises(RateLimitException):
+            single_flight.do(fn)
+        with pytest.raises(RateLimitException):
+            single_flight.do(fn)
+        fn.assert_called_once()
+
+    def test_result_is_reused_within_window(self):
+        """Test that a finished call is reused only within the window."""
+        clock = FakeClock()
+        single_flight = SingleFlight(window=5, clock=clock)
+        fn = Mock(side_effect=["first", "second"])
+
+        assert single_flight.do(fn) == "first"
+        clock.now = 4.9
+        assert single_flight.do(fn) == "first"
+        clock.now = 5
+        assert single_flight.do(fn) == "second"
+        assert single_flight.coalesced == 1
+
+    def test_window_can_be_overridden_per_call(self):
+        """Test that a call with window=0 only shares calls still in flight."""
+        clock = FakeClock()
+        single_flight = SingleFlight(window=5, clock=clock)
+        fn = Mock(side_effect=["first", "second"])
+
+        assert single_flight.do(fn) == "first"
+        clock.now = 1
+        assert single_flight.do(fn, window=0) == "second"
+        assert single_flight.coalesced == 0
@@ -0,0 +1,49 @@
+import os
+import random
+
+import pytest
+
+from airthings import Snappy
+
+
+class TestSnappy:
+    @pytest.mark.parametrize(
+        "data",
+        [
+            b"",
+            b"a",
+            b"abcd" * 1000,
+            bytes(200000),
+            os.urandom(70000),
+            b'airthings_temperature_celsius{device_id="2930000001"} 22.5\n' * 2000,
+        ],
+    )
+    def test_round_trip(self, data):
+        assert Snappy.decompress(Snappy.compress(data)) == data
+
+    def test_random_round_trips(self):
+        rng = random.Random(1)
+        for _ in range(200):
+            data = bytes(rng.choice(b"abc") for _ in range(rng.randint(0, 3000)))
+            assert Snappy.decompress(Snappy.compress(data)) == data
+
+    def test_compresses_repetitive_data(self):
+        data = b'airthings_co2_parts_per_million{device_id="2930000001"} 450\n' * 1000
+        assert len(Snappy.compress(data)) < len(data) / 10
+
+    @pytest.mark.parametrize(
+        "encoded, data",
+        [
+            # Literal "Wikipedia", then a 2-byte-offset copy of 18 bytes from 9 back
+            ("1b2057696b697065646961460900", b"Wikipedia" * 3),
+            # Literal "a", then an overlapping 1-byte-offset copy of 9 bytes from 1 back
+            ("0a00611501", b"a" * 10),
+        ],
+    )
+    def test_decodes_each_element_type(self, encoded, data):
+        """Test decoding of streams assembled by hand from the format description."""
+        assert Snappy.decompress(bytes.fromhex(encoded)) == data
+
+    def test_corrupt_input(self):
+        with pytest.raises(ValueError):
+            Snappy.decompress(bytes.fromhex("0a0d0a00"))
@@ -0,0 +1,42 @@
+import json
+
+from airthings.StateStore import STATE_VERSION, StateStore
+
+
+class TestStateStore:
+    def test_save_and_load(self, tmp_path):
+        """Test that saved state is loaded back unchanged."""
+        store = StateStore(str(tmp_path / "state.json"))
+        store.save({"generation": 3, "readings": {"device1": {"data": {}, "updated_at": 1.0}}})
+
+        state = store.load()
+        assert state["generation"] == 3
+        assert state["readings"] == {"device1": {"data": {}, "updated_at": 1.0}}
+        assert state["version"] == STATE_VERSION
+        # Only the state file is left behind
+        assert [p.name for p in tmp_path.iterdir()] == ["state.json"]
+
+    def test_missing_file(self, tmp_path):
+        """Test that a missing state file means no state."""
+        assert StateStore(str(tmp_path / "missing.json")).load() is None
+
+    def test_corrupt_or_outdated_file_is_ignored(self, tmp_path):
+        """Test that unreadable files and unknown versions are treated as no state."""
+        path = tmp_path / "state.json"
+        path.write_text("{not json")
+        assert StateStore(str(path)).load() is None
+
+        path.write_text(json.dumps({"version": STATE_VERSION + 1}))
+        assert StateStore(str(path)).load() is None
+
+    def test_failed_save_keeps_previous_state(self, tmp_path):
+        """Test that a save that fails halfway leaves the old file intact."""
+        store = StateStore(str(tmp_path / "state.json"))
+        store.save({"generation": 1})
+
+        try:
+            store.save({"generation": object()})
+        except TypeError:
+            pass
+        assert store.load()["generation"] == 1
+        assert [p.name for p in tmp_path.iterdir()] == ["state.json"]
@@ -0,0 +1,90 @@
+from unittest.mock import Mock
+
+import pytest
+
+from airthings.TokenManager import TokenManager
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTokenManager:
+    def test_get_token_is_cached(self):
+        """Test that the token is fetched once and then served from cache."""
+        fetch_token = Mock(return_value=("token1", 3600))
+        manager = TokenManager(fetch_token, clock=FakeClock())
+
+        assert manager.get_token() == "token1"
+        assert manager.get_token() == "token1"
+        fetch_token.assert_called_once()
+        assert manager.refresh_count == 1
+
+    def test_get_token_refreshes_after_expiry(self):
+        """Test that an expired token is refreshed synchronously."""
+        clock = FakeClock()
+        fetch_token = Mock(side_effect=[("token1", 3600), ("token2", 3600)])
+        manager = TokenManager(fetch_token, clock=clock)
+
+        assert manager.get_token() == "token1"
+        clock.now += 3600
+        assert manager.get_token() == "token2"
+        assert manager.refresh_count == 2
+
+    def test_get_token_refreshes_in_background_near_expiry(self):
+        """Test that a token inside the refresh margin is replaced in the background."""
+        clock = FakeClock()
+        fetch_token = Mock(side_effect=[("token1", 3600), ("token2", 3600)])
+        manager = TokenManager(fetch_token, refresh_margin=300, clock=clock)
+
+        manager.get_token()
+        clock.now += 3400
+        # Still valid, so the old token is served while the refresh runs
+        assert manager.get_token() == "token1"
+        manager._background_refresh.join(timeout=5)
+        assert manager.get_token() == "token2"
+
+    def test_invalidate_only_clears_matching_token(self):
+        """Test that invalidating a stale token keeps a newer one."""
+        fetch_token = Mock(side_effect=[("token1", 3600), ("token2", 3600)])
+        manager = TokenManager(fetch_token, clock=FakeClock())
+
+        manager.get_token()
+        manager.invalidate("other_token")
+        assert manager.get_token() == "token1"
+        manager.invalidate("token1")
+        assert manager.get_token() == "token2"
+
+    def test_token_age(self):
+        """Test token age reporting."""
+        clock = FakeClock()
+        manager = TokenManager(Mock(return_value=("token1", 3600)), clock=clock)
+
+        assert manager.token_age() is None
+        manager.get_token()
+        clock.now += 42
+        assert manager.token_age() == 42
+
+    def test_export_and_restore(self):
+        """Test that an exported token is reused after a restart until it expires."""
+        clock = FakeClock()
+        manager = TokenManager(Mock(return_value=("token1", 3600)), clock=clock)
+        manager.get_token()
+        clock.now += 60
+        access_token, expires_at, fetched_at = manager.export()
+        assert access_token == "token1"
+
+        fetch_token = Mock(return_value=("token2", 3600))
+        restored = TokenManager(fetch_token, clock=FakeClock())
+        restored.restore(access_token, expires_at, fetched_at)
+        assert restored.get_token() == "token1"
+        assert restored.token_age() == pytest.approx(60, abs=1)
+        fetch_token.assert_not_called()
+
+        expired = TokenManager(fetch_token, clock=FakeClock())
+        expired.restore(access_token, 0)
+        assert expired.export() is None